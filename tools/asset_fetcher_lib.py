@@ -0,0 +1,5275 @@
+"""
+Asset Fetcher's implementation; tools/asset_fetcher.py is the command-line
+entry point and documents usage.
+
+The code lives in this importable module, rather than in the script, so
+Python caches its bytecode: a script run directly is compiled from source
+on every call.
+"""
+
+import contextlib
+import contextvars
+import io
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+
+SECRETS_DIR = Path.home() / ".claude" / "secrets"
+OPENAI_KEY_FILE = SECRETS_DIR / "openai_api_key"
+
+# Download cache location (--cache-dir / $ASSET_FETCHER_CACHE)
+CACHE_DIR = Path(os.environ.get("ASSET_FETCHER_CACHE",
+                                Path.home() / ".cache" / "asset_fetcher"))
+
+# License-safe audio sources
+AUDIO_SOURCES = {
+    "pixabay": {
+        "name": "Pixabay",
+        "license": "Pixabay License — royalty-free, no attribution, commercial OK",
+        "search_url": "https://pixabay.com/sound-effects/search/{query}/",
+    },
+    "freesound": {
+        "name": "Freesound CC0",
+        "license": "CC0 Public Domain — no restrictions",
+        "search_url": "https://freesound.org/search/?q={query}&f=license:%22Creative+Commons+0%22&s=rating+desc",
+    },
+}
+
+
+# Sound pages fetched side by side when a search only returns page links,
+# and the read timeout for each
+PAGE_HEDGE_COUNT = 3
+PAGE_TIMEOUT = 10.0
+
+# Search results probed when an audio entry sets max_duration, max_bytes or
+# mono, and how much of each file's head is fetched for ffprobe
+PROBE_COUNT = 5
+PROBE_BYTES = 32 * 1024
+
+# Downloads are streamed to disk in chunks of this size (--chunk-size)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Default per-kind concurrency caps for `batch --jobs N`. "search" and
+# "download" share the batch worker pool; "image" caps DALL-E requests in
+# flight on the image pipeline (at any --jobs); "convert" runs ffmpeg on its
+# own pool, and sizes the process pool for NumPy post-processing, to the core
+# count unless overridden.
+DEFAULT_LIMITS = {
+    "image": 2,
+    "search": 4,
+    "download": 8,
+    "convert": os.cpu_count() or 1,
+}
+
+# DALL-E 3 requests started per minute (--image-rate). Up to this many start
+# at once, then they are spaced evenly; the right figure depends on the
+# account's rate-limit tier. Failed requests (429, 5xx, connection errors)
+# are retried with exponential backoff and full jitter.
+IMAGE_RATE_PER_MINUTE = 5
+IMAGE_MAX_ATTEMPTS = 6
+IMAGE_BACKOFF_BASE = 2.0
+IMAGE_BACKOFF_MAX = 60.0
+
+
+# ---------------------------------------------------------------------------
+# Concurrency
+# ---------------------------------------------------------------------------
+
+# Active only while a concurrent batch is running; serial callers see no limits.
+_limits: dict[str, threading.BoundedSemaphore] = {}
+_convert_pool = None
+_cpu_pool = None
+
+
+@contextlib.contextmanager
+def _limit(kind: str):
+    """Hold a slot of the given kind for the duration of the block."""
+    sem = _limits.get(kind)
+    if sem is None:
+        yield
+        return
+    with sem:
+        yield
+
+
+@contextlib.contextmanager
+def concurrent_pools(jobs: int, limits: dict | None = None):
+    """Set up the network worker pool and the ffmpeg pool for a batch run.
+
+    Yields the network pool. While the block is active, search_audio and
+    download_file respect the per-kind limits, convert_with_ffmpeg hands
+    its work to the convert pool and run_cpu to a process pool.
+    """
+    global _convert_pool, _cpu_pool
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    caps = {**DEFAULT_LIMITS, **(limits or {})}
+    _limits.clear()
+    for kind, n in caps.items():
+        # ffmpeg slots are not capped by the network job count
+        _limits[kind] = threading.BoundedSemaphore(max(1, n if kind == "convert" else min(n, jobs)))
+
+    net_pool = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="net")
+    _convert_pool = ThreadPoolExecutor(max_workers=max(1, caps["convert"]),
+                                       thread_name_prefix="ffmpeg")
+    # Workers start on first use; spawn, since forking a threaded process is unsafe
+    _cpu_pool = ProcessPoolExecutor(max_workers=max(1, caps["convert"]),
+                                    mp_context=multiprocessing.get_context("spawn"))
+    try:
+        yield net_pool
+    finally:
+        net_pool.shutdown(wait=True, cancel_futures=True)
+        _convert_pool.shutdown(wait=True)
+        _convert_pool = None
+        _cpu_pool.shutdown(wait=True)
+        _cpu_pool = None
+        _limits.clear()
+
+
+def run_cpu(fn, *args, **kwargs):
+    """Run CPU-bound work (NumPy post-processing) on the batch's process pool, if any.
+
+    fn must be a module-level function and its arguments and result picklable.
+    """
+    if _cpu_pool is None:
+        return fn(*args, **kwargs)
+    return _cpu_pool.submit(fn, *args, **kwargs).result()
+
+
+def parse_limits(specs: list[str] | None) -> dict:
+    """Parse repeated KIND=N options into a limits dict."""
+    import argparse
+    limits = {}
+    for spec in specs or []:
+        kind, sep, value = spec.partition("=")
+        if not sep or kind not in DEFAULT_LIMITS or not value.isdigit() or int(value) < 1:
+            raise argparse.ArgumentTypeError(
+                f"bad limit '{spec}' — expected KIND=N with KIND in {', '.join(DEFAULT_LIMITS)}")
+        limits[kind] = int(value)
+    return limits
+
+
+# ---------------------------------------------------------------------------
+# Per-asset notes
+# ---------------------------------------------------------------------------
+
+# Details gathered while one asset is built (resolved source URL, conversion
+# arguments, ...). Batch mode opens a notes dict per entry; outside of one,
+# _note is a no-op.
+_asset_notes = contextvars.ContextVar("asset_notes", default=None)
+
+
+@contextlib.contextmanager
+def asset_notes():
+    """Collect notes about the asset built inside the block."""
+    notes = {}
+    token = _asset_notes.set(notes)
+    try:
+        yield notes
+    finally:
+        _asset_notes.reset(token)
+
+
+def _note(key: str, value):
+    notes = _asset_notes.get()
+    if notes is not None:
+        notes[key] = value
+
+
+# Set while `watch` builds an entry; once the entry is edited again the
+# build stops at its next download or pipe chunk (see check_cancelled)
+_build_cancelled = contextvars.ContextVar("build_cancelled", default=None)
+
+
+class BuildCancelled(Exception):
+    """The asset being built was superseded before it finished."""
+
+
+class AssetError(Exception):
+    """An asset could not be fetched or converted; the message says why.
+
+    A one-shot command prints it and exits 1; batch and watch record it as
+    the entry's error and go on.
+    """
+
+
+def check_cancelled():
+    """Raise BuildCancelled if the current build has been superseded; else a no-op."""
+    event = _build_cancelled.get()
+    if event is not None and event.is_set():
+        raise BuildCancelled("superseded by a newer edit")
+
+
+# ---------------------------------------------------------------------------
+# Tracing
+# ---------------------------------------------------------------------------
+
+# Each phase() block becomes a span: appended to the current asset's notes
+# under "phases" and, while a trace is open (batch --trace), kept as a
+# Chrome trace event. self_seconds is the span's time minus its children.
+_current_span = contextvars.ContextVar("current_span", default=None)
+_trace_lock = threading.Lock()
+_trace_events: list[dict] | None = None
+_trace_origin = time.perf_counter()
+
+
+@contextlib.contextmanager
+def phase(name: str, **fields):
+    """Time the block (or, as a decorator, each call) as one span.
+
+    Yields the span dict; code further down the stack adds fields and
+    counters (bytes, retries, ...) with _span_note and _span_count.
+    """
+    span = {"phase": name, **fields}
+    parent = _current_span.get()
+    token = _current_span.set(span)
+    start = time.perf_counter()
+    try:
+        yield span
+    except BaseException as e:
+        span["error"] = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _current_span.reset(token)
+        with _trace_lock:
+            children = span.pop("_children", 0.0)
+            span["start"] = round(start - _trace_origin, 4)
+            span["seconds"] = round(seconds, 4)
+            # A hedged request can outlive the span that started it
+            if parent is not None and "seconds" not in parent:
+                parent["_children"] = parent.get("_children", 0.0) + seconds
+        # Children running side by side can add up to more than the parent
+        span["self_seconds"] = round(max(0.0, seconds - children), 4)
+        notes = _asset_notes.get()
+        if notes is not None:
+            notes.setdefault("phases", []).append(span)
+        if _trace_events is not None:
+            thread = threading.current_thread()
+            args = {k: v for k, v in span.items()
+                    if k not in ("phase", "start", "seconds", "self_seconds")}
+            if notes is not None and "asset" in notes:
+                args["asset"] = notes["asset"]
+            with _trace_lock:
+                _trace_events.append({
+                    "name": name, "cat": name, "ph": "X", "pid": os.getpid(),
+                    "tid": thread.ident, "thread": thread.name,
+                    "ts": round((start - _trace_origin) * 1e6),
+                    "dur": round(seconds * 1e6), "args": args,
+                })
+
+
+def _span_note(key: str, value):
+    """Set a field on the innermost open span, if any."""
+    span = _current_span.get()
+    if span is not None:
+        span[key] = value
+
+
+def _span_count(key: str, n: int = 1):
+    """Add n to a counter on the innermost open span, if any."""
+    span = _current_span.get()
+    if span is not None:
+        span[key] = span.get(key, 0) + n
+
+
+def start_trace(keep_events: bool = False):
+    """Restart the span clock; with keep_events, collect events for write_trace."""
+    global _trace_events, _trace_origin
+    _trace_origin = time.perf_counter()
+    _trace_events = [] if keep_events else None
+
+
+def write_trace(path: str):
+    """Write the collected events as a Chrome/Perfetto trace and stop tracing."""
+    global _trace_events
+    events, _trace_events = _trace_events or [], None
+    threads = {}
+    for event in events:
+        threads[event["tid"]] = event.pop("thread")
+    meta = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+             "args": {"name": name}} for tid, name in threads.items()]
+    Path(path).write_text(json.dumps({"traceEvents": meta + events, "displayTimeUnit": "ms"}))
+
+
+class PhaseTotals:
+    """Running per-phase totals of spans, so a long batch needn't keep them all.
+
+    p95 comes from a fixed-size random sample of each phase's durations.
+    """
+
+    def __init__(self, sample: int = 1024):
+        import random
+        self.sample = sample
+        self._rows = {}
+        self._random = random.Random(0)
+
+    def add(self, spans: list[dict]):
+        for span in spans:
+            row = self._rows.setdefault(span["phase"], {
+                "phase": span["phase"], "count": 0, "seconds": 0.0, "self_seconds": 0.0,
+                "bytes": 0, "retries": 0, "durations": []})
+            row["count"] += 1
+            row["seconds"] += span["seconds"]
+            row["self_seconds"] += span["self_seconds"]
+            row["bytes"] += span.get("bytes", 0)
+            row["retries"] += span.get("retries", 0)
+            durations = row["durations"]
+            if len(durations) < self.sample:
+                durations.append(span["seconds"])
+            elif (i := self._random.randrange(row["count"])) < self.sample:
+                durations[i] = span["seconds"]
+
+    def __bool__(self) -> bool:
+        return bool(self._rows)
+
+    def top(self, n: int = 6) -> list[dict]:
+        """Phases by self time, largest first."""
+        rows = []
+        for row in self._rows.values():
+            durations = sorted(row["durations"])
+            rows.append({**{k: v for k, v in row.items() if k != "durations"},
+                         "p95": durations[min(len(durations) - 1, int(len(durations) * 0.95))]})
+        rows.sort(key=lambda r: -r["self_seconds"])
+        return rows[:n]
+
+
+def hot_spots(spans: list[dict], top: int = 6) -> list[dict]:
+    """Aggregate spans per phase, largest self time first."""
+    totals = PhaseTotals()
+    totals.add(spans)
+    return totals.top(top)
+
+
+# ---------------------------------------------------------------------------
+# HTTP session
+# ---------------------------------------------------------------------------
+
+BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+                  "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+    "Upgrade-Insecure-Requests": "1",
+}
+
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class HTTPResponse:
+    """A response whose connection goes back to the pool once it is closed."""
+
+    def __init__(self, session, key, conn, resp, url):
+        self._session = session
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.url = url
+        self.status = resp.status
+        self.headers = resp.headers
+
+    def read(self, amt: int | None = None) -> bytes:
+        return self._resp.read(amt)
+
+    def close(self):
+        if self._conn is None:
+            return
+        resp, conn = self._resp, self._conn
+        self._conn = None
+        # Drain small leftovers so the connection can be reused
+        if not resp.isclosed() and not resp.chunked and (resp.length or 0) <= 64 * 1024:
+            try:
+                resp.read()
+            except OSError:
+                pass
+        if resp.isclosed() and not resp.will_close:
+            self._session._release(self._key, conn)
+        else:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HTTPSession:
+    """Keep-alive HTTP client with per-host connection pools.
+
+    All requests share one cookie jar, so cookies set by a search page are
+    sent on the slug-page and CDN requests that follow. Connections are
+    returned to their host's pool once a response has been read in full.
+
+    host_overrides maps a hostname to "addr:port"; requests for that host
+    go there over plain HTTP instead. Only the benchmarks set it, to point
+    the tool at a local stand-in server (see tools/benchmarks), so targets
+    must be loopback addresses.
+    """
+
+    def __init__(self, connect_timeout: float = 10.0, read_timeout: float = 30.0,
+                 max_idle_per_host: int = 8, host_overrides: dict | None = None):
+        import http.cookiejar
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.host_overrides = dict(host_overrides or {})
+        for host, target in self.host_overrides.items():
+            if not _is_loopback(target.rpartition(":")[0] or target):
+                raise ValueError(f"host override {host}={target}: plain HTTP is only "
+                                 "allowed to a loopback address")
+        self.cookies = http.cookiejar.CookieJar()
+        self.stats = {"requests": 0, "connections_opened": 0, "connections_reused": 0}
+        self._idle: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    def _connect(self, key: tuple, timeout: float | None):
+        import http.client
+        scheme, host, port = key
+        if scheme == "https":
+            if self._ssl_context is None:
+                import ssl
+                self._ssl_context = ssl.create_default_context()
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout,
+                                               context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(timeout or self.read_timeout)
+        with self._lock:
+            self.stats["connections_opened"] += 1
+        return conn
+
+    def _acquire(self, key: tuple, timeout: float | None):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                conn = idle.pop()
+                self.stats["connections_reused"] += 1
+                conn.sock.settimeout(timeout or self.read_timeout)
+                return conn, True
+        return self._connect(key, timeout), False
+
+    def _release(self, key: tuple, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host and conn.sock is not None:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def open(self, url: str, headers: dict | None = None, method: str = "GET",
+             timeout: float | None = None, max_redirects: int = 5) -> HTTPResponse:
+        """Send a request and return the response with its body unread.
+
+        Follows redirects. Raises urllib.error.HTTPError for 4xx/5xx, like
+        urlopen does.
+        """
+        import http.client
+        import urllib.error
+        import urllib.request
+
+        # Errors that mean a pooled keep-alive connection went stale between requests
+        stale_errors = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                        ConnectionResetError, BrokenPipeError)
+        for _ in range(max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            scheme = parts.scheme.lower()
+            if scheme not in ("http", "https"):
+                raise ValueError(f"unsupported URL scheme: {url}")
+            key = (scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80))
+            path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+
+            # Let the cookie jar see a urllib Request so it can add and collect cookies
+            ureq = urllib.request.Request(url, headers={**BROWSER_HEADERS, **(headers or {})},
+                                          method=method)
+            self.cookies.add_cookie_header(ureq)
+            req_headers = dict(ureq.header_items())
+
+            override = self.host_overrides.get(parts.hostname)
+            if override:
+                # Plain HTTP to the stand-in, with the original Host header
+                host, _, port = override.partition(":")
+                key = ("http", host, int(port or 80))
+                req_headers["Host"] = parts.netloc
+
+            conn, reused = self._acquire(key, timeout)
+            try:
+                conn.request(method, path, headers=req_headers)
+                resp = conn.getresponse()
+            except stale_errors:
+                conn.close()
+                if not reused:
+                    raise
+                # The server dropped an idle connection; retry once on a fresh one
+                conn = self._connect(key, timeout)
+                try:
+                    conn.request(method, path, headers=req_headers)
+                    resp = conn.getresponse()
+                except BaseException:
+                    conn.close()
+                    raise
+            except BaseException:
+                conn.close()
+                raise
+
+            with self._lock:
+                self.stats["requests"] += 1
+            self.cookies.extract_cookies(resp, ureq)
+            response = HTTPResponse(self, key, conn, resp, url)
+
+            location = resp.getheader("Location")
+            if resp.status in _REDIRECT_CODES and location:
+                response.close()
+                url = urllib.parse.urljoin(url, location)
+                if resp.status == 303 or (resp.status in (301, 302) and method != "HEAD"):
+                    method = "GET"
+                continue
+
+            if resp.status >= 400:
+                body = resp.read()
+                response.close()
+                raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers,
+                                             io.BytesIO(body))
+            return response
+
+        raise urllib.error.HTTPError(url, 310, "Too many redirects", None, None)
+
+    def get(self, url: str, accept: str = "*/*", timeout: float | None = None) -> bytes:
+        """GET a URL and return the whole body."""
+        with self.open(url, headers={"Accept": accept}, timeout=timeout) as resp:
+            return resp.read()
+
+    def close(self):
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for idle in pools.values():
+            for conn in idle:
+                conn.close()
+
+
+_http_session: HTTPSession | None = None
+_http_session_lock = threading.Lock()
+
+
+def _session() -> HTTPSession:
+    """Return the process-wide HTTP session, creating it on first use."""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = HTTPSession()
+        return _http_session
+
+
+def _is_loopback(host: str) -> bool:
+    import ipaddress
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError:
+        return False
+
+
+def configure_http(connect_timeout: float | None = None, read_timeout: float | None = None):
+    """Set timeouts on the shared HTTP session."""
+    session = _session()
+    if connect_timeout is not None:
+        session.connect_timeout = connect_timeout
+    if read_timeout is not None:
+        session.read_timeout = read_timeout
+
+
+# Progress lines only make sense for a single download on a terminal
+_show_progress = False
+
+
+def configure_downloads(chunk_size: int | None = None, show_progress: bool | None = None):
+    """Set the streaming buffer size and whether download_file prints progress."""
+    global DOWNLOAD_CHUNK_SIZE, _show_progress
+    if chunk_size:
+        DOWNLOAD_CHUNK_SIZE = chunk_size
+    if show_progress is not None:
+        _show_progress = show_progress
+
+
+def http_stats() -> dict:
+    """Request and connection counters for the shared HTTP session."""
+    session = _session()
+    with session._lock:
+        return dict(session.stats)
+
+
+# ---------------------------------------------------------------------------
+# Download cache
+# ---------------------------------------------------------------------------
+
+# ioctl that makes dst share src's blocks copy-on-write (btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+
+def _copy_file(src, dst):
+    """Copy src to dst as a file of its own: reflinked where the filesystem can, else copied.
+
+    Never a hard link, so editing either file leaves the other alone.
+    """
+    import shutil
+
+    if sys.platform == "linux":
+        import fcntl
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+    shutil.copyfile(src, dst)
+
+
+class DownloadCache:
+    """Content-addressed on-disk cache for downloaded files.
+
+    Bodies live under objects/ named by their SHA-256, so two URLs serving
+    the same bytes share one file. index.json maps each URL to its object
+    plus the validators (ETag / Last-Modified) and freshness deadline from
+    the response. Fresh entries are served with no network call; stale ones
+    are revalidated with a conditional request. When the objects exceed
+    max_size, the least recently used ones are evicted.
+    """
+
+    def __init__(self, root: Path, max_size: int = 2 * 1024 ** 3,
+                 default_ttl: float = 24 * 3600):
+        self.root = Path(root)
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self._index = None
+
+    # -- index -------------------------------------------------------------
+
+    @property
+    def _index_path(self) -> Path:
+        return self.root / "index.json"
+
+    def _urls(self) -> dict:
+        if self._index is None:
+            try:
+                self._index = json.loads(self._index_path.read_text())
+            except (OSError, ValueError):
+                self._index = {}
+            self._index.setdefault("urls", {})
+        return self._index["urls"]
+
+    def _save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self._index_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self._index, indent=1))
+        os.replace(tmp, self._index_path)
+
+    def object_path(self, sha256: str) -> Path:
+        return self.root / "objects" / sha256[:2] / sha256
+
+    # -- lookups -----------------------------------------------------------
+
+    def lookup(self, url: str) -> dict | None:
+        """Return the index entry for url if its object is still on disk, at its recorded size."""
+        with self._lock:
+            entry = self._urls().get(url)
+            if entry:
+                obj = self.object_path(entry["sha256"])
+                if obj.exists() and obj.stat().st_size == entry["size"]:
+                    return dict(entry)
+                # Damaged (e.g. hard-linked to an output by an older version, then
+                # edited): drop it so the next store writes it afresh
+                obj.unlink(missing_ok=True)
+        return None
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() < entry.get("expires", 0)
+
+    def conditional_headers(self, entry: dict) -> dict:
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def materialize(self, url: str, entry: dict, output: Path, revalidated: bool = False,
+                    headers=None):
+        """Copy a cached object to output and record the use.
+
+        output is replaced rather than written through, so a hard link left
+        by an older version is broken instead of changing the object.
+        """
+        tmp = output.with_name(output.name + ".part")
+        _copy_file(self.object_path(entry["sha256"]), tmp)
+        os.replace(tmp, output)
+        self.record_use(url, revalidated, headers)
+
+    def record_use(self, url: str, revalidated: bool = False, headers=None):
+        """Count a hit (or revalidation) and bump the entry's LRU timestamp."""
+        with self._lock:
+            self.stats["revalidated" if revalidated else "hits"] += 1
+            current = self._urls().get(url)
+            if current is not None:
+                current["last_used"] = time.time()
+                if headers is not None:
+                    current["expires"] = self._expires(headers)
+                self._save()
+
+    # -- storing -----------------------------------------------------------
+
+    def _expires(self, headers) -> float:
+        """Freshness deadline from Cache-Control / Expires, else the default TTL."""
+        now = time.time()
+        cache_control = (headers.get("Cache-Control") or "").lower()
+        if "no-cache" in cache_control:
+            return now
+        m = re.search(r"max-age=(\d+)", cache_control)
+        if m:
+            return now + int(m.group(1))
+        if headers.get("Expires"):
+            import email.utils
+            try:
+                return email.utils.parsedate_to_datetime(headers["Expires"]).timestamp()
+            except (TypeError, ValueError):
+                return now
+        return now + self.default_ttl
+
+    def store(self, url: str, path: Path, sha256: str, headers, scratch: bool = False):
+        """Add a downloaded file to the cache under url.
+
+        The object is a copy, so editing the delivered file cannot change
+        it. A scratch path (a private temp file about to be deleted) is
+        hard-linked instead where the filesystem allows.
+        """
+        with self._lock:
+            self.stats["misses"] += 1
+        if "no-store" in (headers.get("Cache-Control") or "").lower():
+            return
+        obj = self.object_path(sha256)
+        if not obj.exists():
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            tmp = obj.with_suffix(f".{threading.get_ident()}.tmp")
+            try:
+                if not scratch:
+                    raise OSError
+                os.link(path, tmp)
+            except OSError:
+                _copy_file(path, tmp)
+            os.replace(tmp, obj)
+        with self._lock:
+            self._urls()[url] = {
+                "sha256": sha256,
+                "size": obj.stat().st_size,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "expires": self._expires(headers),
+                "last_used": time.time(),
+            }
+            self._evict(self.max_size)
+            self._save()
+
+    # -- maintenance -------------------------------------------------------
+
+    def _objects(self) -> dict:
+        """sha256 -> (size, last_used) over every indexed object."""
+        objects = {}
+        for entry in self._urls().values():
+            size, last_used = objects.get(entry["sha256"], (entry["size"], 0))
+            objects[entry["sha256"]] = (size, max(last_used, entry.get("last_used", 0)))
+        return objects
+
+    def _evict(self, max_size: int) -> tuple[int, int]:
+        objects = self._objects()
+        total = sum(size for size, _ in objects.values())
+        removed = freed = 0
+        for sha, (size, _) in sorted(objects.items(), key=lambda kv: kv[1][1]):
+            if total <= max_size:
+                break
+            self.object_path(sha).unlink(missing_ok=True)
+            urls = self._urls()
+            for url in [u for u, e in urls.items() if e["sha256"] == sha]:
+                del urls[url]
+            total -= size
+            freed += size
+            removed += 1
+        return removed, freed
+
+    def prune(self, max_size: int | None = None) -> tuple[int, int]:
+        """Evict least recently used objects until the cache fits max_size.
+
+        Also drops index entries whose object has gone missing. Returns
+        (objects removed, bytes freed).
+        """
+        with self._lock:
+            urls = self._urls()
+            for url in [u for u, e in urls.items() if not self.object_path(e["sha256"]).exists()]:
+                del urls[url]
+            result = self._evict(self.max_size if max_size is None else max_size)
+            self._save()
+        return result
+
+    def summary(self) -> dict:
+        with self._lock:
+            objects = self._objects()
+            return {
+                "root": str(self.root),
+                "urls": len(self._urls()),
+                "objects": len(objects),
+                "bytes": sum(size for size, _ in objects.values()),
+                "max_size": self.max_size,
+                **self.stats,
+            }
+
+
+_download_cache: DownloadCache | None = None
+_download_cache_lock = threading.Lock()
+_cache_enabled = True
+
+
+def _cache() -> DownloadCache | None:
+    """Return the shared download cache, or None when caching is off."""
+    global _download_cache
+    if not _cache_enabled:
+        return None
+    with _download_cache_lock:
+        if _download_cache is None:
+            _download_cache = DownloadCache(CACHE_DIR)
+        return _download_cache
+
+
+def configure_cache(enabled: bool | None = None, root: str | None = None,
+                    max_size_mb: int | None = None, transcode_max_size_mb: int | None = None):
+    """Turn the download and transcode caches on/off, move them, or change their size caps."""
+    global _cache_enabled, _download_cache, CACHE_DIR
+    if enabled is not None:
+        _cache_enabled = enabled
+    if root:
+        CACHE_DIR = Path(root).expanduser()
+        _download_cache = None
+    cache = _cache()
+    if cache is not None and max_size_mb is not None:
+        cache.max_size = max_size_mb * 1024 ** 2
+    transcodes = _transcode_cache()
+    if transcodes is not None and transcode_max_size_mb is not None:
+        transcodes.max_size = transcode_max_size_mb * 1024 ** 2
+
+
+# ---------------------------------------------------------------------------
+# Transcode cache
+# ---------------------------------------------------------------------------
+
+class TranscodeCache:
+    """ffmpeg results on disk, so an unchanged conversion never runs twice.
+
+    Keyed by transcode_key: the source's SHA-256, the ffmpeg command with
+    the paths left out, and `ffmpeg -version`. Each key maps to the output
+    objects (under objects/ by SHA-256), any analysis results, and the CPU
+    time the conversion took. Objects and the outputs restored from them are
+    copies (see _copy_file), so editing a converted asset never changes the
+    cache; least recently used keys are evicted past max_size.
+    """
+
+    def __init__(self, root: Path, max_size: int = 1024 ** 3):
+        self.root = Path(root)
+        self.max_size = max_size
+        self.stats = {"hits": 0, "misses": 0, "cpu_saved": 0.0}
+        self._lock = threading.Lock()
+        self._index = None
+
+    @property
+    def _index_path(self) -> Path:
+        return self.root / "index.json"
+
+    def _keys(self) -> dict:
+        if self._index is None:
+            try:
+                self._index = json.loads(self._index_path.read_text())
+            except (OSError, ValueError):
+                self._index = {}
+            self._index.setdefault("keys", {})
+        return self._index["keys"]
+
+    def _save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self._index_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self._index, indent=1))
+        os.replace(tmp, self._index_path)
+
+    def object_path(self, sha256: str) -> Path:
+        return self.root / "objects" / sha256[:2] / sha256
+
+    def restore(self, key: str, outputs: list[dict]) -> bool:
+        """Put the cached results for key in place; False (a miss) if there are none.
+
+        An object missing or no longer at its recorded size is a miss.
+        """
+        with self._lock:
+            entry = self._keys().get(key)
+            if (not entry or len(entry["outputs"]) != len(outputs)
+                    or not all(self._intact(o) for o in entry["outputs"])):
+                return False
+            entry["last_used"] = time.time()
+            self.stats["hits"] += 1
+            self.stats["cpu_saved"] += entry["cpu_seconds"]
+            self._save()
+        for out, cached in zip(outputs, entry["outputs"]):
+            for field in ("filter", "analysis"):
+                if field in cached:
+                    out[field] = cached[field]
+            target = Path(out["path"])
+            tmp = target.with_name(target.name + ".part")
+            tmp.unlink(missing_ok=True)
+            _copy_file(self.object_path(cached["sha256"]), tmp)
+            os.replace(tmp, target)
+        return True
+
+    def _intact(self, cached: dict) -> bool:
+        obj = self.object_path(cached["sha256"])
+        return obj.exists() and obj.stat().st_size == cached["size"]
+
+    def store(self, key: str, outputs: list[dict], cpu_seconds: float):
+        """Add copies of the files a conversion just wrote under key."""
+        cached = []
+        for out in outputs:
+            sha256 = _file_sha256(out["path"])
+            obj = self.object_path(sha256)
+            if not (obj.exists() and obj.stat().st_size == os.path.getsize(out["path"])):
+                obj.parent.mkdir(parents=True, exist_ok=True)
+                tmp = obj.with_suffix(f".{threading.get_ident()}.tmp")
+                _copy_file(out["path"], tmp)
+                os.replace(tmp, obj)
+            cached.append({"sha256": sha256, "size": obj.stat().st_size,
+                           **{k: out[k] for k in ("filter", "analysis") if k in out}})
+        with self._lock:
+            self.stats["misses"] += 1
+            self._keys()[key] = {"outputs": cached, "cpu_seconds": round(cpu_seconds, 3),
+                                 "last_used": time.time()}
+            self._evict(self.max_size)
+            self._save()
+
+    def _objects(self) -> dict:
+        """sha256 -> (size, last_used) over every cached output."""
+        objects = {}
+        for entry in self._keys().values():
+            for out in entry["outputs"]:
+                size, last_used = objects.get(out["sha256"], (out["size"], 0))
+                objects[out["sha256"]] = (size, max(last_used, entry["last_used"]))
+        return objects
+
+    def _evict(self, max_size: int) -> tuple[int, int]:
+        keys = self._keys()
+        objects = self._objects()
+        total = sum(size for size, _ in objects.values())
+        removed = freed = 0
+        for key, entry in sorted(keys.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= max_size:
+                break
+            del keys[key]
+            removed += 1
+            still_used = self._objects()
+            for out in entry["outputs"]:
+                if out["sha256"] in objects and out["sha256"] not in still_used:
+                    self.object_path(out["sha256"]).unlink(missing_ok=True)
+                    del objects[out["sha256"]]
+                    total -= out["size"]
+                    freed += out["size"]
+        return removed, freed
+
+    def prune(self, max_size: int | None = None) -> tuple[int, int]:
+        """Evict least recently used conversions until the cache fits max_size.
+
+        Returns (conversions removed, bytes freed).
+        """
+        with self._lock:
+            result = self._evict(self.max_size if max_size is None else max_size)
+            self._save()
+        return result
+
+    def summary(self) -> dict:
+        with self._lock:
+            objects = self._objects()
+            return {
+                "root": str(self.root),
+                "conversions": len(self._keys()),
+                "bytes": sum(size for size, _ in objects.values()),
+                "max_size": self.max_size,
+                "cpu_seconds": sum(e["cpu_seconds"] for e in self._keys().values()),
+                **self.stats,
+            }
+
+
+_transcode_cache_instance: TranscodeCache | None = None
+_ffmpeg_version: str | None = None
+
+
+def _transcode_cache() -> TranscodeCache | None:
+    """Return the shared transcode cache (under the download cache's root), or None."""
+    global _transcode_cache_instance
+    if not _cache_enabled:
+        return None
+    with _download_cache_lock:
+        current, root = _transcode_cache_instance, CACHE_DIR / "transcodes"
+        if current is None or current.root != root:
+            _transcode_cache_instance = TranscodeCache(root, current.max_size if current
+                                                       else 1024 ** 3)
+        return _transcode_cache_instance
+
+
+def ffmpeg_version() -> str:
+    """Output of `ffmpeg -version`, read once per process."""
+    import subprocess
+
+    global _ffmpeg_version
+    if _ffmpeg_version is None:
+        result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
+        _ffmpeg_version = result.stdout
+    return _ffmpeg_version
+
+
+def transcode_key(source_sha256: str, outputs: list[dict]) -> str:
+    """Cache key for converting a source to outputs with the installed ffmpeg.
+
+    Output paths become placeholders (keeping the extension, which picks
+    the muxer); analysis requests stand in for the filters they produce.
+    """
+    import hashlib
+
+    key = {"source": source_sha256, **output_signature(outputs), "ffmpeg": ffmpeg_version()}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def output_signature(outputs: list[dict]) -> dict:
+    """What outputs' bytes depend on besides the source: the command, minus paths."""
+    placeholders = [{**out, "path": f"out{i}{Path(out['path']).suffix}"}
+                    for i, out in enumerate(outputs)]
+    command = ffmpeg_command("in", [{k: v for k, v in out.items() if k != "filter"}
+                                    for out in placeholders])
+    return {"command": command, "analyze": [out.get("analyze") for out in outputs]}
+
+
+# ---------------------------------------------------------------------------
+# Search cache
+# ---------------------------------------------------------------------------
+
+class SearchCache:
+    """Parsed search results on disk, keyed by (source, normalized query).
+
+    Entries older than ttl seconds are ignored. Only non-empty results from
+    successful requests are stored, so a blocked or failed scrape is retried
+    on the next call.
+    """
+
+    def __init__(self, path: Path, ttl: float = 24 * 3600):
+        self.path = Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = None
+
+    @staticmethod
+    def key(source: str, query: str) -> str:
+        return f"{source}:{' '.join(query.lower().split())}"
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, source: str, query: str) -> list[dict] | None:
+        with self._lock:
+            entry = self._load().get(self.key(source, query))
+        if entry and time.time() - entry["fetched_at"] < self.ttl:
+            return entry["results"]
+        return None
+
+    def put(self, source: str, query: str, results: list[dict]):
+        with self._lock:
+            entries = self._load()
+            entries[self.key(source, query)] = {"fetched_at": time.time(), "results": results}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(entries, indent=1))
+            os.replace(tmp, self.path)
+
+    def prune(self) -> int:
+        """Drop expired entries; returns how many were removed."""
+        with self._lock:
+            entries = self._load()
+            now = time.time()
+            expired = [k for k, e in entries.items() if now - e["fetched_at"] >= self.ttl]
+            for k in expired:
+                del entries[k]
+            if expired:
+                tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(entries, indent=1))
+                os.replace(tmp, self.path)
+        return len(expired)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._load())
+
+
+_search_cache: SearchCache | None = None
+_search_refresh = False
+# In-process single flight: identical searches in one run share one request,
+# even with --refresh
+_search_flights: dict = {}
+_search_flights_lock = threading.Lock()
+search_stats = {"cached": 0, "fetched": 0, "deduped": 0}
+
+
+def configure_search_cache(ttl: float | None = None, refresh: bool | None = None):
+    """Set the search cache TTL (seconds) and whether to bypass it."""
+    global _search_refresh
+    if ttl is not None:
+        _search_cache_instance().ttl = ttl
+    if refresh is not None:
+        _search_refresh = refresh
+
+
+def _search_cache_instance() -> SearchCache:
+    global _search_cache
+    with _search_flights_lock:
+        if _search_cache is None or _search_cache.path.parent != CACHE_DIR:
+            ttl = _search_cache.ttl if _search_cache else 24 * 3600
+            _search_cache = SearchCache(CACHE_DIR / "search.json", ttl)
+        return _search_cache
+
+
+def cached_search(source: str, query: str, scrape) -> list[dict]:
+    """Run scrape(query) unless a fresh cached or in-flight result exists.
+
+    Returns a copy of the results, so callers may modify them freely.
+    """
+    import copy
+    from concurrent.futures import Future
+
+    cache = _search_cache_instance()
+    if not _search_refresh:
+        results = cache.get(source, query)
+        if results is not None:
+            print(f"  Search cache hit: {source} '{query}' ({len(results)} result(s))")
+            with _search_flights_lock:
+                search_stats["cached"] += 1
+            return copy.deepcopy(results)
+
+    key = SearchCache.key(source, query)
+    with _search_flights_lock:
+        flight = _search_flights.get(key)
+        owner = flight is None
+        if owner:
+            flight = _search_flights[key] = Future()
+    if not owner:
+        with _search_flights_lock:
+            search_stats["deduped"] += 1
+        return copy.deepcopy(flight.result())
+
+    try:
+        results = scrape(query)
+        with _search_flights_lock:
+            search_stats["fetched"] += 1
+        if results:
+            cache.put(source, query, results)
+        flight.set_result(results or [])
+    except BaseException as e:
+        flight.set_exception(e)
+        raise
+    finally:
+        # Successful results stay memoized until clear_search_memo()
+        if flight.exception() is not None or not flight.result():
+            with _search_flights_lock:
+                _search_flights.pop(key, None)
+    return copy.deepcopy(results or [])
+
+
+def clear_search_memo():
+    """Forget searches memoized in this process (called around each batch run)."""
+    with _search_flights_lock:
+        _search_flights.clear()
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def get_openai_key():
+    if OPENAI_KEY_FILE.exists():
+        return OPENAI_KEY_FILE.read_text().strip()
+    env_key = os.environ.get("OPENAI_API_KEY")
+    if env_key:
+        return env_key
+    raise AssetError("No OpenAI API key found. Place it in ~/.claude/secrets/openai_api_key "
+                     "or set $OPENAI_API_KEY")
+
+
+@phase("request")
+def _request(url: str, accept: str = "*/*") -> bytes:
+    """Make an HTTP GET request with browser-like headers."""
+    _span_note("url", url)
+    body = _session().get(url, accept=accept)
+    _span_count("bytes", len(body))
+    return body
+
+
+def print_progress(done: int, total: int | None, bytes_per_sec: float):
+    """Default download progress callback: one updating line on a terminal."""
+    pct = f"{done * 100 / total:5.1f}%" if total else f"{done / 1024:.0f} KB"
+    sys.stdout.write(f"\r  {pct} at {bytes_per_sec / 1024:.0f} KB/s")
+    if total and done >= total:
+        sys.stdout.write("\n")
+    sys.stdout.flush()
+
+
+def _parse_content_range(value: str | None) -> tuple[int | None, int | None]:
+    """Return (first byte, total length) from a Content-Range header."""
+    m = re.match(r"bytes (?:(\d+)-\d+|\*)/(\d+|\*)", value or "")
+    if not m:
+        return None, None
+    start = int(m.group(1)) if m.group(1) else None
+    total = int(m.group(2)) if m.group(2) != "*" else None
+    return start, total
+
+
+@phase("download")
+def download_file(url: str, output_path: str, sha256: str | None = None,
+                  chunk_size: int | None = None, progress=None, max_attempts: int = 3) -> str:
+    """Stream a file from URL to output_path.
+
+    The body is written chunk by chunk to "<output>.part", which is renamed
+    into place once the Content-Length (and sha256, if given) check out. A
+    .part file left by an earlier run, or by a connection that dropped
+    mid-transfer, is resumed with a Range request.
+
+    Completed downloads go through the download cache: a fresh cached copy
+    is used without touching the network, and a stale one is revalidated
+    with If-None-Match / If-Modified-Since.
+
+    progress, if given, is called as progress(bytes_done, total, bytes_per_sec).
+    """
+    import hashlib
+    import http.client
+    import urllib.error
+
+    _span_note("url", url)
+    output = Path(output_path)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    part = output.with_name(output.name + ".part")
+    chunk_size = chunk_size or DOWNLOAD_CHUNK_SIZE
+    if progress is None and _show_progress:
+        progress = print_progress
+
+    cache = _cache()
+    cached = cache.lookup(url) if cache else None
+    if cached and sha256 and cached["sha256"] != sha256.lower():
+        cached = None
+    if cached and cache.is_fresh(cached):
+        cache.materialize(url, cached, output)
+        _span_note("cache", "hit")
+        print(f"  Cache hit: {output} ({cached['size'] / 1024:.0f} KB)")
+        return str(output)
+
+    if cache:
+        _span_note("cache", "miss")
+    print(f"  Downloading: {url[:100]}...")
+    started = time.monotonic()
+    received = 0
+    headers_seen = {}
+    with _limit("download"):
+        for attempt in range(1, max_attempts + 1):
+            if attempt > 1:
+                _span_count("retries")
+            offset = part.stat().st_size if part.exists() else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            if cached and not offset:
+                headers.update(cache.conditional_headers(cached))
+            try:
+                resp = _session().open(url, headers=headers)
+            except urllib.error.HTTPError as e:
+                if e.code != 416 or not offset:
+                    raise
+                # Nothing left past our offset: either the .part is already
+                # complete or it belongs to a different version of the file
+                _, total = _parse_content_range(e.headers.get("Content-Range"))
+                if total == offset:
+                    break
+                part.unlink()
+                continue
+
+            with resp:
+                headers_seen = resp.headers
+                if resp.status == 304:
+                    cache.materialize(url, cached, output, revalidated=True, headers=resp.headers)
+                    _span_note("cache", "revalidated")
+                    print(f"  Cache revalidated: {output} ({cached['size'] / 1024:.0f} KB)")
+                    return str(output)
+                total = None
+                if resp.status == 206:
+                    start, total = _parse_content_range(resp.headers.get("Content-Range"))
+                    if start != offset:
+                        part.unlink()
+                        continue
+                    mode = "ab"
+                    print(f"  Resuming at {offset / 1024:.0f} KB")
+                else:
+                    offset, mode = 0, "wb"
+                length = resp.headers.get("Content-Length")
+                if total is None and length is not None:
+                    total = offset + int(length)
+
+                done = offset
+                try:
+                    with open(part, mode) as f:
+                        while chunk := resp.read(chunk_size):
+                            check_cancelled()
+                            f.write(chunk)
+                            done += len(chunk)
+                            received += len(chunk)
+                            _span_count("bytes", len(chunk))
+                            if progress:
+                                elapsed = time.monotonic() - started
+                                progress(done, total, received / elapsed if elapsed else 0.0)
+                except (OSError, http.client.HTTPException) as e:
+                    if attempt == max_attempts:
+                        raise
+                    print(f"  Connection lost at {done / 1024:.0f} KB ({e}); resuming...")
+                    continue
+
+            if total is not None and done != total:
+                if attempt == max_attempts:
+                    raise IOError(f"incomplete download: got {done} of {total} bytes")
+                continue
+            break
+        else:
+            raise IOError(f"download of {url} did not complete after {max_attempts} attempts")
+
+    digest = None
+    if sha256 or cache:
+        digest = hashlib.sha256()
+        with open(part, "rb") as f:
+            while block := f.read(1024 * 1024):
+                digest.update(block)
+        if sha256 and digest.hexdigest() != sha256.lower():
+            part.unlink()
+            raise ValueError(f"checksum mismatch for {url}: got {digest.hexdigest()}")
+
+    os.replace(part, output)
+    if cache:
+        cache.store(url, output, digest.hexdigest(), headers_seen)
+    elapsed = time.monotonic() - started
+    rate = received / elapsed if elapsed else 0.0
+    print(f"  Saved: {output} ({output.stat().st_size / 1024:.0f} KB, {rate / 1024:.0f} KB/s)")
+    return str(output)
+
+
+def ffmpeg_output_args(fmt: str, bitrate: str = None, sample_rate: int = None,
+                       channels: int = None) -> list[str]:
+    """Encoder arguments for a target format (between the input and output paths).
+
+    bitrate, sample_rate and channels override the format's defaults;
+    bitrate only applies to compressed formats.
+    """
+    channel_args = ["-ac", str(channels or 1)]
+    if fmt == "m4a":
+        # AAC in M4A container — compressed, good for ambient loops
+        rate_args = ["-ar", str(sample_rate)] if sample_rate else []
+        return ["-c:a", "aac", "-b:a", bitrate or "128k", *rate_args, *channel_args]
+    if fmt == "caf":
+        # 16-bit PCM in CAF container — uncompressed, low latency for SFX
+        return ["-c:a", "pcm_s16le", "-ar", str(sample_rate or 44100), *channel_args,
+                "-f", "caf"]
+    if fmt == "wav":
+        return ["-c:a", "pcm_s16le", "-ar", str(sample_rate or 44100), *channel_args]
+    args = ["-b:a", bitrate] if bitrate else []
+    args += ["-ar", str(sample_rate)] if sample_rate else []
+    args += ["-ac", str(channels)] if channels else []
+    return args
+
+
+# Per-output encoder options a manifest entry may set
+OUTPUT_OPTIONS = ("bitrate", "sample_rate", "channels")
+# Per-output edits that need the decoded audio first (see analyze_audio)
+ANALYSIS_OPTIONS = ("trim", "loudness", "loop")
+
+
+def output_spec(path: str, fmt: str = None, **options) -> dict:
+    """Describe one conversion output: path, format and encoder arguments.
+
+    Analysis options (trim, loudness, loop) go under "analyze"; the
+    conversion fills in the resulting "filter" and "analysis".
+    """
+    fmt = fmt or Path(path).suffix.lstrip(".").lower()
+    analyze = {k: v for k, v in options.items()
+               if k in ANALYSIS_OPTIONS and v not in (None, False)}
+    options = {k: v for k, v in options.items() if k in OUTPUT_OPTIONS and v is not None}
+    spec = {"path": str(path), "format": fmt, "options": options,
+            "args": ffmpeg_output_args(fmt, **options)}
+    if analyze:
+        spec["analyze"] = analyze
+    return spec
+
+
+def ffmpeg_command(input_arg: str, outputs: list[dict], benchmark: bool = False) -> list[str]:
+    """Build one ffmpeg invocation that writes every output from a single decode.
+
+    With several outputs each gets its own "-map 0:a" so ffmpeg decodes the
+    input once and feeds the decoded audio to every encoder. benchmark adds
+    -benchmark, whose report _ffmpeg_cpu_seconds reads.
+    """
+    cmd = ["ffmpeg", "-y", *(["-benchmark"] if benchmark else []), "-i", input_arg]
+    for out in outputs:
+        if len(outputs) > 1:
+            cmd += ["-map", "0:a"]
+        if out.get("filter"):
+            cmd += ["-af", out["filter"]]
+        cmd += [*out["args"], out["path"]]
+    return cmd
+
+
+def _ffmpeg_cpu_seconds(stderr: str) -> float:
+    """User + system CPU time from the report `ffmpeg -benchmark` ends with."""
+    found = re.findall(r"bench: utime=([\d.]+)s stime=([\d.]+)s", stderr)
+    return sum(map(float, found[-1])) if found else 0.0
+
+
+def _clear_outputs(outputs: list[dict]):
+    """Unlink outputs: old ones before ffmpeg writes (an older version may have
+    hard-linked one into a cache), and staging files that are no longer wanted.
+    """
+    for out in outputs:
+        Path(out["path"]).unlink(missing_ok=True)
+
+
+def _staged_outputs(outputs: list[dict]) -> list[dict]:
+    """Copies of output specs that write to ".<stem>.part<suffix>" beside each output.
+
+    The suffix is kept, so ffmpeg picks the same container.
+    """
+    staged = []
+    for out in outputs:
+        path = Path(out["path"])
+        staged.append({**out, "path": str(path.with_name(f".{path.stem}.part{path.suffix}"))})
+    return staged
+
+
+def _note_convert(outputs: list[dict]):
+    _note("convert", [{k: out[k] for k in ("format", "options", "args", "filter") if k in out}
+                      for out in outputs])
+
+
+def _report_outputs(outputs: list[dict]):
+    for out in outputs:
+        print(f"  Converted: {out['path']} ({os.path.getsize(out['path']) / 1024:.0f} KB)")
+
+
+def convert_with_ffmpeg(input_path: str, output_path: str, format_hint: str = None):
+    """Convert audio/image using ffmpeg."""
+    convert_outputs(input_path, [output_spec(output_path, format_hint)])
+
+
+def convert_outputs(input_path: str, outputs: list[dict]):
+    """Convert input_path to every output spec with one ffmpeg run.
+
+    During a concurrent batch the work runs on the ffmpeg pool; the caller
+    blocks until it finishes either way.
+    """
+    if _convert_pool is not None:
+        # Run in a copy of our context so asset notes reach the caller's record
+        ctx = contextvars.copy_context()
+        return _convert_pool.submit(ctx.run, _convert_outputs, input_path, outputs).result()
+    return _convert_outputs(input_path, outputs)
+
+
+def _source_sha256(path: str) -> str:
+    """SHA-256 of a conversion's input; download cache objects are named by theirs."""
+    cache = _cache()
+    if cache and Path(path).parent.parent == cache.root / "objects":
+        return Path(path).name
+    return _file_sha256(path)
+
+
+@phase("convert")
+def _convert_outputs(input_path: str, outputs: list[dict]):
+    import shutil
+
+    check_cancelled()
+    _span_note("outputs", [out["format"] for out in outputs])
+    transcodes = _transcode_cache() if shutil.which("ffmpeg") else None
+    source = _source_sha256(input_path) if transcodes or _source_flights is not None else None
+    with deduplicated({"source": f"sha256:{source}", **output_signature(outputs)},
+                      outputs) as reused:
+        if reused:
+            _span_note("dedup", True)
+        else:
+            _convert_once(input_path, outputs, source, transcodes)
+    _span_count("bytes", sum(os.path.getsize(out["path"]) for out in outputs
+                             if os.path.exists(out["path"])))
+
+
+def _convert_once(input_path: str, outputs: list[dict], source: str | None, transcodes):
+    with _limit("convert"):
+        key = transcode_key(source, outputs) if transcodes else None
+        if key and transcodes.restore(key, outputs):
+            _note_convert(outputs)
+            _span_note("transcode", "hit")
+            print(f"  Transcode cache hit: {', '.join(Path(o['path']).name for o in outputs)}")
+            _report_outputs(outputs)
+        else:
+            if any("analyze" in out for out in outputs):
+                _analyze_outputs(input_path, outputs)
+            cpu_seconds = _run_ffmpeg_convert(input_path, outputs)
+            if key and cpu_seconds is not None:
+                transcodes.store(key, outputs, cpu_seconds)
+
+
+def _run_ffmpeg_convert(input_path: str, outputs: list[dict]) -> float | None:
+    """Run the conversion; returns ffmpeg's CPU seconds (None without ffmpeg)."""
+    import shutil
+    import subprocess
+
+    if not shutil.which("ffmpeg"):
+        print("  ERROR: ffmpeg not found — install with: sudo apt install ffmpeg", file=sys.stderr)
+        for out in outputs:
+            shutil.copy2(input_path, out["path"])
+        return None
+
+    cmd = ffmpeg_command(input_path, outputs, benchmark=True)
+    _note_convert(outputs)
+
+    targets = ", ".join(f"{out['format']}: {Path(out['path']).name}" for out in outputs)
+    print(f"  Converting → {targets}")
+    _clear_outputs(outputs)
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise AssetError(f"ffmpeg conversion failed:\n{result.stderr[-500:]}")
+
+    _report_outputs(outputs)
+    return _ffmpeg_cpu_seconds(result.stderr)
+
+
+def _needs_seekable_input(head: bytes) -> bool:
+    """True for MP4-family data whose moov atom is not ahead of the media data.
+
+    Walks the top-level boxes in the first bytes of the stream. A moov
+    before mdat ("faststart") can be decoded from a pipe; anything else
+    needs a seekable file.
+    """
+    if head[4:8] != b"ftyp":
+        return False
+    pos = 0
+    while pos + 8 <= len(head):
+        size = int.from_bytes(head[pos:pos + 4], "big")
+        box = head[pos + 4:pos + 8]
+        if box == b"moov":
+            return False
+        if box == b"mdat":
+            return True
+        if size == 1 and pos + 16 <= len(head):
+            size = int.from_bytes(head[pos + 8:pos + 16], "big")
+        if size < 8:
+            return True
+        pos += size
+    return True
+
+
+def _read_head(resp, size: int) -> bytes:
+    head = b""
+    while len(head) < size:
+        chunk = resp.read(size - len(head))
+        if not chunk:
+            break
+        head += chunk
+    return head
+
+
+def _check_body_length(resp, received: int):
+    """Raise if a body ended short of its Content-Length; http.client just stops reading."""
+    expected = resp.headers.get("Content-Length")
+    if expected is not None and received != int(expected):
+        raise IOError(f"incomplete download: got {received} of {expected} bytes")
+
+
+@phase("pipe_convert")
+def _pipe_convert(url: str, outputs: list[dict]) -> str | None:
+    """Stream url into ffmpeg's stdin, so the download and the encode overlap.
+
+    Returns "pipe" on success. If the head of the stream shows an MP4 that
+    needs seekable input, the rest of the body is spooled to a scratch file
+    and converted from there ("tempfile"). Returns None if ffmpeg rejected
+    the piped input; the caller should then take the temp-file path.
+    While streaming, the body is also written to the download cache, and
+    the outputs to the transcode cache.
+
+    ffmpeg writes to staging files beside the outputs (see _staged_outputs),
+    which replace them only once the download and the encode have both
+    succeeded; a dropped connection never leaves a truncated asset behind.
+    """
+    import hashlib
+    import subprocess
+
+    cache = _cache()
+    transcodes = _transcode_cache()
+    output_path = outputs[0]["path"]
+    staged = _staged_outputs(outputs)
+    cmd = ffmpeg_command("pipe:0", staged, benchmark=True)
+    spool = None
+    _span_note("url", url)
+    print(f"  Streaming: {url[:100]}...")
+    with _limit("download"), _limit("convert"):
+        with _session().open(url) as resp:
+            head = _read_head(resp, DOWNLOAD_CHUNK_SIZE)
+            digest = hashlib.sha256()
+            received = 0
+            if _needs_seekable_input(head):
+                print("  Source needs seekable input (moov atom at the end) — using a temp file")
+                spool = _scratch_path(url, output_path, Path(urllib.parse.urlparse(url).path).suffix)
+                with open(spool, "wb") as f:
+                    chunk = head
+                    while chunk:
+                        check_cancelled()
+                        f.write(chunk)
+                        digest.update(chunk)
+                        received += len(chunk)
+                        _span_count("bytes", len(chunk))
+                        chunk = resp.read(DOWNLOAD_CHUNK_SIZE)
+                _check_body_length(resp, received)
+                if cache:
+                    cache.store(url, Path(spool), digest.hexdigest(), resp.headers, scratch=True)
+            else:
+                tee_path = Path(_scratch_path(url, output_path, ".tee")) if cache else None
+                tee = open(tee_path, "wb") if tee_path else None
+                targets = ", ".join(f"{out['format']}: {Path(out['path']).name}" for out in outputs)
+                print(f"  Converting → {targets} (piped)")
+                _note_convert(outputs)
+                proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE)
+                # Drain stderr on the side so a chatty ffmpeg can't block on it
+                stderr = []
+                drain = threading.Thread(target=lambda: stderr.append(proc.stderr.read()),
+                                         daemon=True)
+                drain.start()
+                complete = False
+                try:
+                    chunk = head
+                    while chunk:
+                        check_cancelled()
+                        proc.stdin.write(chunk)
+                        digest.update(chunk)
+                        received += len(chunk)
+                        _span_count("bytes", len(chunk))
+                        if tee:
+                            tee.write(chunk)
+                        chunk = resp.read(DOWNLOAD_CHUNK_SIZE)
+                    _check_body_length(resp, received)
+                    complete = True
+                except BrokenPipeError:
+                    pass
+                except BaseException:
+                    # Dropped connection, cancelled build, Ctrl-C: nothing of it is kept
+                    proc.kill()
+                    proc.wait()
+                    _clear_outputs(staged)
+                    if tee_path:
+                        tee_path.unlink(missing_ok=True)
+                    raise
+                finally:
+                    with contextlib.suppress(BrokenPipeError):
+                        proc.stdin.close()
+                    returncode = proc.wait()
+                    drain.join()
+                    if tee:
+                        tee.close()
+                try:
+                    if returncode != 0 or not complete:
+                        err = (stderr[0] if stderr else b"").decode("utf-8", errors="replace")
+                        print(f"  WARNING: piped conversion failed:\n{err[-500:]}", file=sys.stderr)
+                        return None
+                    for out, part in zip(outputs, staged):
+                        os.replace(part["path"], out["path"])
+                    if tee:
+                        cache.store(url, tee_path, digest.hexdigest(), resp.headers, scratch=True)
+                    if transcodes:
+                        err = (stderr[0] if stderr else b"").decode("utf-8", errors="replace")
+                        transcodes.store(transcode_key(digest.hexdigest(), outputs), outputs,
+                                         _ffmpeg_cpu_seconds(err))
+                finally:
+                    _clear_outputs(staged)
+                    if tee_path:
+                        tee_path.unlink(missing_ok=True)
+
+    if spool:
+        try:
+            convert_outputs(spool, outputs)
+        finally:
+            os.unlink(spool)
+        return "tempfile"
+
+    _report_outputs(outputs)
+    return "pipe"
+
+
+@phase("fetch_convert")
+def fetch_and_convert(url: str, outputs: list[dict], sha256: str | None = None) -> str:
+    """Download url and convert it to every output spec (see output_spec).
+
+    Prefers streaming the body straight into ffmpeg (see _pipe_convert). A
+    fresh cached copy is converted in place, and downloads with a checksum
+    go through a temp file so they are verified before use. Returns the
+    path taken ("pipe", "cache" or "tempfile") and notes it, with timing,
+    for the batch summary.
+    """
+    import shutil
+
+    started = time.monotonic()
+    cache = _cache()
+    cached = cache.lookup(url) if cache else None
+    if cached and (not cache.is_fresh(cached) or (sha256 and cached["sha256"] != sha256.lower())):
+        cached = None
+
+    path = None
+    if cached:
+        print(f"  Cache hit: converting cached copy of {url[:80]}")
+        cache.record_use(url)
+        convert_outputs(str(cache.object_path(cached["sha256"])), outputs)
+        path = "cache"
+    elif not sha256 and shutil.which("ffmpeg") and not any("analyze" in out for out in outputs):
+        # (analysis needs the whole source before encoding starts)
+        try:
+            path = _pipe_convert(url, outputs)
+        except OSError as e:
+            # The outputs are untouched; download_file resumes and retries a dropped connection
+            print(f"  Streaming failed ({e})")
+        if path is None:
+            print("  Retrying with a temp file")
+
+    if path is None:
+        src_ext = Path(urllib.parse.urlparse(url).path).suffix or ".bin"
+        tmp_path = _scratch_path(url, outputs[0]["path"], src_ext)
+        try:
+            download_file(url, tmp_path, sha256=sha256)
+            convert_outputs(tmp_path, outputs)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        path = "tempfile"
+
+    _span_note("path", path)
+    _note("convert_path", path)
+    _note("convert_seconds", round(time.monotonic() - started, 3))
+    return path
+
+
+# ---------------------------------------------------------------------------
+# Source deduplication
+# ---------------------------------------------------------------------------
+
+# Single flight per source (or prompt) and output signature during a batch
+# run: the first entry fetches and converts, the others copy its outputs.
+# None outside run_batch / run_workspace.
+_source_flights: dict | None = None
+_source_flights_lock = threading.Lock()
+# Where snapshot=True leaders keep their outputs for later followers
+_dedup_dir: str | None = None
+
+
+@contextlib.contextmanager
+def deduplicated(key: dict, outputs: list[dict], snapshot: bool = False):
+    """Share one fetch-and-convert between batch entries with the same key.
+
+    key says what the outputs' bytes depend on: for audio the source
+    ("url:..." before the download, "sha256:..." once the bytes are known)
+    plus output_signature; for images the prompt. Yields True if another
+    entry already produced identical outputs, which are then copied into
+    place and the caller should skip its own work; False if the caller must
+    do it. If the entry that went first fails, the others do their own work.
+    With snapshot, the first entry's outputs are copied aside as they are
+    when the block ends, for callers that go on to rewrite them (e.g.
+    quantize). Each key an entry shares is noted under "dedup_claims", so
+    the batch can credit it as a serial run would (see _settle_dedup).
+    """
+    import hashlib
+    from concurrent.futures import Future
+
+    if _source_flights is None:
+        yield False
+        return
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    notes = _asset_notes.get()
+    claims = notes.setdefault("dedup_claims", []) if notes is not None else []
+    with _source_flights_lock:
+        flight = _source_flights.get(digest)
+        leader = flight is None
+        if leader:
+            flight = _source_flights[digest] = Future()
+    if not leader:
+        try:
+            first = flight.result()
+        except BaseException:
+            first = None
+        if first:
+            claims.append(digest)
+            _copy_outputs(first, outputs)
+        yield bool(first)
+        return
+    claims.append(digest)
+    try:
+        yield False
+        published = [dict(out) for out in outputs]
+        if snapshot:
+            for i, out in enumerate(published):
+                out["path"] = _dedup_snapshot(out["path"], f"{digest}-{i}")
+    except BaseException as e:
+        flight.set_exception(e)
+        raise
+    notes = _asset_notes.get() or {}
+    flight.set_result({"asset": notes.get("asset"), "outputs": published})
+
+
+def _dedup_snapshot(path: str, name: str) -> str:
+    import tempfile
+
+    global _dedup_dir
+    with _source_flights_lock:
+        if _dedup_dir is None:
+            _dedup_dir = tempfile.mkdtemp(prefix="asset_fetcher-dedup-")
+    kept = os.path.join(_dedup_dir, name)
+    _copy_file(path, kept)
+    return kept
+
+
+def _copy_outputs(first: dict, outputs: list[dict]):
+    """Copy another entry's outputs in as ours and note the bytes saved.
+
+    Copies, not links, so editing one asset in place leaves its twins alone.
+    """
+    saved = 0
+    for out, done in zip(outputs, first["outputs"]):
+        src, target = Path(done["path"]), Path(out["path"])
+        saved += src.stat().st_size
+        for field in ("filter", "analysis"):
+            if field in done:
+                out[field] = done[field]
+        tmp = target.with_name(target.name + ".part")
+        tmp.unlink(missing_ok=True)
+        _copy_file(src, tmp)
+        os.replace(tmp, target)
+    if all("args" in out for out in outputs):
+        _note_convert(outputs)
+    _note("dedup", {"of": first["asset"], "bytes_saved": saved})
+    print(f"  Same as {first['asset']}: copied "
+          f"{', '.join(Path(out['path']).name for out in outputs)}")
+
+
+@contextlib.contextmanager
+def source_dedup():
+    """Turn on deduplicated() for the duration of a batch run."""
+    import shutil
+
+    global _source_flights, _dedup_dir
+    _source_flights = {}
+    try:
+        yield
+    finally:
+        _source_flights = None
+        if _dedup_dir:
+            shutil.rmtree(_dedup_dir, ignore_errors=True)
+            _dedup_dir = None
+
+
+# ---------------------------------------------------------------------------
+# Audio analysis
+# ---------------------------------------------------------------------------
+
+# Frames quieter than this (RMS, dBFS) count as silence for "trim"
+TRIM_THRESHOLD_DB = -50.0
+# Audio kept either side of the first/last sound, so attacks and tails aren't clipped
+TRIM_PAD_MS = 10
+# Sample peak a loudness gain may not push past (dBFS)
+LOUDNESS_PEAK_DB = -1.0
+# Window matched between a loop's start and its candidate ends
+LOOP_WINDOW_MS = 50
+# Loops keep at least this share of the (trimmed) sound
+LOOP_MIN_SHARE = 0.75
+
+# BS.1770 K-weighting: a high shelf (gain dB, Q, center Hz) then a high-pass (Q, corner Hz)
+_K_SHELF = (3.999843853973347, 0.7071752369554196, 1681.974450955533)
+_K_HIGHPASS = (0.5003270373238773, 38.13547087602444)
+
+
+def read_pcm(path: str):
+    """Decode audio to float32 samples through ffmpeg; returns ((frames, channels) array, rate)."""
+    import subprocess
+
+    np = _numpy()
+    result = subprocess.run(["ffmpeg", "-v", "error", "-i", str(path), "-map", "0:a:0",
+                             "-f", "wav", "-c:a", "pcm_f32le", "pipe:1"], capture_output=True)
+    data = result.stdout
+    if result.returncode != 0 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        err = result.stderr.decode("utf-8", errors="replace")
+        raise RuntimeError(f"could not decode {path}: {err[-300:]}")
+    # Walk the chunks; a piped WAV has no real sizes on RIFF or data
+    pos, channels, rate = 12, 0, 0
+    while pos + 8 <= len(data):
+        kind, size = data[pos:pos + 4], int.from_bytes(data[pos + 4:pos + 8], "little")
+        if kind == b"fmt ":
+            channels = int.from_bytes(data[pos + 10:pos + 12], "little")
+            rate = int.from_bytes(data[pos + 12:pos + 16], "little")
+        elif kind == b"data":
+            body = data[pos + 8:]
+            body = body[:size] if 0 < size < len(body) else body
+            body = body[:len(body) - len(body) % (4 * channels)]
+            return np.frombuffer(body, "<f4").reshape(-1, channels), rate
+        pos += 8 + size + (size & 1)
+    raise RuntimeError(f"could not decode {path}: no audio data")
+
+
+def k_weighting(rate: int, freqs):
+    """Complex response of the BS.1770 K-weighting filters at freqs (Hz).
+
+    The biquads are designed for rate the way libebur128 does it, which
+    reproduces the standard's 48 kHz coefficients.
+    """
+    np = _numpy()
+    z = np.exp(-2j * np.pi * freqs / rate)
+
+    def biquad(b, a):
+        return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+    gain_db, q, fc = _K_SHELF
+    k = np.tan(np.pi * fc / rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    shelf = biquad((vh + vb * k / q + k * k, 2 * (k * k - vh), vh - vb * k / q + k * k),
+                   (1 + k / q + k * k, 2 * (k * k - 1), 1 - k / q + k * k))
+    q, fc = _K_HIGHPASS
+    k = np.tan(np.pi * fc / rate)
+    highpass = biquad((1, -2, 1), (1, 2 * (k * k - 1) / (1 + k / q + k * k),
+                                   (1 - k / q + k * k) / (1 + k / q + k * k)))
+    return shelf * highpass
+
+
+def integrated_loudness(samples, rate: int) -> float:
+    """Integrated loudness (LUFS) per ITU-R BS.1770: K-weighting, 400 ms blocks, gating.
+
+    The K-weighting filters are applied in the frequency domain (one FFT per
+    channel). All channels are weighted 1.0, as for mono and stereo.
+    """
+    np = _numpy()
+    frames = len(samples)
+    n = 1 << int(np.ceil(np.log2(frames + rate // 2)))  # padded, so filter tails don't wrap
+    freqs = np.fft.rfftfreq(n, 1 / rate)
+    response = k_weighting(rate, freqs)[:, None]
+    weighted = np.fft.irfft(np.fft.rfft(samples, n, axis=0) * response, n, axis=0)[:frames]
+
+    # Mean square per 400 ms block, stepping 100 ms, from a running sum
+    block, step = int(0.4 * rate), int(0.1 * rate)
+    power = np.concatenate([np.zeros((1, samples.shape[1])), np.cumsum(weighted ** 2, axis=0)])
+    if frames < block:
+        starts, block = np.array([0]), max(frames, 1)
+    else:
+        starts = np.arange(0, frames - block + 1, step)
+    z = ((power[starts + block] - power[starts]) / block).sum(axis=1)
+    loudness = -0.691 + 10 * np.log10(np.maximum(z, 1e-20))
+    gated = z[loudness > -70]
+    if not len(gated):
+        return float("-inf")
+    relative = -0.691 + 10 * np.log10(gated.mean()) - 10
+    gated = z[(loudness > -70) & (loudness > relative)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def silence_bounds(mono, rate: int, threshold_db: float = TRIM_THRESHOLD_DB,
+                   pad_ms: float = TRIM_PAD_MS) -> tuple[int, int]:
+    """[start, end) frames of mono between the first and last 10 ms above threshold_db RMS."""
+    np = _numpy()
+    hop = max(1, rate // 100)
+    count = len(mono) // hop
+    if not count:
+        return 0, len(mono)
+    rms = np.sqrt((mono[:count * hop].reshape(count, hop).astype(np.float64) ** 2).mean(axis=1))
+    loud = np.flatnonzero(rms > 10 ** (threshold_db / 20))
+    if not len(loud):
+        return 0, len(mono)
+    pad = int(pad_ms * rate / 1000)
+    return max(0, int(loud[0]) * hop - pad), min(len(mono), (int(loud[-1]) + 1) * hop + pad)
+
+
+def loop_end(mono, start: int, end: int, rate: int, window_ms: float = LOOP_WINDOW_MS,
+             min_share: float = LOOP_MIN_SHARE) -> tuple[int, float]:
+    """Where to cut [start, end) so jumping back to start is least audible.
+
+    The first window of the sound is cross-correlated (FFT) against every
+    position in the last part of it; the loop ends where the audio that
+    would have followed best matches what the jump plays instead. Returns
+    (end frame, normalized correlation).
+    """
+    np = _numpy()
+    w = max(1, int(window_ms * rate / 1000))
+    lo, hi = start + int(min_share * (end - start)), end - w
+    if hi <= lo or lo - start < w:
+        return end, 0.0
+    template = mono[start:start + w].astype(np.float64)
+    region = mono[lo:hi + w].astype(np.float64)
+    n = 1 << int(np.ceil(np.log2(len(region) + w)))
+    corr = np.fft.irfft(np.fft.rfft(region, n) * np.conj(np.fft.rfft(template, n)), n)
+    corr = corr[:hi - lo + 1]
+    energy = np.concatenate([[0], np.cumsum(region ** 2)])
+    norms = np.sqrt((energy[w:] - energy[:-w])[:len(corr)] * (template ** 2).sum())
+    score = np.where(norms > 1e-12, corr / np.maximum(norms, 1e-12), 0)
+    best = int(score.argmax())
+    return lo + best, round(float(score[best]), 4)
+
+
+def analyze_audio(path: str, requests: list[dict | None]) -> list[dict | None]:
+    """Decode path once and work out each output's edits.
+
+    Each request holds an output's analysis options: "trim" (true, or
+    {"threshold_db", "pad_ms"}), "loudness" (target LUFS, e.g. -16) and
+    "loop" (true, or {"window_ms", "min_share"}). The result per output
+    says where it starts and ends (seconds), the gain applied and the
+    loudness before and after, plus the ffmpeg "filter" that applies it.
+    """
+    np = _numpy()
+    samples, rate = read_pcm(path)
+    mono = samples.mean(axis=1)
+    results = []
+    for request in requests:
+        if not request:
+            results.append(None)
+            continue
+        start, end = 0, len(mono)
+        result = {"duration": round(len(mono) / rate, 4)}
+        if request.get("trim"):
+            trim = request["trim"] if isinstance(request["trim"], dict) else {}
+            start, end = silence_bounds(mono, rate, **trim)
+            result["trimmed"] = round((len(mono) - (end - start)) / rate, 4)
+        if request.get("loop"):
+            loop = request["loop"] if isinstance(request["loop"], dict) else {}
+            end, result["loop_correlation"] = loop_end(mono, start, end, rate, **loop)
+        result["start"], result["end"] = round(start / rate, 6), round(end / rate, 6)
+        filters = []
+        if (start, end) != (0, len(mono)):
+            filters.append(f"atrim=start={start / rate:.6f}:end={end / rate:.6f},"
+                           "asetpts=PTS-STARTPTS")
+        if request.get("loudness") is not None:
+            kept = samples[start:end]
+            before = integrated_loudness(kept, rate)
+            peak = 20 * np.log10(max(float(np.abs(kept).max(initial=0)), 1e-9))
+            gain = min(request["loudness"] - before, LOUDNESS_PEAK_DB - peak) \
+                if np.isfinite(before) else 0.0
+            result.update(lufs_before=round(before, 2), gain_db=round(gain, 2),
+                          lufs_after=round(before + gain, 2))
+            filters.append(f"volume={gain:.2f}dB")
+        result["filter"] = ",".join(filters)
+        results.append(result)
+    return results
+
+
+def _analyze_outputs(input_path: str, outputs: list[dict]):
+    """Fill in "analysis" and "filter" on every output that asked for analysis."""
+    import shutil
+
+    if not shutil.which("ffmpeg"):
+        return
+    with phase("analyze"):
+        results = run_cpu(analyze_audio, input_path, [out.get("analyze") for out in outputs])
+    for out, result in zip(outputs, results):
+        if result:
+            if result["filter"]:
+                out["filter"] = result["filter"]
+            out["analysis"] = {k: v for k, v in result.items() if k != "filter"}
+            edits = [f"{result['start']:.3f}-{result['end']:.3f}s"]
+            if "gain_db" in result:
+                edits.append(f"{result['lufs_before']:.1f} → {result['lufs_after']:.1f} LUFS")
+            if "loop_correlation" in result:
+                edits.append(f"loop match {result['loop_correlation']:.2f}")
+            print(f"  Analysis: {Path(out['path']).name} {', '.join(edits)}")
+
+
+# ---------------------------------------------------------------------------
+# Image generation (DALL-E 3)
+# ---------------------------------------------------------------------------
+
+class TokenBucket:
+    """Asyncio token bucket: rate tokens per second, holding at most capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        import asyncio
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait for a token and take it."""
+        import asyncio
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self._updated is not None:
+                    self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def drain(self):
+        """Drop banked tokens, e.g. after the server says we are over the limit."""
+        self.tokens = 0
+
+
+def _retry_after(error) -> float | None:
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 1000), ("retry-after", 1)):
+        value = response.headers.get(header)
+        try:
+            return float(value) / scale
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def _backoff_delay(attempt: int, retry_after: float | None = None) -> float:
+    """Exponential backoff with full jitter, but never sooner than retry_after."""
+    import random
+    delay = random.uniform(0, min(IMAGE_BACKOFF_MAX, IMAGE_BACKOFF_BASE * 2 ** (attempt - 1)))
+    return max(delay, retry_after or 0.0)
+
+
+class ImagePipeline:
+    """DALL-E 3 generations on a background asyncio loop.
+
+    Requests go through the async OpenAI client (OPENAI_BASE_URL points it
+    at another endpoint, e.g. tools/benchmarks/stub_server.py), at most
+    concurrency at a time and no faster than the token bucket allows.
+    Images come back as b64_json, so there is no second download. submit()
+    starts a generation and returns a concurrent.futures.Future for
+    (png bytes, revised prompt, retries); identical requests share one
+    future until result() collects it.
+    """
+
+    def __init__(self, api_key: str, rate_per_minute: float = IMAGE_RATE_PER_MINUTE,
+                 concurrency: int = DEFAULT_LIMITS["image"],
+                 max_attempts: int = IMAGE_MAX_ATTEMPTS):
+        import asyncio
+        self.api_key = api_key
+        self.max_attempts = max_attempts
+        self._bucket = TokenBucket(rate_per_minute / 60, max(1.0, rate_per_minute))
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._client = None
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="images", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt: str, size: str, quality: str):
+        import asyncio
+        key = (prompt, size, quality)
+        with self._lock:
+            future = self._flights.get(key)
+            if future is None:
+                future = asyncio.run_coroutine_threadsafe(
+                    self._generate(prompt, size, quality), self._loop)
+                self._flights[key] = future
+        return future
+
+    def result(self, prompt: str, size: str, quality: str) -> tuple[bytes, str, int]:
+        """Wait for a generation (starting it if needed) and forget it."""
+        future = self.submit(prompt, size, quality)
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                if self._flights.get((prompt, size, quality)) is future:
+                    del self._flights[(prompt, size, quality)]
+
+    def forget(self):
+        """Drop generations nobody collected."""
+        with self._lock:
+            self._flights.clear()
+
+    def close(self):
+        async def shutdown():
+            if self._client is not None:
+                await self._client.close()
+
+        import asyncio
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _generate(self, prompt: str, size: str, quality: str) -> tuple[bytes, str, int]:
+        import asyncio
+        import base64
+        from openai import APIConnectionError, APIStatusError, AsyncOpenAI
+
+        if self._client is None:
+            # Retries are ours, so they share the rate limiter
+            self._client = AsyncOpenAI(api_key=self.api_key, max_retries=0)
+        async with self._slots:
+            for attempt in range(1, self.max_attempts + 1):
+                await self._bucket.acquire()
+                try:
+                    response = await self._client.images.generate(
+                        model="dall-e-3",
+                        prompt=prompt,
+                        size=size,
+                        quality=quality,
+                        n=1,
+                        response_format="b64_json",
+                    )
+                except (APIConnectionError, APIStatusError) as e:
+                    status = getattr(e, "status_code", None)
+                    if (status is not None and status != 429 and status < 500) \
+                            or attempt == self.max_attempts:
+                        raise
+                    if status == 429:
+                        self._bucket.drain()
+                    delay = _backoff_delay(attempt, _retry_after(e))
+                    print(f"  Image request failed ({status or type(e).__name__}); "
+                          f"retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                item = response.data[0]
+                return base64.b64decode(item.b64_json), item.revised_prompt or "", attempt - 1
+
+
+_image_pipeline_instance = None
+_image_lock = threading.Lock()
+_image_settings = {"rate_per_minute": IMAGE_RATE_PER_MINUTE,
+                   "concurrency": DEFAULT_LIMITS["image"]}
+
+
+def _image_pipeline() -> ImagePipeline:
+    global _image_pipeline_instance
+    with _image_lock:
+        if _image_pipeline_instance is None:
+            _image_pipeline_instance = ImagePipeline(get_openai_key(), **_image_settings)
+        return _image_pipeline_instance
+
+
+def configure_images(rate_per_minute: float | None = None, concurrency: int | None = None):
+    """Change the image pipeline's rate limit or concurrency (takes effect on next use)."""
+    global _image_pipeline_instance
+    changes = {"rate_per_minute": rate_per_minute, "concurrency": concurrency}
+    changes = {k: v for k, v in changes.items() if v is not None and v != _image_settings[k]}
+    if not changes:
+        return
+    _image_settings.update(changes)
+    if _image_pipeline_instance is not None:
+        _image_pipeline_instance.close()
+        _image_pipeline_instance = None
+
+
+def prefetch_images(entries: list[dict]):
+    """Start generating every manifest image entry now; generate_image picks them up."""
+    pipeline = _image_pipeline()
+    for img in entries:
+        pipeline.submit(img["prompt"], img.get("size", "1792x1024"),
+                        img.get("quality", "standard"))
+
+
+@phase("image")
+def generate_image(prompt: str, output_path: str, size: str = "1792x1024", quality: str = "standard"):
+    """Generate an image with DALL-E 3 and save to output_path."""
+    output = Path(output_path)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    print(f"Generating image with DALL-E 3...")
+    print(f"  Prompt: {prompt[:100]}{'...' if len(prompt) > 100 else ''}")
+    print(f"  Size: {size}, Quality: {quality}")
+
+    _span_note("size", size)
+    # One generation per prompt across the run; quantize may rewrite output later
+    key = {"prompt": prompt, "size": size, "quality": quality, "suffix": output.suffix.lower()}
+    with deduplicated(key, [{"path": str(output)}], snapshot=True) as reused:
+        if not reused:
+            _save_generated(prompt, output, size, quality)
+    return str(output)
+
+
+def _save_generated(prompt: str, output: Path, size: str, quality: str):
+    png, revised_prompt, retries = _image_pipeline().result(prompt, size, quality)
+    _span_count("bytes", len(png))
+    _span_count("retries", retries)
+    print(f"  Revised prompt: {revised_prompt[:120]}...")
+    _note("revised_prompt", revised_prompt)
+
+    if output.suffix.lower() == ".png":
+        tmp = output.with_name(output.name + ".part")
+        tmp.write_bytes(png)
+        os.replace(tmp, output)
+        print(f"  Saved: {output} ({len(png) / 1024:.0f} KB)")
+    else:
+        scratch = _scratch_path(prompt, str(output), ".png")
+        Path(scratch).write_bytes(png)
+        try:
+            convert_outputs(scratch, [output_spec(str(output))])
+        finally:
+            os.unlink(scratch)
+
+
+# ---------------------------------------------------------------------------
+# Image arrays (NumPy)
+# ---------------------------------------------------------------------------
+
+def _numpy():
+    """NumPy is only needed for image post-processing (sprites, ...)."""
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("NumPy not found — install with: pip install numpy") from None
+    return numpy
+
+
+def _has_numpy() -> bool:
+    import importlib.util
+    return importlib.util.find_spec("numpy") is not None
+
+
+def _png_size(path) -> tuple[int, int]:
+    with open(path, "rb") as f:
+        head = f.read(24)
+    if head[:8] != b"\x89PNG\r\n\x1a\n" or head[12:16] != b"IHDR":
+        raise ValueError(f"{path} is not a PNG")
+    return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+
+
+def read_rgba(path: str):
+    """Decode a PNG into an (height, width, 4) uint8 array, through ffmpeg."""
+    import subprocess
+
+    np = _numpy()
+    width, height = _png_size(path)
+    result = subprocess.run(["ffmpeg", "-v", "error", "-i", str(path),
+                             "-f", "rawvideo", "-pix_fmt", "rgba", "pipe:1"], capture_output=True)
+    if result.returncode != 0 or len(result.stdout) != width * height * 4:
+        err = result.stderr.decode("utf-8", errors="replace")
+        raise RuntimeError(f"could not decode {path}: {err[-300:]}")
+    return np.frombuffer(result.stdout, np.uint8).reshape(height, width, 4)
+
+
+def _png_bytes(width: int, height: int, color_type: int, raw: bytes, bit_depth: int = 8,
+               chunks: list[tuple[bytes, bytes]] = (), compress_level: int = 9) -> bytes:
+    """A PNG from filtered scanlines, with only the chunks given (no metadata)."""
+    import struct
+    import zlib
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data)))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0))
+            + b"".join(chunk(kind, data) for kind, data in chunks)
+            + chunk(b"IDAT", zlib.compress(raw, compress_level))
+            + chunk(b"IEND", b""))
+
+
+def _write_atomic(path, data: bytes):
+    tmp = Path(str(path) + ".part")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def encode_png(rgba, compress_level: int = 9) -> bytes:
+    """Encode an (height, width, 4) uint8 array as RGB, or RGBA if any pixel isn't opaque."""
+    np = _numpy()
+    height, width, _ = rgba.shape
+    channels = 4 if (rgba[..., 3] < 255).any() else 3
+    rows = np.ascontiguousarray(rgba[..., :channels], dtype=np.uint8).reshape(height, -1)
+    # "Up" filter on every row: flat illustrations compress far better than unfiltered
+    up = rows.copy()
+    up[1:] -= rows[:-1]
+    raw = np.hstack([np.full((height, 1), 2, np.uint8), up]).tobytes()
+    return _png_bytes(width, height, 6 if channels == 4 else 2, raw,
+                      compress_level=compress_level)
+
+
+def write_png(path: str, rgba, compress_level: int = 9):
+    """Write an (height, width, 4) uint8 array as a PNG, without metadata."""
+    _write_atomic(path, encode_png(rgba, compress_level))
+
+
+def encode_indexed_png(indices, palette, compress_level: int = 9) -> bytes:
+    """Encode an (height, width) array of indices into an (n, 4) RGBA palette.
+
+    Uses the smallest bit depth that fits n; palette alpha goes into tRNS
+    only if some entry isn't opaque.
+    """
+    np = _numpy()
+    height, width = indices.shape
+    depth = next(d for d in (1, 2, 4, 8) if len(palette) <= 1 << d)
+    per_byte = 8 // depth
+    packed = np.pad(indices.astype(np.uint8), ((0, 0), (0, -width % per_byte)))
+    packed = packed.reshape(height, -1, per_byte)
+    shifts = (depth * np.arange(per_byte - 1, -1, -1)).astype(np.uint8)
+    rows = np.bitwise_or.reduce(packed << shifts, axis=2).astype(np.uint8)
+    # Palette images compress best unfiltered
+    raw = np.hstack([np.zeros((height, 1), np.uint8), rows]).tobytes()
+    palette = np.asarray(palette, np.uint8)
+    chunks = [(b"PLTE", palette[:, :3].tobytes())]
+    translucent = np.flatnonzero(palette[:, 3] < 255)
+    if len(translucent):
+        chunks.append((b"tRNS", palette[:translucent[-1] + 1, 3].tobytes()))
+    return _png_bytes(width, height, 3, raw, depth, chunks, compress_level)
+
+
+def _resize_axis(img, n: int, axis: int):
+    """Resample float img to n samples along axis: area average to shrink, linear to grow."""
+    np = _numpy()
+    m = img.shape[axis]
+    if n == m:
+        return img
+    img = np.moveaxis(img, axis, 0)
+    shape = (-1,) + (1,) * (img.ndim - 1)
+    if n < m:
+        # Integrate over each output pixel's (fractional) footprint with a running sum
+        csum = np.concatenate([np.zeros((1,) + img.shape[1:]),
+                               np.cumsum(img, axis=0, dtype=np.float64)])
+        edges = np.linspace(0, m, n + 1)
+        whole = np.minimum(np.floor(edges).astype(int), m - 1)
+        integral = csum[whole] + (edges - whole).reshape(shape) * img[whole]
+        out = (integral[1:] - integral[:-1]) * (n / m)
+    else:
+        centers = np.clip((np.arange(n) + 0.5) * m / n - 0.5, 0, m - 1)
+        lo = np.floor(centers).astype(int)
+        hi = np.minimum(lo + 1, m - 1)
+        t = (centers - lo).reshape(shape)
+        out = img[lo] * (1 - t) + img[hi] * t
+    return np.moveaxis(out, 0, axis)
+
+
+def resize_rgba(rgba, width: int, height: int):
+    """Resize an RGBA array, premultiplying alpha so transparent edges don't bleed."""
+    np = _numpy()
+    f = rgba.astype(np.float64)
+    f[..., :3] *= f[..., 3:4] / 255
+    f = _resize_axis(_resize_axis(f, height, 0), width, 1)
+    alpha = f[..., 3:4]
+    f[..., :3] = np.where(alpha > 0, f[..., :3] * 255 / np.maximum(alpha, 1e-9), 0)
+    return np.clip(np.rint(f), 0, 255).astype(np.uint8)
+
+
+# ---------------------------------------------------------------------------
+# Sprite sheets
+# ---------------------------------------------------------------------------
+
+# Opaque pixels with every channel at or above this count as the white
+# background DALL-E draws sprite sheets on
+SPRITE_WHITE = 240
+# Rows/columns with no more foreground pixels than this are gaps (stray specks)
+SPRITE_NOISE_PIXELS = 2
+
+
+def _runs(profile) -> list[tuple[int, int]]:
+    """[start, end) spans where a boolean profile is True."""
+    np = _numpy()
+    edges = np.flatnonzero(np.diff(np.concatenate([[False], profile, [False]]).astype(np.int8)))
+    return [(int(a), int(b)) for a, b in zip(edges[::2], edges[1::2])]
+
+
+def _frame_spans(profile, count: int | None) -> list[tuple[int, int]]:
+    """Foreground spans along one axis, coerced to count frames if given.
+
+    Extra spans (a detached hand, a speck) are merged across the narrowest
+    gaps; too few (poses touching) fall back to an even split.
+    """
+    spans = _runs(profile)
+    if not count or not spans:
+        return spans
+    while len(spans) > count:
+        gaps = [spans[i + 1][0] - spans[i][1] for i in range(len(spans) - 1)]
+        i = gaps.index(min(gaps))
+        spans[i:i + 2] = [(spans[i][0], spans[i + 1][1])]
+    if len(spans) < count:
+        start, end = spans[0][0], spans[-1][1]
+        step = (end - start) / count
+        spans = [(start + round(i * step), start + round((i + 1) * step)) for i in range(count)]
+    return spans
+
+
+def _cells(spans: list[tuple[int, int]], length: int) -> list[tuple[int, int]]:
+    """Widen spans to cells that meet halfway across each gap and reach the edges."""
+    bounds = [0] + [(a[1] + b[0]) // 2 for a, b in zip(spans, spans[1:])] + [length]
+    return list(zip(bounds, bounds[1:]))
+
+
+def _fill_runs(seed, mask):
+    """Grow seed along rows to the whole mask run each seed pixel sits in."""
+    np = _numpy()
+    starts = mask & ~np.pad(mask, ((0, 0), (1, 0)))[:, :-1]
+    labels = np.cumsum(starts, axis=None).reshape(mask.shape) * mask
+    hit = np.zeros(labels.max() + 1, bool)
+    hit[labels[seed & mask]] = True
+    hit[0] = False
+    return hit[labels]
+
+
+def _border_background(background):
+    """Background pixels connected to the image border (scanline flood fill)."""
+    np = _numpy()
+    reach = np.zeros_like(background)
+    reach[[0, -1], :] = background[[0, -1], :]
+    reach[:, [0, -1]] = background[:, [0, -1]]
+    while True:
+        grown = _fill_runs(reach, background)
+        grown = _fill_runs(grown.T, background.T).T
+        if np.array_equal(grown, reach):
+            return reach
+        reach = grown
+
+
+def detect_frames(rgba, frames: int | None = None, rows: int = 1) -> list[dict]:
+    """Find sprite frames on a white or transparent background.
+
+    Rows of frames come from the row projection of the foreground mask and
+    frames within a row from its column projection. Returns one dict per
+    frame in reading order: "cell" is the frame's slot on the sheet and
+    "box" its trimmed content, both (x0, y0, x1, y1).
+    """
+    np = _numpy()
+    background = (rgba[..., 3] < 16) | (rgba[..., :3].min(axis=2) >= SPRITE_WHITE)
+    foreground = ~background
+    height, width = foreground.shape
+    per_row = -(-frames // rows) if frames else None
+
+    found = []
+    row_spans = _frame_spans(foreground.sum(axis=1) > SPRITE_NOISE_PIXELS, rows)
+    for (cy0, cy1), (y0, y1) in zip(_cells(row_spans, height), row_spans):
+        band = foreground[y0:y1]
+        col_spans = _frame_spans(band.sum(axis=0) > SPRITE_NOISE_PIXELS, per_row)
+        for (cx0, cx1), (x0, x1) in zip(_cells(col_spans, width), col_spans):
+            content = band[:, x0:x1]
+            ys = np.flatnonzero(content.any(axis=1))
+            xs = np.flatnonzero(content.any(axis=0))
+            if not len(xs):
+                continue
+            found.append({"cell": (cx0, cy0, cx1, cy1),
+                          "box": (x0 + int(xs[0]), y0 + int(ys[0]),
+                                  x0 + int(xs[-1]) + 1, y0 + int(ys[-1]) + 1)})
+    return found[:frames] if frames else found
+
+
+def pack_shelves(sizes: list[tuple[int, int]], padding: int = 2):
+    """Shelf-pack (w, h) rectangles, tallest first, into a roughly square atlas.
+
+    Returns ([(x, y) per rectangle], (atlas width, atlas height)).
+    """
+    import math
+
+    area = sum((w + padding) * (h + padding) for w, h in sizes)
+    width = max(max(w for w, _ in sizes) + 2 * padding, math.ceil(math.sqrt(area)) + padding)
+    positions = [None] * len(sizes)
+    x = y = padding
+    shelf = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+        w, h = sizes[i]
+        if x + w + padding > width:
+            x, y, shelf = padding, y + shelf + padding, 0
+        positions[i] = (x, y)
+        x += w + padding
+        shelf = max(shelf, h)
+    return positions, (width, y + shelf + padding)
+
+
+def _scaled_name(path: Path, scale: int) -> Path:
+    return path if scale == 1 else path.with_name(f"{path.stem}@{scale}x{path.suffix}")
+
+
+def make_sprite_atlas(sheet_path: str, frames: int | None = None, frame_size: int = 128,
+                      rows: int = 1, scales: list[int] = (1, 2, 3), padding: int = 2,
+                      transparent: bool = True) -> dict:
+    """Slice a sprite sheet into trimmed frames and pack them into an atlas.
+
+    frame_size is the larger side, in points (@1x pixels), of the biggest
+    frame slot; every frame is scaled by the same factor so poses keep their
+    relative size. Writes <stem>_atlas.png plus <stem>_atlas@Nx.png for each
+    other scale, and <stem>_atlas.json with each frame's rectangle in
+    points, its offset within its slot and the slot size (multiply by the
+    scale for pixels). With transparent, white background reachable from
+    the sheet's edges becomes transparent. Returns a summary for
+    results.json.
+    """
+    np = _numpy()
+    sheet = Path(sheet_path)
+    rgba = read_rgba(sheet_path)
+    found = detect_frames(rgba, frames, rows)
+    if not found:
+        raise ValueError(f"no sprite frames found in {sheet_path}")
+    if frames and len(found) != frames:
+        print(f"  WARNING: expected {frames} frames in {sheet.name}, found {len(found)}",
+              file=sys.stderr)
+    if transparent:
+        background = (rgba[..., :3].min(axis=2) >= SPRITE_WHITE) | (rgba[..., 3] < 16)
+        rgba = rgba.copy()
+        rgba[_border_background(background)] = 0
+
+    biggest = max(max(f["cell"][2] - f["cell"][0], f["cell"][3] - f["cell"][1]) for f in found)
+    k = frame_size / biggest
+    index = []
+    for i, f in enumerate(found):
+        (cx0, cy0, cx1, cy1), (x0, y0, x1, y1) = f["cell"], f["box"]
+        index.append({
+            "name": f"{sheet.stem}_{i}",
+            "size": (max(1, round((x1 - x0) * k)), max(1, round((y1 - y0) * k))),
+            "offset": {"x": round((x0 - cx0) * k), "y": round((y0 - cy0) * k)},
+            "source_size": {"w": round((cx1 - cx0) * k), "h": round((cy1 - cy0) * k)},
+        })
+    positions, (atlas_w, atlas_h) = pack_shelves([entry["size"] for entry in index], padding)
+
+    atlas_path = sheet.with_name(f"{sheet.stem}_atlas.png")
+    images = []
+    for scale in scales:
+        atlas = np.zeros((atlas_h * scale, atlas_w * scale, 4), np.uint8)
+        for f, entry, (x, y) in zip(found, index, positions):
+            x0, y0, x1, y1 = f["box"]
+            w, h = entry["size"]
+            frame = resize_rgba(rgba[y0:y1, x0:x1], w * scale, h * scale)
+            atlas[y * scale:(y + h) * scale, x * scale:(x + w) * scale] = frame
+        out = _scaled_name(atlas_path, scale)
+        write_png(str(out), atlas)
+        images.append(str(out))
+
+    for entry, (x, y) in zip(index, positions):
+        w, h = entry.pop("size")
+        entry["frame"] = {"x": x, "y": y, "w": w, "h": h}
+    index_path = atlas_path.with_suffix(".json")
+    index_path.write_text(json.dumps({
+        "image": atlas_path.name,
+        "scales": list(scales),
+        "size": {"w": atlas_w, "h": atlas_h},
+        "frames": index,
+    }, indent=2))
+    print(f"  Sprites: {len(index)} frames from {sheet.name} → {atlas_path.name} "
+          f"({atlas_w}x{atlas_h} pt, @{'x/@'.join(map(str, scales))}x)")
+    return {"atlas": str(index_path), "frames": len(index), "images": images,
+            "size": [atlas_w, atlas_h]}
+
+
+# ---------------------------------------------------------------------------
+# Palette quantization
+# ---------------------------------------------------------------------------
+
+# Palette sizes tried in turn; the first within the error budget wins
+QUANTIZE_COLORS = (16, 32, 64, 128, 256)
+# Mean CIE76 ΔE allowed between a quantized image and its original; ~2.3 is
+# a just-noticeable difference, and flat fills hit well under 1
+QUANTIZE_MAX_DELTA_E = 1.5
+# Pixels sampled to fit the palette on; every pixel is mapped afterwards
+QUANTIZE_SAMPLE = 20000
+
+# Linear sRGB → XYZ, and the D65 white point
+_SRGB_TO_XYZ = ((0.4124, 0.3576, 0.1805), (0.2126, 0.7152, 0.0722), (0.0193, 0.1192, 0.9505))
+_D65 = (0.95047, 1.0, 1.08883)
+
+
+def _perceptual(colors):
+    """CIELAB coordinates of (n, 4) RGBA colors, with alpha as a fourth axis if any isn't opaque."""
+    np = _numpy()
+    c = colors[:, :3] / 255.0
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array(_SRGB_TO_XYZ).T / np.array(_D65)
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    lab = np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], 1)
+    if (colors[:, 3] < 255).any():
+        lab = np.hstack([lab, colors[:, 3:4] * (100 / 255)])
+    return lab
+
+
+def _nearest(points, centers, block: int = 65536):
+    """(index of the nearest center, distance to it) for each point."""
+    np = _numpy()
+    labels = np.empty(len(points), np.intp)
+    dist = np.empty(len(points))
+    c2 = (centers ** 2).sum(1)
+    for i in range(0, len(points), block):
+        p = points[i:i + block]
+        d2 = (p ** 2).sum(1)[:, None] - 2 * p @ centers.T + c2
+        labels[i:i + block] = d2.argmin(1)
+        dist[i:i + block] = np.sqrt(np.maximum(d2[np.arange(len(p)), labels[i:i + block]], 0))
+    return labels, dist
+
+
+def _kmeans(points, weights, k: int, iterations: int = 15, seed: int = 0):
+    """Weighted k-means with k-means++ seeding; returns the centers."""
+    np = _numpy()
+    rng = np.random.default_rng(seed)
+    centers = [points[rng.choice(len(points), p=weights / weights.sum())]]
+    closest = ((points - centers[0]) ** 2).sum(1)
+    for _ in range(1, k):
+        score = closest * weights
+        if not score.any():
+            break
+        centers.append(points[rng.choice(len(points), p=score / score.sum())])
+        closest = np.minimum(closest, ((points - centers[-1]) ** 2).sum(1))
+    centers = np.array(centers)
+    for _ in range(iterations):
+        labels, _ = _nearest(points, centers)
+        mass = np.bincount(labels, weights, len(centers))
+        sums = np.stack([np.bincount(labels, weights * points[:, d], len(centers))
+                         for d in range(points.shape[1])], 1)
+        moved = np.where(mass[:, None] > 0, sums / np.maximum(mass, 1e-12)[:, None], centers)
+        if np.abs(moved - centers).max() < 0.05:
+            break
+        centers = moved
+    return centers
+
+
+def _fit_palette(colors, counts, features, sample, k: int):
+    """An RGBA palette of up to k colors for the unique colors, and each one's index in it."""
+    np = _numpy()
+    centers = _kmeans(features[sample[0]], sample[1].astype(float), k)
+    labels, _ = _nearest(features, centers)
+    # Palette entries are their members' mean color, so the error is measured on what's written
+    mass = np.bincount(labels, counts, len(centers))
+    used = mass > 0
+    palette = np.stack([np.bincount(labels, counts * colors[:, d], len(centers))
+                        for d in range(4)], 1)[used] / mass[used, None]
+    palette = np.clip(np.rint(palette), 0, 255).astype(np.uint8)
+    labels, dist = _nearest(features, _perceptual(palette))
+    return palette, labels, dist
+
+
+def quantize_png(path: str, max_delta_e: float = QUANTIZE_MAX_DELTA_E, max_colors: int = 256,
+                 sample: int = QUANTIZE_SAMPLE) -> dict:
+    """Shrink a PNG in place: an indexed palette if one fits the error budget.
+
+    Palettes of QUANTIZE_COLORS sizes (up to max_colors) are fitted with
+    k-means in CIELAB over a pixel sample; the first whose mean ΔE (CIE76)
+    over all pixels is within max_delta_e is written as an indexed PNG.
+    Otherwise the image is re-encoded losslessly. Either way only image
+    chunks are written, so metadata is stripped, and the file is left alone
+    if that isn't smaller. Returns sizes and the error for results.json.
+    """
+    np = _numpy()
+    before = os.path.getsize(path)
+    rgba = read_rgba(path)
+    height, width, _ = rgba.shape
+    pixels = rgba.reshape(-1, 4).copy()
+    pixels[pixels[:, 3] == 0] = 0  # color under full transparency doesn't matter
+    keys, inverse, counts = np.unique(pixels.view(np.uint32).ravel(), return_inverse=True,
+                                      return_counts=True)
+    colors = keys.view(np.uint8).reshape(-1, 4)
+
+    stats = {"path": str(path), "bytes_before": before, "colors": int(len(colors)),
+             "delta_e": 0.0, "delta_e_p95": 0.0}
+    if len(colors) <= max_colors:
+        palette, labels = colors, np.arange(len(colors))
+        stats["mode"] = "indexed"
+    else:
+        features = _perceptual(colors)
+        rng = np.random.default_rng(0)
+        sampled = np.unique(inverse[rng.integers(0, len(inverse), sample)], return_counts=True)
+        for k in [k for k in QUANTIZE_COLORS if k < max_colors] + [max_colors]:
+            palette, labels, dist = _fit_palette(colors, counts, features, sampled, k)
+            mean = float((dist * counts).sum() / counts.sum())
+            if mean <= max_delta_e:
+                order = np.argsort(dist)
+                p95 = dist[order][np.searchsorted(np.cumsum(counts[order]), 0.95 * counts.sum())]
+                stats.update(mode="indexed", colors=len(palette), delta_e=round(mean, 3),
+                             delta_e_p95=round(float(p95), 3))
+                break
+        else:
+            stats.update(mode="lossless", best_delta_e=round(mean, 3))
+
+    if stats["mode"] == "indexed":
+        # Translucent entries first keeps tRNS short; then most used first
+        usage = np.bincount(labels, counts, len(palette))
+        order = np.lexsort((-usage, palette[:, 3] == 255))
+        remap = np.empty(len(order), np.intp)
+        remap[order] = np.arange(len(order))
+        png = encode_indexed_png(remap[labels][inverse].reshape(height, width), palette[order])
+    else:
+        png = encode_png(rgba)
+
+    if len(png) < before:
+        _write_atomic(path, png)
+    else:
+        stats["mode"] = "original"
+    stats["bytes_after"] = os.path.getsize(path)
+    saved = 1 - stats["bytes_after"] / before
+    error = f", ΔE {stats['delta_e']:.2f} (p95 {stats['delta_e_p95']:.2f})" \
+        if stats["mode"] == "indexed" else ""
+    print(f"  Optimized: {Path(path).name} {stats['mode']}, {stats['colors']} colors{error}, "
+          f"{before / 1024:.0f} KB → {stats['bytes_after'] / 1024:.0f} KB (-{saved:.0%})")
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# HTML link extraction
+# ---------------------------------------------------------------------------
+
+_URL_TAIL = r"""[^"'\\<>\s})]+"""
+# A character no URL match contains: once one follows, the match can't grow
+_URL_END = re.compile(r"""["'\\<>\s})]""")
+
+# Every URL kind the scrapers look for: the literal its matches start with,
+# the rest of the pattern, and a character no match contains. Starting
+# with a literal lets re find candidates with a fast substring search; one
+# alternation of all of them has no common prefix and is tried at every
+# character, some 20x slower on a 300 KB search page.
+_LINK_KINDS = {
+    "pixabay_audio": ("https://cdn.pixabay.com/audio/",
+                      rf"\d{{4}}/{_URL_TAIL}\.(?:mp3|wav|ogg|m4a)", _URL_END),
+    "pixabay_download": ("https://cdn.pixabay.com/download/audio",
+                         rf"{_URL_TAIL}\.(?:mp3|wav|ogg|m4a)", _URL_END),
+    "freesound_cdn": ("https://cdn.freesound.org/previews/",
+                      rf"{_URL_TAIL}\.(?:mp3|wav|ogg)", _URL_END),
+    "freesound_data": ("https://freesound.org/data/previews/",
+                       rf"{_URL_TAIL}\.(?:mp3|wav|ogg)", _URL_END),
+    # Pixabay sound pages look like: /sound-effects/rain-patter-12345/
+    "slug": ("/sound-effects/", r"([\w-]+-\d+)/", re.compile(r"[^\w/-]")),
+}
+_LINK_PATTERNS = {kind: re.compile(re.escape(prefix) + rest)
+                  for kind, (prefix, rest, _) in _LINK_KINDS.items()}
+# Search-result previews on Freesound: /previews/<folder>/<id>_<user>-<hq|lq>-preview*.mp3
+_FREESOUND_PREVIEW_RE = re.compile(r"/previews/\d+/\d+_\d+-[a-z]+-preview[^/]*\.mp3$")
+
+
+class LinkExtractor:
+    """Pulls audio URLs and sound-page slugs out of HTML as it streams in.
+
+    Feed it chunks as they arrive; matches are collected per kind in
+    document order with duplicates dropped. A match can span chunks, so
+    from the first literal prefix that more data could still turn into (or
+    extend) a match, the text is held back until that data (or the end)
+    arrives, however long the URL. stop(found) is checked after each chunk;
+    once it returns True, done is set and the caller can stop reading.
+    """
+
+    def __init__(self, stop=None):
+        import codecs
+        self.found = {kind: [] for kind in _LINK_PATTERNS}
+        self.done = False
+        self._stop = stop
+        self._seen = set()
+        self._buf = ""
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def feed(self, data: bytes, final: bool = False) -> bool:
+        """Scan another chunk; returns done."""
+        if self.done:
+            return True
+        self._buf += self._decoder.decode(data, final)
+        cut = len(self._buf)
+        tails = {}
+        for kind, (prefix, _, end) in _LINK_KINDS.items():
+            if final:
+                held = cut
+            else:
+                if end not in tails:
+                    tails[end] = _after_last(self._buf, end)
+                held = _open_match(self._buf, prefix, tails[end])
+            cut = min(cut, held)
+            for m in _LINK_PATTERNS[kind].finditer(self._buf):
+                if m.start() >= held:
+                    # May continue in the next chunk: rescanned from there
+                    break
+                self._add(kind, m)
+        self._buf = self._buf[cut:]
+        if final or (self._stop and self._stop(self.found)):
+            self.done = True
+        return self.done
+
+    def _add(self, kind: str, m: re.Match):
+        # A match rescanned after a cut is dropped here
+        value = m.group(1) if m.lastindex else m.group().rstrip(".,;")
+        if (kind, value) not in self._seen:
+            self._seen.add((kind, value))
+            self.found[kind].append(value)
+
+
+def _after_last(text: str, end: re.Pattern) -> int:
+    """Index just past the last end character in text (0 if there is none)."""
+    window = 64
+    while True:
+        start = max(len(text) - window, 0)
+        last = None
+        for last in end.finditer(text, start):
+            pass
+        if last or not start:
+            return last.end() if last else 0
+        window *= 8
+
+
+def _open_match(text: str, prefix: str, tail: int) -> int:
+    """Where the earliest match for prefix that more text could still complete starts.
+
+    Matches contain no end character, so only text from tail (see
+    _after_last) on can hold one: the first prefix there, else a start of
+    prefix cut off by the end of text; len(text) if neither.
+    """
+    at = text.find(prefix, tail)
+    if at != -1:
+        return at
+    at = text.find(prefix[0], max(len(text) - len(prefix) + 1, tail))
+    while at != -1 and not prefix.startswith(text[at:]):
+        at = text.find(prefix[0], at + 1)
+    return len(text) if at == -1 else at
+
+
+@phase("scrape")
+def extract_links(url: str, stop=None, timeout: float | None = None) -> dict[str, list[str]]:
+    """Fetch an HTML page and return the links LinkExtractor finds, by kind.
+
+    The body is scanned as it streams in; once stop(found) is satisfied the
+    rest of the page is not read.
+    """
+    _span_note("url", url)
+    extractor = LinkExtractor(stop)
+    with _session().open(url, headers={"Accept": "text/html"}, timeout=timeout) as resp:
+        while not extractor.done:
+            chunk = resp.read(DOWNLOAD_CHUNK_SIZE)
+            _span_count("bytes", len(chunk))
+            extractor.feed(chunk, final=not chunk)
+    return extractor.found
+
+
+# ---------------------------------------------------------------------------
+# Audio: search + download
+# ---------------------------------------------------------------------------
+
+def _search_pixabay(query: str) -> list[dict]:
+    """Search Pixabay sound effects through the search cache."""
+    return cached_search("pixabay", query, _scrape_pixabay)
+
+
+def _search_freesound(query: str) -> list[dict]:
+    """Search Freesound CC0 sounds through the search cache."""
+    return cached_search("freesound", query, _scrape_freesound)
+
+
+def _scrape_pixabay(query: str) -> list[dict] | None:
+    """Search Pixabay sound effects, return list of {url, title, slug}.
+
+    Pixabay serves audio via JavaScript, so we can't extract direct CDN URLs
+    from the HTML. Instead we extract the sound page slugs so the user (or
+    Claude via WebSearch) can find the direct download URL.
+
+    If slug pages contain an embedded audio URL we grab it; otherwise we
+    return the page URL for manual download. Returns None if the search
+    request itself failed.
+    """
+    encoded_q = urllib.parse.quote_plus(query)
+    search_url = f"https://pixabay.com/sound-effects/search/{encoded_q}/"
+
+    print(f"  Searching Pixabay: {search_url}")
+    try:
+        found = extract_links(search_url)
+    except Exception as e:
+        print(f"  WARNING: Pixabay search failed: {e}", file=sys.stderr)
+        return None
+
+    # Direct CDN audio URLs first (sometimes present in JSON-LD or preload)
+    direct_urls = found["pixabay_audio"] + found["pixabay_download"]
+    if direct_urls:
+        results = []
+        for url in direct_urls:
+            name = Path(urllib.parse.urlparse(url).path).stem
+            results.append({"url": url, "title": name, "source": "pixabay"})
+        return results
+
+    # Fallback: individual sound page links, skipping "search" slugs
+    results = []
+    for slug in found["slug"]:
+        if not slug.startswith("search"):
+            page_url = f"https://pixabay.com/sound-effects/{slug}/"
+            title = slug.rsplit("-", 1)[0].replace("-", " ").title()
+            results.append({"url": page_url, "title": title, "source": "pixabay",
+                            "is_page": True, "slug": slug})
+
+    return results
+
+
+def _scrape_freesound(query: str) -> list[dict] | None:
+    """Search Freesound for CC0 sounds, return preview URLs (no OAuth needed).
+
+    Returns None if the search request itself failed.
+    """
+    encoded_q = urllib.parse.quote_plus(query)
+    # Freesound search page filtered to CC0 only
+    search_url = (
+        f"https://freesound.org/search/?q={encoded_q}"
+        f"&f=license:%22Creative+Commons+0%22&s=rating+desc"
+    )
+
+    print(f"  Searching Freesound CC0: {search_url}")
+    try:
+        found = extract_links(search_url)
+    except Exception as e:
+        print(f"  WARNING: Freesound search failed: {e}", file=sys.stderr)
+        return None
+
+    # Preview MP3 URLs, embedded in data-mp3 attributes or player elements
+    results = []
+    for url in found["freesound_data"] + found["freesound_cdn"]:
+        if _FREESOUND_PREVIEW_RE.search(url):
+            name = Path(urllib.parse.urlparse(url).path).stem
+            results.append({"url": url, "title": name, "source": "freesound-cc0"})
+
+    return results
+
+
+@phase("search")
+def search_audio(query: str, source: str = "pixabay") -> list[dict]:
+    """Search for audio across supported sources."""
+    _span_note("query", query)
+    _span_note("source", source)
+    with _limit("search"):
+        results = _search_audio(query, source)
+    _span_note("results", len(results))
+    return results
+
+
+def _search_audio(query: str, source: str) -> list[dict]:
+    if source == "pixabay":
+        return _search_pixabay(query)
+    elif source == "freesound":
+        return _search_freesound(query)
+    elif source == "all":
+        # Both scrapes are network-bound; run them side by side
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="search") as pool:
+            pixabay = pool.submit(contextvars.copy_context().run, _search_pixabay, query)
+            freesound = pool.submit(contextvars.copy_context().run, _search_freesound, query)
+            return pixabay.result() + freesound.result()
+    else:
+        print(f"  ERROR: Unknown source '{source}'. Use: pixabay, freesound, all", file=sys.stderr)
+        return []
+
+
+def list_audio(query: str, source: str = "pixabay"):
+    """List search results without downloading."""
+    results = search_audio(query, source)
+    if not results:
+        print(f"  No results found for '{query}' on {source}")
+        return
+
+    print(f"\n  Found {len(results)} result(s) for '{query}':")
+    for i, r in enumerate(results[:10]):
+        license_tag = "Pixabay License" if r["source"] == "pixabay" else "CC0"
+        print(f"    [{i}] [{license_tag}] {r['title']}")
+        print(f"        {r['url']}")
+
+
+# Direct audio links on a sound page, most preferred first
+_PAGE_AUDIO_KINDS = ("pixabay_audio", "pixabay_download", "freesound_cdn", "freesound_data")
+
+
+def _page_audio_urls(found: dict, kind: str) -> list[str]:
+    return [url for url in found[kind] if not url.endswith(".m4a")]
+
+
+def _try_extract_audio_from_page(page_url: str, timeout: float | None = None) -> str | None:
+    """Try to fetch a Pixabay/Freesound sound page and extract a direct audio URL."""
+    # A Pixabay CDN link is the best possible answer, so stop reading there
+    def stop(found):
+        return bool(_page_audio_urls(found, _PAGE_AUDIO_KINDS[0]))
+
+    try:
+        with _limit("search"):
+            found = extract_links(page_url, stop, timeout)
+    except Exception:
+        return None
+
+    for kind in _PAGE_AUDIO_KINDS:
+        urls = _page_audio_urls(found, kind)
+        if urls:
+            return urls[0]
+
+    return None
+
+
+def resolve_page_result(results: list[dict], pick: int, k: int = None,
+                        timeout: float = None) -> tuple[int, str] | None:
+    """Find a direct audio URL behind the sound-page results, hedging across pages.
+
+    Fetches the pick's page and the next top-ranked page results, up to k
+    pages in all, concurrently and with a per-request timeout. Ranking is
+    pick first, then search order. The best-ranked page that yields a URL
+    wins once every page ranked above it has failed, so the pick is
+    preferred whenever it succeeds. Returns (result index, audio URL), or
+    None if no page yields one.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    k = k or PAGE_HEDGE_COUNT
+    timeout = timeout or PAGE_TIMEOUT
+    others = [i for i, r in enumerate(results) if i != pick and r.get("is_page")]
+    order = [pick] + others[:k - 1]
+
+    pool = ThreadPoolExecutor(max_workers=len(order), thread_name_prefix="page")
+    try:
+        futures = {pool.submit(contextvars.copy_context().run, _try_extract_audio_from_page,
+                               results[i]["url"], timeout): i for i in order}
+        resolved = {}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                resolved[futures[f]] = f.result()
+            for i in order:
+                if i not in resolved:
+                    break
+                if resolved[i]:
+                    return i, resolved[i]
+        return None
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Manifest/CLI limits a search result must meet (see probe_candidates)
+AUDIO_CONSTRAINTS = ("max_duration", "max_bytes", "mono")
+
+
+def _ffprobe_head(data: bytes) -> dict:
+    """Codec, channels, sample rate and bit rate of the first audio stream in data."""
+    import shutil
+    import subprocess
+
+    if not shutil.which("ffprobe"):
+        return {}
+    result = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_format",
+                             "-show_streams", "-of", "json", "pipe:0"],
+                            input=data, capture_output=True)
+    try:
+        probe = json.loads(result.stdout or b"{}")
+    except ValueError:
+        return {}
+    streams = probe.get("streams") or [{}]
+    stream, fmt = streams[0], probe.get("format", {})
+
+    def number(*values):
+        for value in values:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                continue
+        return None
+
+    info = {"codec": stream.get("codec_name"), "channels": stream.get("channels"),
+            "sample_rate": number(stream.get("sample_rate")),
+            "bit_rate": number(stream.get("bit_rate"), fmt.get("bit_rate")),
+            "duration": number(stream.get("duration"), fmt.get("duration"))}
+    return {k: v for k, v in info.items() if v is not None}
+
+
+def probe_audio(url: str, timeout: float | None = None) -> dict:
+    """Size, type, codec, channels and duration of a remote audio file.
+
+    Sends a HEAD, then Range-fetches the first PROBE_BYTES and runs ffprobe
+    on them. Duration is the full size over the stream's bit rate, since
+    ffprobe only sees the head; without ffprobe only size and type are known.
+    """
+    import urllib.error
+
+    session = _session()
+    info = {"url": url}
+    with _limit("download"):
+        try:
+            with session.open(url, method="HEAD", timeout=timeout) as resp:
+                info["type"] = resp.headers.get("Content-Type")
+                if resp.headers.get("Content-Length"):
+                    info["bytes"] = int(resp.headers["Content-Length"])
+        except urllib.error.HTTPError:
+            pass  # Some CDNs refuse HEAD; the ranged GET still gives the size
+        with session.open(url, headers={"Range": f"bytes=0-{PROBE_BYTES - 1}"},
+                          timeout=timeout) as resp:
+            head = resp.read(PROBE_BYTES)
+            info.setdefault("type", resp.headers.get("Content-Type"))
+            total = (resp.headers.get("Content-Range") or "").rpartition("/")[2]
+            if resp.status == 206 and total.isdigit():
+                info["bytes"] = int(total)
+            elif resp.status == 200 and resp.headers.get("Content-Length"):
+                info.setdefault("bytes", int(resp.headers["Content-Length"]))
+    _span_count("bytes", len(head))
+    if (info.get("type") or "").startswith("text/"):
+        raise ValueError(f"not audio ({info['type']})")
+
+    found = _ffprobe_head(head)
+    size = info.get("bytes")
+    if found.get("bit_rate") and size and size > len(head):
+        found["duration"] = round(size * 8 / found["bit_rate"], 2)
+    elif size and size > len(head):
+        found.pop("duration", None)  # Only describes the bytes ffprobe was given
+    found.pop("bit_rate", None)
+    return {**info, **found}
+
+
+def _probe_result(result: dict, timeout: float) -> dict:
+    url = result["url"]
+    if result.get("is_page"):
+        url = _try_extract_audio_from_page(url, timeout)
+        if not url:
+            raise ValueError("no audio link on page")
+    return probe_audio(url, timeout)
+
+
+def constraint_misses(info: dict, constraints: dict) -> tuple[list[str], list[str]]:
+    """(constraints info breaks, constraints it could not be checked against)."""
+    broken, unknown = [], []
+    checks = [("max_duration", "duration", lambda v, limit: v <= limit),
+              ("max_bytes", "bytes", lambda v, limit: v <= limit),
+              ("mono", "channels", lambda v, limit: v == 1)]
+    for name, key, ok in checks:
+        if not constraints.get(name):
+            continue
+        if info.get(key) is None:
+            unknown.append(name)
+        elif not ok(info[key], constraints[name]):
+            broken.append(name)
+    return broken, unknown
+
+
+def probe_candidates(results: list[dict], pick: int, constraints: dict, k: int = None,
+                     timeout: float = None) -> list[dict]:
+    """Probe the top-k search results concurrently and rank them against constraints.
+
+    Ranking is pick first, then search order; page results are resolved to
+    a direct URL first. Returns the probes best first: candidates meeting
+    every constraint, then those that could not be checked, then those
+    breaking the fewest by the smallest margin. Failed probes are dropped.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    k = k or PROBE_COUNT
+    timeout = timeout or PAGE_TIMEOUT
+    order = [pick] + [i for i in range(len(results)) if i != pick][:k - 1]
+    with ThreadPoolExecutor(max_workers=len(order), thread_name_prefix="probe") as pool:
+        futures = [(i, pool.submit(contextvars.copy_context().run, _probe_result, results[i],
+                                   timeout)) for i in order]
+    probes = []
+    for rank, (i, future) in enumerate(futures):
+        try:
+            info = future.result()
+        except Exception as e:
+            print(f"    [{i}] probe failed: {e}")
+            continue
+        broken, unknown = constraint_misses(info, constraints)
+        probes.append({"index": i, "rank": rank, **info, "broken": broken, "unknown": unknown})
+
+    def overshoot(probe):
+        # How far past its limits a candidate is, as a multiple of the limit
+        keys = {"max_duration": "duration", "max_bytes": "bytes"}
+        return sum(probe[keys[name]] / constraints[name]
+                   for name in probe["broken"] if name in keys)
+
+    probes.sort(key=lambda p: (len(p["broken"]), len(p["unknown"]), overshoot(p), p["rank"]))
+    return probes
+
+
+def _describe_probe(probe: dict) -> str:
+    parts = []
+    if "duration" in probe:
+        parts.append(f"{probe['duration']:.1f}s")
+    if "bytes" in probe:
+        parts.append(f"{probe['bytes'] / 1024:.0f} KB")
+    if "codec" in probe:
+        parts.append(probe["codec"])
+    if "channels" in probe:
+        parts.append({1: "mono", 2: "stereo"}.get(probe["channels"], f"{probe['channels']} ch"))
+    if probe["broken"]:
+        parts.append("breaks " + ", ".join(probe["broken"]))
+    return ", ".join(parts) or "unknown"
+
+
+def search_and_download_audio(query: str, output_path: str, fmt: str = None,
+                               source: str = "pixabay", pick: int = 0,
+                               outputs: list[dict] | None = None,
+                               constraints: dict | None = None):
+    """Search for audio, download the best (or Nth) match, convert to target format.
+
+    outputs, if given, is passed on to download_audio. constraints
+    (max_duration seconds, max_bytes, mono) make the top results get probed
+    first, and the best one meeting them is downloaded instead of the pick.
+    """
+    results = search_audio(query, source)
+
+    if not results:
+        print(f"  TIP: Try a different query, source, or provide a direct --url.", file=sys.stderr)
+        raise AssetError(f"No results found for '{query}' on {source}")
+
+    print(f"  Found {len(results)} result(s):")
+    for i, r in enumerate(results[:5]):
+        marker = " <<<" if i == pick else ""
+        page_tag = " [page link]" if r.get("is_page") else ""
+        print(f"    [{i}] {r['title']} ({r['source']}){page_tag}{marker}")
+
+    if pick >= len(results):
+        pick = 0
+    chosen = results[pick]
+
+    if any((constraints or {}).get(name) for name in AUDIO_CONSTRAINTS):
+        with phase("probe"):
+            probes = probe_candidates(results, pick, constraints)
+            _span_note("candidates", len(probes))
+        if not probes:
+            raise AssetError(f"Could not probe any of the top results for '{query}'")
+        print(f"  Probed {len(probes)} candidate(s):")
+        for probe in sorted(probes, key=lambda p: p["rank"]):
+            marker = " <<<" if probe is probes[0] else ""
+            print(f"    [{probe['index']}] {_describe_probe(probe)}{marker}")
+        best = probes[0]
+        if best["broken"]:
+            print(f"  WARNING: no candidate meets {', '.join(best['broken'])}; "
+                  f"using the closest", file=sys.stderr)
+        _note("probe", {k: best[k] for k in ("index", "duration", "bytes", "codec", "channels")
+                        if k in best})
+        pick, chosen = best["index"], {**results[best["index"]], "url": best["url"],
+                                             "is_page": False}
+
+    # If we got a page URL instead of a direct audio URL, try to extract the audio
+    if chosen.get("is_page"):
+        print(f"  Got page URL, attempting to extract audio from: {chosen['url']}")
+        resolved = resolve_page_result(results, pick)
+        if resolved:
+            index, direct_url = resolved
+            if index != pick:
+                print(f"  No audio on [{pick}]; using [{index}] {results[index]['title']} instead")
+                pick, chosen = index, results[index]
+            print(f"  Found direct audio URL: {direct_url[:80]}...")
+            chosen["url"] = direct_url
+        else:
+            print(f"  TIP: Visit the page in a browser, copy the download URL,", file=sys.stderr)
+            print(f"       then use: python3 tools/asset_fetcher.py audio --url <URL> --output {output_path}", file=sys.stderr)
+            raise AssetError(f"Could not extract audio URL from page: {chosen['url']}")
+
+    print(f"  Downloading: [{pick}] {chosen['title']} ({chosen['source']})")
+    return download_audio(chosen["url"], output_path, fmt, outputs=outputs)
+
+
+def _scratch_path(url: str, output_path: str, suffix: str) -> str:
+    """Stable temp path for a download, so an interrupted run can resume it."""
+    import hashlib
+    import tempfile
+    key = hashlib.sha1(f"{url}\0{Path(output_path).resolve()}".encode()).hexdigest()[:16]
+    scratch = Path(tempfile.gettempdir()) / "asset_fetcher"
+    scratch.mkdir(exist_ok=True)
+    return str(scratch / f"{key}{suffix}")
+
+
+def download_audio(url: str, output_path: str, fmt: str = None, sha256: str = None,
+                   outputs: list[dict] | None = None):
+    """Download audio from URL and convert to target format.
+
+    outputs, a list of output_spec dicts, replaces output_path/fmt when one
+    source should become several files (formats, bitrates, ...); they are
+    all written by a single ffmpeg run.
+    """
+    output = Path(output_path)
+    fmt = fmt or output.suffix.lstrip(".").lower()
+    outputs = outputs or [output_spec(output_path, fmt)]
+    for out in outputs:
+        Path(out["path"]).parent.mkdir(parents=True, exist_ok=True)
+    _note("source_url", url)
+
+    with deduplicated({"source": f"url:{url}", **output_signature(outputs)}, outputs) as reused:
+        if reused:
+            return output_path
+        # Infer source format from URL
+        src_fmt = Path(urllib.parse.urlparse(url).path).suffix.lstrip(".").lower() or "mp3"
+        if (len(outputs) == 1 and src_fmt == outputs[0]["format"] and not outputs[0]["options"]
+                and "analyze" not in outputs[0]):
+            download_file(url, outputs[0]["path"], sha256=sha256)
+            print(f"  No conversion needed — saved as {outputs[0]['path']}")
+        else:
+            fetch_and_convert(url, outputs, sha256)
+
+    return output_path
+
+
+# ---------------------------------------------------------------------------
+# Incremental builds
+# ---------------------------------------------------------------------------
+
+LOCK_VERSION = 2
+
+
+def _entry_hash(entry: dict, output_path: str) -> str:
+    import hashlib
+    blob = json.dumps({"entry": entry, "output": output_path}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def _file_sha256(path) -> str:
+    import hashlib
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _fingerprint(path: str) -> dict:
+    st = os.stat(path)
+    return {"sha256": _file_sha256(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _output_unchanged(path: str, recorded: dict) -> bool:
+    """True if path still holds the bytes recorded in the lockfile.
+
+    A matching size and mtime is trusted, so a no-op run hashes nothing.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if st.st_size != recorded["size"]:
+        return False
+    if st.st_mtime_ns == recorded["mtime_ns"]:
+        return True
+    return _file_sha256(path) == recorded["sha256"]
+
+
+def load_lock(lock_path: Path) -> dict:
+    try:
+        lock = json.loads(lock_path.read_text())
+    except (OSError, ValueError):
+        return {}
+    if lock.get("version") != LOCK_VERSION:
+        return {}
+    return lock.get("entries", {})
+
+
+def lock_is_current(locked: dict | None, entry_hash: str) -> bool:
+    """True if a locked entry was built from the same inputs and its outputs are intact."""
+    if not locked or locked.get("entry_hash") != entry_hash:
+        return False
+    for convert in locked.get("convert") or []:
+        if convert["args"] != ffmpeg_output_args(convert["format"], **convert["options"]):
+            return False
+    outputs = locked.get("outputs") or {}
+    return bool(outputs) and all(_output_unchanged(p, rec) for p, rec in outputs.items())
+
+
+def lock_entry(entry_hash: str, notes: dict, outputs: list[str]) -> dict:
+    """Lockfile record for a freshly built entry."""
+    return {
+        "entry_hash": entry_hash,
+        "source_url": notes.get("source_url"),
+        "convert": notes.get("convert"),
+        "outputs": {path: _fingerprint(path) for path in outputs},
+    }
+
+
+def write_lock(lock_path: Path, entries: dict):
+    tmp = lock_path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"version": LOCK_VERSION, "entries": entries}, indent=2))
+    os.replace(tmp, lock_path)
+
+
+# ---------------------------------------------------------------------------
+# Asset packs
+# ---------------------------------------------------------------------------
+#
+# One file holding every built asset, for the app to mmap and slice:
+#
+#   header (64 bytes)  magic "AFPK", version, header size, alignment, entry
+#                      count, index offset and length, index CRC-32
+#   data               each asset's bytes, starting on an `alignment` boundary
+#   index              one 64-byte record per asset, sorted by name: offset,
+#                      length, SHA-256, type (file extension), name offset
+#                      and length into the string table that follows
+#
+# All integers are little-endian. Repacking appends only new or changed
+# assets and a fresh index, then rewrites the header; the space they leave
+# behind is reclaimed by a full rewrite once it outgrows the live data.
+
+PACK_MAGIC = b"AFPK"
+PACK_VERSION = 1
+# Data alignment; a cache line keeps zero-copy slices friendly to SIMD loads
+PACK_ALIGN = 64
+
+_PACK_HEADER = struct.Struct("<4sHHIIQQI28x")
+_PACK_ENTRY = struct.Struct("<QQ32s8sIH2x")
+
+
+class AssetPack:
+    """A pack file mapped read-only; data(name) is a zero-copy memoryview."""
+
+    def __init__(self, path):
+        import mmap
+
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_index()
+        except Exception:
+            self._map.close()
+            raise
+
+    def _read_index(self):
+        import zlib
+
+        if len(self._map) < _PACK_HEADER.size:
+            raise ValueError(f"{self.path} is not an asset pack")
+        (magic, version, header_size, self.align, count, self.index_offset, self.index_length,
+         index_crc) = _PACK_HEADER.unpack_from(self._map, 0)
+        if magic != PACK_MAGIC:
+            raise ValueError(f"{self.path} is not an asset pack")
+        if version != PACK_VERSION:
+            raise ValueError(f"{self.path}: unsupported pack version {version}")
+        end = self.index_offset + self.index_length
+        if end > len(self._map) or count * _PACK_ENTRY.size > self.index_length:
+            raise ValueError(f"{self.path}: index out of bounds (truncated file?)")
+        index = self._map[self.index_offset:end]
+        if zlib.crc32(index) != index_crc:
+            raise ValueError(f"{self.path}: index checksum mismatch")
+        names = index[count * _PACK_ENTRY.size:]
+        self.entries = []
+        for i in range(count):
+            offset, length, digest, kind, name_at, name_len = _PACK_ENTRY.unpack_from(
+                index, i * _PACK_ENTRY.size)
+            self.entries.append({
+                "name": names[name_at:name_at + name_len].decode("utf-8"),
+                "type": kind.rstrip(b"\0").decode("ascii"),
+                "offset": offset, "length": length, "sha256": digest.hex(),
+            })
+        self._by_name = {entry["name"]: entry for entry in self.entries}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
+
+    def close(self):
+        # Views handed out by data() must be released first
+        with contextlib.suppress(BufferError):
+            self._map.close()
+
+    @property
+    def size(self) -> int:
+        return len(self._map)
+
+    def dead_bytes(self) -> int:
+        """Bytes not used by the header, live data or index (left by repacks)."""
+        used = sum(entry["length"] for entry in self.entries)
+        return self.size - _PACK_HEADER.size - used - self.index_length
+
+    def data(self, name: str) -> memoryview:
+        entry = self._by_name[name]
+        return memoryview(self._map)[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def verify(self) -> list[str]:
+        """Problems found (bounds, alignment, overlaps, content hashes); empty if sound."""
+        import hashlib
+
+        problems = []
+        last_end, last_name = _PACK_HEADER.size, None
+        for entry in sorted(self.entries, key=lambda e: e["offset"]):
+            name, offset, length = entry["name"], entry["offset"], entry["length"]
+            if offset % self.align:
+                problems.append(f"{name}: offset {offset} not aligned to {self.align}")
+            if offset < last_end:
+                problems.append(f"{name}: overlaps {last_name or 'the header'}")
+            if offset + length > self.index_offset:
+                problems.append(f"{name}: runs past the data section")
+                continue
+            with self.data(name) as view:
+                if hashlib.sha256(view).hexdigest() != entry["sha256"]:
+                    problems.append(f"{name}: content hash mismatch")
+            last_end, last_name = offset + length, name
+        return problems
+
+
+def _pack_index(entries: list[dict]) -> bytes:
+    records, names = [], b""
+    for entry in sorted(entries, key=lambda e: e["name"]):
+        name = entry["name"].encode("utf-8")
+        records.append(_PACK_ENTRY.pack(entry["offset"], entry["length"],
+                                        bytes.fromhex(entry["sha256"]),
+                                        entry["type"].encode("ascii")[:8], len(names), len(name)))
+        names += name
+    return b"".join(records) + names
+
+
+def _pack_header(align: int, entries: list[dict], index_offset: int, index: bytes) -> bytes:
+    import zlib
+    return _PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, _PACK_HEADER.size, align, len(entries),
+                             index_offset, len(index), zlib.crc32(index))
+
+
+def _append_aligned(f, src: str, align: int) -> tuple[int, int]:
+    """Copy file src to the end of f on an align boundary; returns (offset, length)."""
+    import shutil
+
+    end = f.seek(0, os.SEEK_END)
+    offset = -(-end // align) * align
+    f.write(b"\0" * (offset - end))
+    with open(src, "rb") as s:
+        shutil.copyfileobj(s, f, DOWNLOAD_CHUNK_SIZE)
+    return offset, f.tell() - offset
+
+
+def write_pack(pack_path: str, files: dict[str, str], digests: dict[str, str] | None = None,
+               align: int = PACK_ALIGN) -> dict:
+    """Pack files ({name: path}) into pack_path, reusing what an existing pack already holds.
+
+    Assets whose SHA-256 (from digests, {path: hex}, or hashed here) and
+    length match the existing pack keep their bytes in place; only new or
+    changed ones are appended. The new index is synced before the header
+    that points at it is rewritten, so a crash leaves the old pack intact.
+    Returns counts and sizes for results.json.
+    """
+    digests = digests or {}
+    wanted = []
+    for name, path in sorted(files.items()):
+        wanted.append({"name": name, "path": path, "length": os.path.getsize(path),
+                       "sha256": digests.get(path) or _file_sha256(path),
+                       "type": Path(name).suffix.lstrip(".").lower()})
+
+    old = {}
+    dead = 0
+    with contextlib.suppress(OSError, ValueError):
+        with AssetPack(pack_path) as pack:
+            if pack.align == align:
+                old = {e["name"]: e for e in pack.entries}
+                dead = pack.dead_bytes() + pack.index_length
+    reused = [w for w in wanted if (o := old.get(w["name"])) and o["sha256"] == w["sha256"]
+              and o["length"] == w["length"]]
+    kept = {w["name"] for w in reused}
+    changed = [w for w in wanted if w["name"] not in kept]
+    dead += sum(o["length"] for name, o in old.items() if name not in kept)
+    stats = {"path": str(pack_path), "entries": len(wanted), "written": len(changed),
+             "reused": len(reused)}
+
+    if old and not changed and len(reused) == len(old):
+        stats.update(bytes=os.path.getsize(pack_path), rewritten=False)
+        return stats
+    full = not old or dead > sum(w["length"] for w in wanted)
+    if full:
+        # Fresh file: everything is written, then it replaces the old pack in one step
+        for entry in wanted:
+            entry.pop("offset", None)
+        changed, reused = wanted, []
+        target = Path(str(pack_path) + ".part")
+        mode = "w+b"
+    else:
+        for entry in reused:
+            entry["offset"] = old[entry["name"]]["offset"]
+        target, mode = Path(pack_path), "r+b"
+
+    with open(target, mode) as f:
+        if full:
+            f.write(b"\0" * _PACK_HEADER.size)
+        for entry in changed:
+            entry["offset"], length = _append_aligned(f, entry["path"], align)
+            if length != entry["length"]:
+                raise RuntimeError(f"{entry['path']} changed while packing")
+        index = _pack_index(wanted)
+        index_offset = -(-f.seek(0, os.SEEK_END) // 8) * 8
+        f.seek(index_offset)
+        f.write(index)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(0)
+        f.write(_pack_header(align, wanted, index_offset, index))
+        f.flush()
+        os.fsync(f.fileno())
+    if full:
+        os.replace(target, pack_path)
+    stats.update(written=len(changed), reused=len(reused), bytes=os.path.getsize(pack_path),
+                 rewritten=full)
+    return stats
+
+
+def pack_command(args):
+    """`pack inspect` / `pack verify`."""
+    try:
+        pack = AssetPack(args.pack)
+    except (OSError, ValueError) as e:
+        print(f"  ✗ {e}", file=sys.stderr)
+        sys.exit(1)
+    with pack:
+        if args.pack_command == "inspect":
+            print(f"  Pack: {pack.path} ({pack.size / 1024:.0f} KB, {len(pack.entries)} assets, "
+                  f"{pack.align}-byte aligned, {pack.dead_bytes() / 1024:.0f} KB unused)")
+            for entry in pack.entries:
+                print(f"    {entry['name']:<40} {entry['type']:<5} @{entry['offset']:<10} "
+                      f"{entry['length']:>10}  {entry['sha256'][:12]}")
+            return
+        problems = pack.verify()
+    for problem in problems:
+        print(f"  ✗ {problem}", file=sys.stderr)
+    if problems:
+        sys.exit(1)
+    print(f"  OK: {len(pack.entries)} assets verified in {pack.path}")
+
+
+# ---------------------------------------------------------------------------
+# Batch mode
+# ---------------------------------------------------------------------------
+
+# Entries read ahead of the one being built, so their images can start
+# generating early (see prefetch_images); at least --jobs x 4
+BATCH_LOOKAHEAD = 64
+
+
+def open_manifest(manifest_path: str):
+    """Read a manifest; returns (settings, iterator of ("images" | "audio", entry)).
+
+    A .json manifest is loaded whole. A .jsonl manifest is streamed a line
+    at a time: leading lines without a "name" hold settings (output_dir,
+    pack, ...), and every later line is one entry. An entry is an image if
+    it says "kind": "image" or has a "prompt", otherwise audio.
+    """
+    path = Path(manifest_path)
+    if path.suffix != ".jsonl":
+        manifest = json.loads(path.read_text())
+        settings = {k: v for k, v in manifest.items() if k not in ("images", "audio")}
+        entries = [("images", e) for e in manifest.get("images", [])]
+        entries += [("audio", e) for e in manifest.get("audio", [])]
+        return settings, iter(entries)
+
+    f = open(path)
+    lines = enumerate(f, 1)
+    settings, first = {}, None
+    try:
+        for number, line in lines:
+            if line.strip():
+                obj = _manifest_line(path, number, line)
+                if "name" in obj:
+                    first = obj
+                    break
+                settings.update(obj)
+    except Exception:
+        f.close()
+        raise
+
+    def entries():
+        with f:
+            entry = first
+            while entry is not None:
+                kind = entry.get("kind") or ("image" if "prompt" in entry else "audio")
+                yield ("images" if kind == "image" else "audio"), entry
+                entry = None
+                for number, line in lines:
+                    if line.strip():
+                        entry = _manifest_line(path, number, line)
+                        break
+
+    return settings, entries()
+
+
+def _manifest_line(path: Path, number: int, line: str) -> dict:
+    try:
+        obj = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"{path}:{number}: {e}") from None
+    if not isinstance(obj, dict):
+        raise ValueError(f"{path}:{number}: expected a JSON object")
+    return obj
+
+
+def results_path(manifest_path: str) -> Path:
+    """Where a manifest's results go.
+
+    <manifest>.results.json, or for a .jsonl manifest its one-record-per-line
+    log, <manifest>.results.jsonl (see Checkpoint).
+    """
+    path = Path(manifest_path)
+    return path.with_suffix(".results.jsonl" if path.suffix == ".jsonl" else ".results.json")
+
+
+def load_checkpoint(path: Path) -> dict:
+    """Records from a results checkpoint, by entry name (the last one wins).
+
+    A torn last line, left by a kill mid-write, is ignored.
+    """
+    done = {}
+    with contextlib.suppress(FileNotFoundError), open(path) as f:
+        for line in f:
+            with contextlib.suppress(ValueError):
+                record = json.loads(line)
+                if isinstance(record, dict) and "name" in record:
+                    done[record["name"]] = record
+    return done
+
+
+class Checkpoint:
+    """Append-only results log; each record is on disk before the next entry is reported."""
+
+    def __init__(self, path: Path, resume: bool = False):
+        self.path = path
+        self._file = open(path, "a" if resume else "w")
+        if resume and self._file.tell():
+            # Start on a fresh line if the last run died mid-record
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def append(self, record: dict):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _lookahead(items, size: int, on_read):
+    """Yield items, reading up to size ahead and calling on_read on each as it is read."""
+    import collections
+
+    buffer = collections.deque()
+    for item in items:
+        on_read(item)
+        buffer.append(item)
+        if len(buffer) > size:
+            yield buffer.popleft()
+    yield from buffer
+
+
+def _process_image(img: dict, output_dir: Path) -> tuple[str, dict]:
+    """Generate one manifest image; returns (results key, record)."""
+    name = img["name"]
+    output_path = str(output_dir / name)
+    try:
+        print(f"\n{'=' * 60}")
+        print(f"IMAGE: {name}")
+        print(f"{'=' * 60}")
+        generate_image(
+            prompt=img["prompt"],
+            output_path=output_path,
+            size=img.get("size", "1792x1024"),
+            quality=img.get("quality", "standard"),
+        )
+        record = {"name": name, "path": output_path, "status": "ok"}
+        pngs = [output_path] if output_path.lower().endswith(".png") else []
+        if "sprites" in img:
+            with phase("sprites"):
+                sprites = run_cpu(make_sprite_atlas, output_path, **img["sprites"])
+            record["sprites"] = sprites
+            pngs += sprites["images"]
+        if img.get("quantize") and not _has_numpy():
+            # Optional: the image is fine as generated
+            print("  WARNING: NumPy not found — keeping the PNG unquantized "
+                  "(install with: pip install numpy)", file=sys.stderr)
+        elif img.get("quantize"):
+            options = img["quantize"] if isinstance(img["quantize"], dict) else {}
+            with phase("quantize"):
+                record["optimized"] = [run_cpu(quantize_png, path, **options) for path in pngs]
+        if "sprites" in img:
+            paths = [output_path, *sprites["images"], sprites["atlas"]]
+            record["outputs"] = [
+                {"name": Path(p).name, "path": p, "format": Path(p).suffix.lstrip("."),
+                 "bytes": os.path.getsize(p)}
+                for p in paths
+            ]
+        if "dedup" in (_asset_notes.get() or {}):
+            record["dedup"] = _asset_notes.get()["dedup"]
+        return "images", record
+    except Exception as e:
+        print(f"  ERROR: {e}", file=sys.stderr)
+        return "errors", {"name": name, "error": str(e)}
+
+
+def _process_audio(aud: dict, output_dir: Path) -> tuple[str, dict]:
+    """Fetch one manifest audio entry; returns (results key, record)."""
+    name = aud["name"]
+    output_path = str(output_dir / name)
+    fmt = aud.get("format", Path(name).suffix.lstrip("."))
+    source = aud.get("source", "pixabay")
+    pick = aud.get("pick", 0)
+    try:
+        print(f"\n{'=' * 60}")
+        print(f"AUDIO: {name} (source: {source})")
+        print(f"  License: {AUDIO_SOURCES.get(source, {}).get('license', 'unknown')}")
+        print(f"{'=' * 60}")
+        outputs = None
+        if "outputs" in aud:
+            if not isinstance(aud["outputs"], list) or not all(
+                    isinstance(out, dict) and "name" in out for out in aud["outputs"]):
+                raise ValueError('"outputs" must be a list of objects with a "name"')
+            outputs = [output_spec(str(output_dir / out["name"]), out.get("format"), **out)
+                       for out in aud["outputs"]]
+            output_path = outputs[0]["path"]
+        elif any(k in aud for k in OUTPUT_OPTIONS + ANALYSIS_OPTIONS):
+            outputs = [output_spec(output_path, fmt, **aud)]
+        if "url" in aud:
+            download_audio(aud["url"], output_path, fmt, aud.get("sha256"), outputs=outputs)
+        elif "search" in aud:
+            constraints = {k: aud[k] for k in AUDIO_CONSTRAINTS if k in aud}
+            search_and_download_audio(aud["search"], output_path, fmt, source, pick, outputs,
+                                      constraints)
+        else:
+            print(f"  SKIP: No 'url' or 'search' for {name}", file=sys.stderr)
+            return "errors", {"name": name, "error": "no url or search"}
+        record = {"name": name, "path": output_path, "status": "ok"}
+        if "outputs" in aud:
+            record["outputs"] = [
+                {"name": Path(out["path"]).name, "path": out["path"], "format": out["format"],
+                 **out["options"], "bytes": os.path.getsize(out["path"]),
+                 **({"analysis": out["analysis"]} if "analysis" in out else {})}
+                for out in outputs
+            ]
+        elif outputs and "analysis" in outputs[0]:
+            record["analysis"] = outputs[0]["analysis"]
+        notes = _asset_notes.get() or {}
+        for key in ("probe", "dedup"):
+            if key in notes:
+                record[key] = notes[key]
+        return "audio", record
+    except Exception as e:
+        print(f"  ERROR: {e}", file=sys.stderr)
+        return "errors", {"name": name, "error": str(e)}
+
+
+def _build_entry(fn, entry: dict, output_dir: Path) -> tuple[str, dict, dict]:
+    """Run one _process_* function; returns (results key, record, asset notes)."""
+    with asset_notes() as notes:
+        notes["asset"] = entry["name"]
+        kind, record = fn(entry, output_dir)
+    return kind, record, notes
+
+
+def _pack_locked(output_dir: Path, pack: str, lock: dict) -> dict:
+    """Pack every output in lock, each named by its path under output_dir."""
+    outputs = {path: fp for entry in lock.values() for path, fp in entry["outputs"].items()}
+    files = {Path(os.path.relpath(path, output_dir)).as_posix(): path for path in outputs}
+    return write_pack(str(output_dir / pack), files,
+                      {path: fp["sha256"] for path, fp in outputs.items()})
+
+
+class BatchRun:
+    """One manifest's share of a batch: its plan, lockfile, checkpoint and results.
+
+    run_batch builds one manifest; run_workspace hands several to
+    _build_runs, which takes their entries through one set of pools.
+    """
+
+    def __init__(self, manifest_path: str, incremental: bool = False,
+                 force: list[str] | None = None, resume: bool = False,
+                 root: str | None = None, phases: PhaseTotals | None = None):
+        self.manifest_path = manifest_path
+        self.settings, self._entries = open_manifest(manifest_path)
+        self.streaming = Path(manifest_path).suffix == ".jsonl"
+        # A workspace resolves output_dir against its root rather than the cwd
+        self.output_dir = Path(root or "") / self.settings.get("output_dir", ".")
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.lock_path = Path(manifest_path).with_suffix(".lock.json")
+        self.locked = load_lock(self.lock_path)
+        self.force = set(force or [])
+        self.incremental = incremental or bool(self.force)
+        self.resume = resume
+        self.checkpoint_path = Path(manifest_path).with_suffix(".results.jsonl")
+        self.results_path = results_path(manifest_path)
+        self._done = load_checkpoint(self.checkpoint_path) if resume else {}
+        # A .json run's checkpoint only outlives it if the run is killed (see write)
+        self.checkpoint = Checkpoint(self.checkpoint_path, resume)
+
+        # Records are kept for results.json only for a .json manifest; a .jsonl
+        # run leaves them in the checkpoint and keeps running totals
+        self.records = []
+        self.tally = {"images": 0, "audio": 0, "errors": 0, "unchanged": 0, "resumed": 0}
+        self.errors = []
+        self.convert_times: dict[str, list[float]] = {}
+        self.optimized = {"count": 0, "before": 0, "after": 0, "worst": 0.0}
+        self.dedup = {"entries": 0, "bytes_saved": 0}
+        # index -> (name, keys shared, "dedup" note) per built entry that shared work
+        self.dedup_claims = {}
+        self.phases = phases if phases is not None else PhaseTotals()
+        self.new_lock = {}
+        self.results = None
+
+    def plan(self):
+        """(index, kind, fn, entry, entry hash, state) per entry.
+
+        state is "build", "unchanged" (lockfile) or "resumed" (checkpoint).
+        """
+        for index, (kind, entry) in enumerate(self._entries):
+            name = entry["name"]
+            entry_hash = _entry_hash(entry, str(self.output_dir / name))
+            state = "build"
+            if name not in self.force:
+                previous = self._done.get(name)
+                if (previous and previous["kind"] != "errors"
+                        and lock_is_current(previous.get("lock"), entry_hash)):
+                    state = "resumed"
+                elif self.incremental and lock_is_current(self.locked.get(name), entry_hash):
+                    state = "unchanged"
+            fn = _process_image if kind == "images" else _process_audio
+            yield index, kind, fn, entry, entry_hash, state
+
+    def report(self, item, result_kind: str, record: dict):
+        index, kind, _, entry, entry_hash, state = item
+        self.tally[result_kind] += 1
+        if state != "build":
+            self.tally[state] += 1
+        if result_kind == "errors" and len(self.errors) < 20:
+            self.errors.append(record)
+        for o in record.get("optimized", []):
+            self.optimized["count"] += 1
+            self.optimized["before"] += o["bytes_before"]
+            self.optimized["after"] += o["bytes_after"]
+            self.optimized["worst"] = max(self.optimized["worst"], o["delta_e"])
+        if "dedup" in record and state == "build":
+            self.dedup["entries"] += 1
+            self.dedup["bytes_saved"] += record["dedup"]["bytes_saved"]
+        if not self.streaming:
+            self.records.append((index, result_kind, record))
+
+    def finish(self, item, built):
+        """Record a built entry: phases, lockfile entry, checkpoint line."""
+        _, kind, _, entry, entry_hash, _ = item
+        name = entry["name"]
+        result_kind, record, notes = built
+        record["phases"] = list(notes.get("phases", []))
+        self.phases.add(record["phases"])
+        if "convert_path" in notes:
+            self.convert_times.setdefault(notes["convert_path"], []).append(
+                notes["convert_seconds"])
+        lock = None
+        if result_kind != "errors":
+            paths = [out["path"] for out in record.get("outputs", [])] or [record["path"]]
+            lock = self.new_lock[name] = lock_entry(entry_hash, notes, paths)
+            if notes.get("dedup_claims"):
+                self.dedup_claims[item[0]] = (name, notes["dedup_claims"], record.get("dedup"))
+        self.checkpoint.append({"kind": result_kind, **record, "lock": lock})
+        self.report(item, result_kind, record)
+
+    def skip(self, item):
+        """Record an entry that is unchanged or was built before a resume."""
+        _, kind, _, entry, _, state = item
+        name = entry["name"]
+        if state == "resumed":
+            previous = self._done[name]
+            self.new_lock[name] = previous["lock"]
+            record = {k: v for k, v in previous.items() if k not in ("kind", "lock")}
+            self.report(item, previous["kind"], record)
+            return
+        self.new_lock[name] = self.locked[name]
+        record = {"name": name, "path": next(iter(self.locked[name]["outputs"])),
+                  "status": "unchanged"}
+        self.checkpoint.append({"kind": kind, **record, "lock": self.locked[name]})
+        self.report(item, kind, record)
+
+    def complete(self) -> dict:
+        """Assemble results once every entry is in, writing the pack if the manifest has one."""
+        tally = self.tally
+        if self.incremental or self.resume:
+            total = tally["images"] + tally["audio"] + tally["errors"]
+            print(f"Incremental: {tally['unchanged']} unchanged, {tally['resumed']} resumed, "
+                  f"{total - tally['unchanged'] - tally['resumed']} built")
+
+        results = {"images": [], "audio": [], "errors": []}
+        for _, result_kind, record in sorted(self.records, key=lambda r: r[0]):
+            results[result_kind].append(record)
+        if self.dedup["entries"]:
+            results["dedup"] = self.dedup
+
+        if self.settings.get("pack"):
+            results["pack"] = _pack_locked(self.output_dir, self.settings["pack"], self.new_lock)
+        self.results = results
+        return results
+
+    def print_summary(self):
+        tally, results, optimized = self.tally, self.results, self.optimized
+        print(f"  Output dir: {self.output_dir}")
+        print(f"  Images: {tally['images']} fetched")
+        print(f"  Audio:  {tally['audio']} fetched")
+        if tally["unchanged"] or tally["resumed"]:
+            print(f"  Unchanged: {tally['unchanged']} (skipped)"
+                  + (f", {tally['resumed']} already done (resumed)" if tally["resumed"] else ""))
+        if tally["errors"]:
+            print(f"  Errors: {tally['errors']}")
+            for e in self.errors:
+                print(f"    ✗ {e['name']}: {e['error']}")
+            if tally["errors"] > len(self.errors):
+                print(f"    ... and {tally['errors'] - len(self.errors)} more "
+                      f"(see {self.results_path})")
+        else:
+            print(f"  All assets fetched successfully.")
+        if self.convert_times:
+            paths = ", ".join(f"{path} {len(t)} (avg {sum(t) / len(t):.2f}s, total {sum(t):.2f}s)"
+                              for path, t in sorted(self.convert_times.items()))
+            print(f"  Fetch+convert: {paths}")
+        if optimized["count"]:
+            print(f"  PNG:    {optimized['count']} optimized, "
+                  f"{optimized['before'] / 1024 ** 2:.1f} MB → "
+                  f"{optimized['after'] / 1024 ** 2:.1f} MB, worst ΔE {optimized['worst']:.2f}")
+        if self.dedup["entries"]:
+            print(f"  Dedup:  {self.dedup['entries']} entries shared another's source, "
+                  f"{self.dedup['bytes_saved'] / 1024 ** 2:.1f} MB not fetched or converted again")
+        if "pack" in results:
+            pack = results["pack"]
+            how = "rewritten" if pack["rewritten"] else f"{pack['reused']} reused in place"
+            print(f"  Pack:   {pack['entries']} assets, {pack['written']} written, {how} "
+                  f"({pack['bytes'] / 1024 ** 2:.1f} MB) → {pack['path']}")
+
+    def write(self):
+        """Write results JSON and, for an incremental run, the lockfile.
+
+        A .jsonl run's results are its checkpoint; a .json run's checkpoint
+        is removed once results.json holds everything in it.
+        """
+        if not self.streaming:
+            self.results_path.write_text(json.dumps(self.results, indent=2))
+            self.checkpoint_path.unlink(missing_ok=True)
+        print(f"  Results written to: {self.results_path}")
+        if self.incremental and self.new_lock != self.locked:
+            write_lock(self.lock_path, self.new_lock)
+
+
+def _start_batch(trace: str | None):
+    clear_search_memo()
+    # The summary is per run, also in a process that runs several (workspace, serve)
+    search_stats.update(dict.fromkeys(search_stats, 0))
+    for counted in (_session(), _cache(), _transcode_cache()):
+        if counted is not None:
+            with counted._lock:
+                counted.stats.update(dict.fromkeys(counted.stats, 0))
+    start_trace(keep_events=bool(trace))
+
+
+def _build_runs(runs: list[BatchRun], jobs: int, limits: dict | None) -> bool:
+    """Build the entries of every run with one worker pool, ffmpeg pool and dedup scope.
+
+    Entries are read, planned and submitted as the pool frees up, one
+    manifest after another; images start generating (once per prompt) as
+    soon as they are read. Returns whether any image was prefetched.
+    """
+    prompts = set()
+
+    def plan():
+        for run in runs:
+            for item in run.plan():
+                yield run, item
+
+    def prefetch(job):
+        _, (_, _, fn, entry, _, state) = job
+        if fn is not _process_image or state != "build":
+            return
+        key = (entry["prompt"], entry.get("size", "1792x1024"), entry.get("quality", "standard"))
+        if not prompts:
+            # Generations run side by side on the image pipeline whatever --jobs is
+            configure_images(concurrency=(limits or {}).get("image"))
+        if key not in prompts:
+            prompts.add(key)
+            prefetch_images([entry])
+
+    jobs_read = _lookahead(plan(), max(BATCH_LOOKAHEAD, jobs * 4), prefetch)
+    with source_dedup():
+        try:
+            if jobs > 1:
+                import concurrent.futures
+
+                print(f"Running batch with {jobs} jobs")
+                with concurrent_pools(jobs, limits) as pool:
+                    in_flight = {}
+                    for run, item in jobs_read:
+                        _, _, fn, entry, _, state = item
+                        if state != "build":
+                            run.skip(item)
+                            continue
+                        # Bounded: never more than jobs x 2 entries submitted ahead
+                        while len(in_flight) >= jobs * 2:
+                            finished, _ = concurrent.futures.wait(
+                                in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                            for future in finished:
+                                done_run, done_item = in_flight.pop(future)
+                                done_run.finish(done_item, future.result())
+                        future = pool.submit(_build_entry, fn, entry, run.output_dir)
+                        in_flight[future] = (run, item)
+                    for future in concurrent.futures.as_completed(list(in_flight)):
+                        done_run, done_item = in_flight.pop(future)
+                        done_run.finish(done_item, future.result())
+            else:
+                for run, item in jobs_read:
+                    _, _, fn, entry, _, state = item
+                    if state != "build":
+                        run.skip(item)
+                    else:
+                        run.finish(item, _build_entry(fn, entry, run.output_dir))
+        finally:
+            for run in runs:
+                run.checkpoint.close()
+    _settle_dedup(runs)
+    return bool(prompts)
+
+
+def _settle_dedup(runs: list[BatchRun]):
+    """Credit work shared between entries to the ones a serial run would have.
+
+    With jobs > 1, whichever entry reaches deduplicated() first does the
+    work, so who is "dedup" of whom varies from run to run. Replaying every
+    entry's claims in manifest order gives each key to its first entry, as
+    a serial run does: an entry that shared another's fetch is taken to go
+    on to the keys that entry went on to claim. Records kept for
+    results.json and the dedup totals are rewritten to match.
+    """
+    members = sorted(((position, index, run, *claimed)
+                      for position, run in enumerate(runs)
+                      for index, claimed in run.dedup_claims.items()),
+                     key=lambda m: m[:2])
+    # Keys claimed after each key by the entry that did its work, and the bytes sharing it saves
+    after, saved = {}, {}
+    for *_, claims, note in members:
+        if note:
+            saved[claims[-1]] = note["bytes_saved"]
+        for i, digest in enumerate(claims[:-1] if note else claims):
+            after[digest] = claims[i + 1:]
+
+    owners, settled = {}, {}
+    for position, index, run, name, claims, note in members:
+        chain = claims + after.get(claims[-1], []) if note else claims
+        shared = next((digest for digest in chain if digest in owners), None)
+        for digest in chain[:chain.index(shared) if shared else None]:
+            owners[digest] = name
+        settled[position, index] = ({"of": owners[shared], "bytes_saved": saved.get(shared, 0)}
+                                    if shared else None)
+
+    for position, run in enumerate(runs):
+        if not run.dedup_claims:
+            continue
+        notes = {index: settled[position, index] for index in run.dedup_claims}
+        for index, _, record in run.records:
+            if index in notes:
+                record.pop("dedup", None)
+                if notes[index]:
+                    record["dedup"] = notes[index]
+        shared = [note for note in notes.values() if note]
+        run.dedup = {"entries": len(shared),
+                     "bytes_saved": sum(note["bytes_saved"] for note in shared)}
+
+
+def _print_run_stats(phases: PhaseTotals):
+    """Summary lines for what every manifest in the run shared: network, caches, hot spots."""
+    if any(search_stats.values()):
+        print(f"  Search: {search_stats['fetched']} fetched, {search_stats['cached']} from cache, "
+              f"{search_stats['deduped']} deduplicated")
+    net = http_stats()
+    print(f"  HTTP:   {net['requests']} requests, {net['connections_opened']} connections "
+          f"opened, {net['connections_reused']} reused")
+    cache = _cache()
+    if cache:
+        print(f"  Cache:  {cache.stats['hits']} hits, {cache.stats['revalidated']} revalidated, "
+              f"{cache.stats['misses']} misses")
+    transcodes = _transcode_cache()
+    if transcodes and (transcodes.stats["hits"] or transcodes.stats["misses"]):
+        hits = transcodes.stats["hits"]
+        looked = hits + transcodes.stats["misses"]
+        print(f"  Transcode: {hits}/{looked} from cache ({hits / looked:.0%}), "
+              f"{transcodes.stats['cpu_saved']:.1f} CPU-s saved")
+    if phases:
+        print(f"  Hot spots (self time; nested phases are excluded from their parents):")
+        for row in phases.top():
+            extra = f", {row['bytes'] / 1e6:.1f} MB" if row["bytes"] else ""
+            extra += f", {row['retries']} retries" if row["retries"] else ""
+            print(f"    {row['phase']:<13} {row['count']:>4}x  self {row['self_seconds']:7.2f}s  "
+                  f"total {row['seconds']:7.2f}s  p95 {row['p95']:6.2f}s{extra}")
+
+
+def _finish_batch(trace: str | None, started: float, prefetched: bool):
+    if trace:
+        write_trace(trace)
+        print(f"  Trace written to: {trace} (open in ui.perfetto.dev or chrome://tracing)")
+    print(f"  Finished in {time.monotonic() - started:.2f}s")
+    clear_search_memo()
+    if prefetched:
+        _image_pipeline().forget()
+
+
+def run_batch(manifest_path: str, jobs: int = 1, limits: dict | None = None,
+              incremental: bool = False, force: list[str] | None = None,
+              trace: str | None = None, resume: bool = False):
+    """Process a JSON or JSONL manifest of assets to fetch.
+
+    With jobs > 1, entries run concurrently on a bounded worker pool (see
+    concurrent_pools); results.json lists entries in the same order as the
+    serial run.
+
+    Entries are read, planned and submitted as the pool frees up, so a
+    .jsonl manifest (see open_manifest) of any length runs in bounded
+    memory. Each finished entry's record is appended, and synced, to
+    <manifest>.results.jsonl as it completes; for a .jsonl manifest that
+    log is the results file, and for a .json manifest it is removed once
+    results.json is written, so it is only left behind by a run that did
+    not finish. With resume, entries the log shows as built (and whose
+    outputs are intact) are not built again.
+
+    Each built entry's record in results.json carries its timed phases
+    (search, scrape, request, download, image, convert, ...) with byte and
+    retry counts; the slowest phases are summarised at the end. With trace,
+    the same spans are also written there as a Chrome/Perfetto trace.
+
+    With incremental=True, each built output is recorded in a lockfile
+    next to the manifest (<manifest>.lock.json), and entries whose manifest
+    entry, conversion parameters and output files all match it are
+    skipped; names in force are rebuilt regardless. Other runs leave the
+    lockfile alone.
+
+    Manifest format:
+    {
+        "output_dir": "path/to/Resources",
+        "pack": "assets.pack",            // optional: also pack every output into one file
+        "images": [
+            {
+                "name": "file.png",
+                "prompt": "DALL-E 3 prompt text",
+                "size": "1792x1024",       // optional, default 1792x1024
+                "quality": "standard"       // optional, default standard
+            },
+            {
+                "name": "kid_walk.png",     // a sprite sheet on a white background
+                "prompt": "...",
+                "sprites": {                // slice into kid_walk_atlas{,@2x,@3x}.png + .json
+                    "frames": 4,            // optional: expected frame count
+                    "rows": 1,              // optional: rows of frames on the sheet
+                    "frame_size": 128,      // optional: largest frame side, in points
+                    "scales": [1, 2, 3]     // optional
+                },
+                "quantize": true            // optional: shrink PNGs to a palette (or
+            }                               //   {"max_delta_e": 1.5, "max_colors": 256});
+                                            //   sprite atlases included
+        ],
+        "audio": [
+            {
+                "name": "ambient_rain.m4a",
+                "search": "rain patter",    // search query — OR —
+                "url": "https://...",       // direct download URL
+                "sha256": "...",            // optional checksum for a direct URL
+                "source": "pixabay",        // pixabay (default) | freesound | all
+                "format": "m4a",            // m4a | caf | wav (inferred from name if omitted)
+                "bitrate": "96k",           // optional encoder overrides: bitrate,
+                "sample_rate": 44100,       //   sample_rate, channels
+                "pick": 0,                  // which search result to use (default: 0 = first)
+                "trim": true,               // optional edits from analysing the decoded audio:
+                "loudness": -16,            //   trim silence (or {"threshold_db", "pad_ms"}),
+                "loop": true                //   normalize to LUFS, cut at a seamless loop point
+            },
+            {
+                "name": "splash",           // one source, several files from one decode
+                "search": "puddle splash",
+                "outputs": [
+                    {"name": "sfx_splash.caf", "format": "caf", "trim": true},
+                    {"name": "loop_splash.m4a", "format": "m4a", "bitrate": "64k", "channels": 2}
+                ]
+            }
+        ]
+    }
+
+    JSONL manifest format: settings first, then one entry per line
+        {"output_dir": "path/to/Resources", "pack": "assets.pack"}
+        {"name": "file.png", "prompt": "..."}
+        {"name": "ambient_rain.m4a", "search": "rain patter"}
+
+    Entries with "outputs" or "sprites" report each file's size under
+    "outputs" in results.json; audio outputs with trim/loudness/loop add
+    what was cut and the gain under "analysis". "quantize" entries report
+    each PNG's size before and after and its ΔE under "optimized". Audio
+    analysis, sprites and quantization run on a process pool (see run_cpu)
+    and need NumPy; without it, "quantize" is skipped with a warning and the
+    PNG kept as generated. With "pack", every output is also written into one
+    mmap-able pack under output_dir (see write_pack); a rerun only appends
+    what changed.
+
+    Audio entries whose source (same URL, or same bytes) and outputs match
+    another entry's are fetched and converted once; the rest copy those
+    files and note it under "dedup" (crediting the first such entry in the
+    manifest, whatever --jobs is), with the totals in results.json (see
+    deduplicated).
+
+    Licensing:
+      - Images: generated by DALL-E 3 (you own the output)
+      - Audio from Pixabay: Pixabay License (royalty-free, no attribution, commercial OK)
+      - Audio from Freesound CC0: public domain (no restrictions)
+    """
+    started = time.monotonic()
+    _start_batch(trace)
+    run = BatchRun(manifest_path, incremental, force, resume)
+    prefetched = _build_runs([run], jobs, limits)
+    results = run.complete()
+
+    print(f"\n{'=' * 60}")
+    print(f"BATCH SUMMARY")
+    print(f"{'=' * 60}")
+    run.print_summary()
+    _print_run_stats(run.phases)
+    print()
+    run.write()
+    _finish_batch(trace, started, prefetched)
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Workspace mode
+# ---------------------------------------------------------------------------
+
+# Manifest file names `workspace` picks up, and directories it never enters
+WORKSPACE_MANIFESTS = ("*_assets.json", "*_assets.jsonl")
+WORKSPACE_SKIP_DIRS = {"build", "DerivedData", "node_modules", "__pycache__"}
+
+
+def discover_manifests(root: str) -> list[Path]:
+    """Asset manifests under root: *_assets.json / *_assets.jsonl files with an output_dir.
+
+    Hidden directories (.git, .build, ...) and WORKSPACE_SKIP_DIRS are not
+    searched. Paths come back sorted, so the build order is stable.
+    """
+    import fnmatch
+
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames
+                             if not d.startswith(".") and d not in WORKSPACE_SKIP_DIRS)
+        for filename in sorted(filenames):
+            if not any(fnmatch.fnmatch(filename, pattern) for pattern in WORKSPACE_MANIFESTS):
+                continue
+            path = Path(dirpath) / filename
+            try:
+                settings, _ = open_manifest(str(path))
+            except (OSError, ValueError) as e:
+                print(f"  SKIP: {path}: {e}", file=sys.stderr)
+                continue
+            if "output_dir" in settings:
+                found.append(path)
+    return found
+
+
+def _package_name(run: BatchRun) -> str:
+    """The package a manifest builds for: the directory under Packages/, else the manifest."""
+    parts = Path(run.settings.get("output_dir", "")).parts
+    if "Packages" in parts[:-1]:
+        return parts[parts.index("Packages") + 1]
+    return Path(run.manifest_path).stem.removesuffix("_assets")
+
+
+def run_workspace(root: str = ".", jobs: int = 1, limits: dict | None = None,
+                  incremental: bool = False, force: list[str] | None = None,
+                  trace: str | None = None, resume: bool = False) -> dict:
+    """Build every asset manifest under root in one process (see discover_manifests).
+
+    All manifests' entries form one job graph on shared pools: searches
+    and downloads on the network pool, conversions on the ffmpeg pool,
+    sprites/quantize/analysis on the process pool. A source URL, source
+    file or image prompt that several packages use is fetched, converted or
+    generated once and placed in every package's output_dir (see
+    deduplicated). Search results, the download and transcode caches and
+    HTTP connections are shared too. Each manifest keeps its own lockfile
+    and results, as with `batch`; output_dir is relative to root. Returns
+    {package: results}.
+    """
+    started = time.monotonic()
+    manifests = discover_manifests(root)
+    if not manifests:
+        print(f"  No asset manifests ({', '.join(WORKSPACE_MANIFESTS)}) under {root}")
+        return {}
+    print(f"Workspace: {len(manifests)} manifest(s) under {root}")
+    for manifest in manifests:
+        print(f"  {manifest}")
+
+    _start_batch(trace)
+    phases = PhaseTotals()
+    runs = [BatchRun(str(m), incremental, force, resume, root, phases) for m in manifests]
+    prefetched = _build_runs(runs, jobs, limits)
+
+    report = {}
+    for run in runs:
+        package = _package_name(run)
+        if package in report:
+            package = f"{package}/{Path(run.manifest_path).name}"
+        report[package] = run.complete()
+
+    print(f"\n{'=' * 60}")
+    print(f"WORKSPACE SUMMARY")
+    print(f"{'=' * 60}")
+    for package, run in zip(report, runs):
+        print(f"[{package}] {run.manifest_path}")
+        run.print_summary()
+        run.write()
+        print()
+    total = {k: sum(run.tally[k] for run in runs) for k in ("images", "audio", "errors")}
+    shared = sum(run.dedup["entries"] for run in runs)
+    print(f"  Packages: {len(runs)}, {total['images']} images, {total['audio']} audio, "
+          f"{total['errors']} errors, {shared} entries shared")
+    _print_run_stats(phases)
+    _finish_batch(trace, started, prefetched)
+    return report
+
+
+# ---------------------------------------------------------------------------
+# Watch mode
+# ---------------------------------------------------------------------------
+
+# A burst of saves (write, rename, touch) is read once, this long after the
+# last of them; without inotify the manifest is stat'ed this often
+WATCH_DEBOUNCE = 0.3
+WATCH_POLL_INTERVAL = 0.5
+
+# inotify events on the manifest's directory: a file written and closed,
+# renamed into place or created
+_IN_CLOSE_WRITE, _IN_MOVED_TO, _IN_CREATE = 0x8, 0x80, 0x100
+
+
+class ManifestWatcher:
+    """Wakes up when a file changes: inotify on Linux, polling its stat elsewhere.
+
+    inotify watches the file's directory rather than the file, so editors
+    that save by renaming a new file over the old one are seen too.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd = self._inotify(path.parent)
+        self._seen = self._signature()
+
+    @staticmethod
+    def _inotify(directory: Path) -> int | None:
+        if not sys.platform.startswith("linux"):
+            return None
+        import ctypes
+        try:
+            libc = ctypes.CDLL("libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(directory.resolve()), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    @property
+    def mechanism(self) -> str:
+        return "inotify" if self._fd is not None else f"polling every {WATCH_POLL_INTERVAL}s"
+
+    def _signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def wait(self, timeout: float) -> bool:
+        """Block for up to timeout seconds; True if the file changed meanwhile."""
+        if self._fd is None:
+            deadline = time.monotonic() + timeout
+            while True:
+                signature = self._signature()
+                if signature != self._seen:
+                    self._seen = signature
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(WATCH_POLL_INTERVAL, remaining))
+
+        import select
+        name = os.fsencode(self.path.name)
+        deadline = time.monotonic() + timeout
+        # Events for other files in the directory don't end the wait
+        while (remaining := deadline - time.monotonic()) > 0:
+            if not select.select([self._fd], [], [], remaining)[0]:
+                return False
+            changed = False
+            with contextlib.suppress(BlockingIOError):
+                while data := os.read(self._fd, 64 * 1024):
+                    pos = 0
+                    while pos + 16 <= len(data):
+                        # struct inotify_event: wd, mask, cookie, len, then a NUL-padded name
+                        length = struct.unpack_from("iIII", data, pos)[3]
+                        changed |= data[pos + 16:pos + 16 + length].rstrip(b"\0") == name
+                        pos += 16 + length
+            if changed:
+                return True
+        return False
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _build_watched(cancel: threading.Event, fn, entry: dict, output_dir: Path):
+    """_build_entry for watch mode: stops early once cancel is set."""
+    _build_cancelled.set(cancel)
+    return _build_entry(fn, entry, output_dir)
+
+
+class WatchSession:
+    """What `watch` knows about one manifest: its entries, builds in flight and results.
+
+    Every save is diffed against the entries last read, by entry hash (see
+    _entry_hash); only added and changed entries are submitted, so an edit
+    to one entry costs one re-read of the manifest plus that entry's build.
+    """
+
+    def __init__(self, manifest_path: str, pool):
+        self.manifest_path = manifest_path
+        self.pool = pool
+        self.lock_path = Path(manifest_path).with_suffix(".lock.json")
+        self.streaming = Path(manifest_path).suffix == ".jsonl"
+        self.results_path = results_path(manifest_path)
+        self.lock = load_lock(self.lock_path)
+        self.settings = {}
+        self.output_dir = Path(".")
+        # name -> (results key, entry, entry hash), in manifest order
+        self.entries = {}
+        # name -> (results key, record) for results.json
+        self.records = self._previous_records()
+        # name -> (future, entry hash, cancel event, submitted at)
+        self.building = {}
+        # Edited while their build was running; resubmitted once it stops
+        self.waiting = set()
+        self._pack_stale = False
+
+    def _previous_records(self) -> dict:
+        records = {}
+        if self.streaming:
+            for name, record in load_checkpoint(self.results_path).items():
+                records[name] = (record["kind"], {k: v for k, v in record.items()
+                                                  if k not in ("kind", "lock")})
+            return records
+        with contextlib.suppress(OSError, ValueError):
+            previous = json.loads(self.results_path.read_text())
+            for kind in ("images", "audio", "errors"):
+                for record in previous.get(kind, []):
+                    records[record["name"]] = (kind, record)
+        return records
+
+    def sync(self):
+        """Re-read the manifest and build what was added or changed since the last read."""
+        try:
+            settings, entries = open_manifest(self.manifest_path)
+            entries = list(entries)
+            names = [entry["name"] for _, entry in entries]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"  Manifest unreadable, keeping the last good one: {e}", file=sys.stderr)
+            return
+        if not self.building:
+            clear_search_memo()
+        first = not self.entries
+        self.settings = settings
+        self.output_dir = Path(settings.get("output_dir", "."))
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        wanted = {}
+        for (kind, entry), name in zip(entries, names):
+            wanted[name] = (kind, entry, _entry_hash(entry, str(self.output_dir / name)))
+
+        removed = [name for name in self.entries if name not in wanted]
+        added, changed, unchanged = [], [], 0
+        for name, (kind, entry, entry_hash) in wanted.items():
+            if name in self.entries:
+                if self.entries[name][2] != entry_hash:
+                    changed.append(name)
+            elif lock_is_current(self.lock.get(name), entry_hash):
+                unchanged += 1
+                if name not in self.records or self.records[name][0] == "errors":
+                    self.records[name] = (kind, {"name": name, "status": "unchanged",
+                                                 "path": next(iter(self.lock[name]["outputs"]))})
+            else:
+                added.append(name)
+        self.entries = wanted
+        for name in removed:
+            self._cancel(name)
+        for name in [n for n in self.lock if n not in wanted]:
+            del self.lock[name]
+        for name in [n for n in self.records if n not in wanted]:
+            del self.records[name]
+
+        if first:
+            print(f"  {len(wanted)} entries: {unchanged} unchanged, {len(added)} to build")
+        elif added or changed or removed:
+            print(f"  Manifest changed: {len(added)} added, {len(changed)} changed, "
+                  f"{len(removed)} removed")
+        else:
+            print(f"  Manifest saved, no entry changed")
+        for name in added + changed:
+            if self._cancel(name):
+                print(f"  {name}: edited while building, cancelling")
+                self.waiting.add(name)
+            else:
+                self._submit(name)
+        if first or removed or unchanged:
+            self._pack_stale |= first or bool(removed)
+            self.write()
+
+    def _cancel(self, name: str) -> bool:
+        """Stop name's build, if any; True if it is running and has yet to notice."""
+        if name not in self.building:
+            return False
+        future, _, cancel, _ = self.building[name]
+        cancel.set()
+        if future.cancel():
+            del self.building[name]
+            return False
+        return True
+
+    def _submit(self, name: str):
+        kind, entry, entry_hash = self.entries[name]
+        fn = _process_image if kind == "images" else _process_audio
+        cancel = threading.Event()
+        future = self.pool.submit(contextvars.copy_context().run, _build_watched, cancel, fn,
+                                  entry, self.output_dir)
+        self.building[name] = (future, entry_hash, cancel, time.monotonic())
+
+    def collect(self):
+        """Record every finished build; results.json and the lockfile are rewritten per entry."""
+        for name, (future, entry_hash, cancel, submitted) in list(self.building.items()):
+            if not future.done():
+                continue
+            del self.building[name]
+            if cancel.is_set():
+                # Superseded or removed: its outputs will be rewritten, or are no longer wanted
+                if name in self.waiting:
+                    self.waiting.discard(name)
+                    if name in self.entries:
+                        self._submit(name)
+                continue
+            result_kind, record, notes = future.result()
+            record["phases"] = list(notes.get("phases", []))
+            if result_kind == "errors":
+                self.lock.pop(name, None)
+                print(f"  ✗ {name}: {record['error']}")
+            else:
+                paths = [out["path"] for out in record.get("outputs", [])] or [record["path"]]
+                self.lock[name] = lock_entry(entry_hash, notes, paths)
+                self._pack_stale = True
+                print(f"  ✓ {name} ({time.monotonic() - submitted:.1f}s)")
+            self.records[name] = (result_kind, record)
+            self.write()
+        if self._pack_stale and not self.building and self.settings.get("pack"):
+            pack = _pack_locked(self.output_dir, self.settings["pack"], self.lock)
+            self._pack_stale = False
+            print(f"  Pack: {pack['entries']} assets, {pack['written']} written → {pack['path']}")
+
+    def write(self):
+        """Rewrite the results (a checkpoint-style log for a .jsonl manifest) and the lockfile."""
+        results = {"images": [], "audio": [], "errors": []}
+        lines = []
+        for name in self.entries:
+            if name in self.records:
+                result_kind, record = self.records[name]
+                results[result_kind].append(record)
+                lines.append(json.dumps({"kind": result_kind, **record,
+                                         "lock": self.lock.get(name)}) + "\n")
+        tmp = self.results_path.with_suffix(".tmp")
+        tmp.write_text("".join(lines) if self.streaming else json.dumps(results, indent=2))
+        os.replace(tmp, self.results_path)
+        write_lock(self.lock_path, self.lock)
+
+    def stop(self):
+        for _, _, cancel, _ in self.building.values():
+            cancel.set()
+
+
+def watch_manifest(manifest_path: str, jobs: int = 4, limits: dict | None = None):
+    """Rebuild a manifest's entries as they are added or edited, until interrupted.
+
+    The manifest is watched with inotify where available (see
+    ManifestWatcher); a burst of saves is read once, WATCH_DEBOUNCE after
+    the last. Entries whose lockfile record is current are not built at
+    startup. After that, each save is diffed against the entries last read
+    and only added or changed ones are built, up to jobs at a time; an
+    entry edited again while building is cancelled at its next download
+    chunk and built afresh. Removed entries drop out of the lockfile and
+    results. The results (see results_path) and the lockfile are rewritten
+    as each entry finishes, and the pack, if any, once the builds in flight are done.
+    """
+    path = Path(manifest_path)
+    watcher = ManifestWatcher(path)
+    print(f"Watching {path} ({watcher.mechanism}, {jobs} jobs); Ctrl-C to stop")
+    # Generations run side by side on the image pipeline whatever --jobs is
+    configure_images(concurrency=(limits or {}).get("image"))
+    try:
+        with concurrent_pools(jobs, limits) as pool:
+            session = WatchSession(manifest_path, pool)
+            try:
+                session.sync()
+                while True:
+                    if watcher.wait(0.1 if session.building else 1.0):
+                        while watcher.wait(WATCH_DEBOUNCE):
+                            pass
+                        session.sync()
+                    session.collect()
+            except KeyboardInterrupt:
+                print(f"\nStopping; cancelling {len(session.building)} build(s) in flight")
+                session.stop()
+    finally:
+        watcher.close()
+        clear_search_memo()
+
+
+# ---------------------------------------------------------------------------
+# Daemon
+# ---------------------------------------------------------------------------
+
+# Subcommands a thin client hands to a running `serve` daemon
+DAEMON_COMMANDS = ("image", "audio", "search-audio", "list-audio")
+
+# Where the daemon listens ($ASSET_FETCHER_SOCKET)
+SERVE_SOCKET = Path(os.environ.get("ASSET_FETCHER_SOCKET")
+                    or Path(os.environ.get("XDG_RUNTIME_DIR") or "/tmp")
+                    / f"asset_fetcher-{os.getuid()}.sock")
+
+# The client whose job the current thread is running; prints go back to it
+_job_output = contextvars.ContextVar("job_output", default=None)
+
+
+class _JobStream(io.TextIOBase):
+    """Stands in for sys.stdout/sys.stderr in the daemon, routing writes to the job's client."""
+
+    def __init__(self, name: str, fallback):
+        self.name = name
+        self._fallback = fallback
+
+    def write(self, text: str) -> int:
+        send = _job_output.get()
+        if send is None:
+            return self._fallback.write(text)
+        send(self.name, text)
+        return len(text)
+
+    def flush(self):
+        if _job_output.get() is None:
+            self._fallback.flush()
+
+    def isatty(self) -> bool:
+        return False
+
+
+def _run_job(job: dict, send) -> int:
+    """Run one forwarded CLI command with its output sent to the client; returns the exit code."""
+    import argparse
+    import traceback
+
+    token = _job_output.set(send)
+    try:
+        run_command(argparse.Namespace(**job))
+        return 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else int(e.code is not None)
+    except AssetError as e:
+        print(f"  ERROR: {e}", file=sys.stderr)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        _job_output.reset(token)
+        clear_search_memo()
+
+
+def _warm_up():
+    """Load what the first jobs would otherwise pay for."""
+    _session()
+    _search_cache_instance()
+    if OPENAI_KEY_FILE.exists() or os.environ.get("OPENAI_API_KEY"):
+        with contextlib.suppress(ImportError):
+            import openai  # noqa: F401
+            _image_pipeline()
+
+
+def serve(socket_path: Path = SERVE_SOCKET) -> int:
+    """Run jobs for thin clients over a Unix socket until interrupted.
+
+    The HTTP pools, download and search caches and the OpenAI client stay
+    warm between jobs. Each connection carries one job: a JSON line with the
+    parsed CLI arguments. The reply is JSON lines of {"stream", "data"}
+    output, ending with {"exit": code}. Jobs run concurrently.
+    """
+    import signal
+    import socketserver
+
+    socket_path = Path(socket_path)
+    if socket_path.exists():
+        if _daemon_listening(socket_path):
+            print(f"  ERROR: a daemon is already listening on {socket_path}", file=sys.stderr)
+            return 1
+        socket_path.unlink()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.readline() or b"{}")
+            lock = threading.Lock()
+
+            def send(stream, data):
+                line = (json.dumps({"stream": stream, "data": data}) + "\n").encode()
+                with lock, contextlib.suppress(OSError):
+                    self.wfile.write(line)
+
+            # A fresh context per job, so notes and spans don't leak between jobs
+            code = contextvars.Context().run(_run_job, request.get("args", {}), send)
+            with lock, contextlib.suppress(OSError):
+                self.wfile.write((json.dumps({"exit": code}) + "\n").encode())
+
+    sys.stdout = _JobStream("stdout", sys.stdout)
+    sys.stderr = _JobStream("stderr", sys.stderr)
+    configure_downloads(show_progress=False)
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+
+    old_umask = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(str(socket_path), Handler)
+    finally:
+        os.umask(old_umask)
+    server.daemon_threads = True
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Serving {', '.join(DAEMON_COMMANDS)} on {socket_path} (Ctrl-C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
+    return 0
+
+
+def _daemon_listening(socket_path: Path) -> bool:
+    import socket
+    with socket.socket(socket.AF_UNIX) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+def forward_to_daemon(args, socket_path: Path = SERVE_SOCKET) -> int | None:
+    """Run a parsed CLI command on the `serve` daemon, relaying its output.
+
+    Returns the job's exit code, or None if no daemon is listening (the
+    caller then runs the command itself).
+    """
+    import socket
+
+    if not Path(socket_path).exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX)
+    try:
+        sock.connect(str(socket_path))
+    except OSError:
+        sock.close()
+        return None
+
+    job = dict(vars(args))
+    # The daemon has its own working directory
+    if job.get("output"):
+        job["output"] = os.path.abspath(job["output"])
+    with sock, sock.makefile("rwb") as conn:
+        conn.write((json.dumps({"args": job}) + "\n").encode())
+        conn.flush()
+        for line in conn:
+            message = json.loads(line)
+            if "exit" in message:
+                return message["exit"]
+            stream = sys.stdout if message["stream"] == "stdout" else sys.stderr
+            stream.write(message["data"])
+            stream.flush()
+    print("  ERROR: the daemon closed the connection mid-job", file=sys.stderr)
+    return 1
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def cache_command(args):
+    """`cache stats` / `cache prune`."""
+    cache = _cache() or DownloadCache(CACHE_DIR)
+    transcodes = _transcode_cache() or TranscodeCache(CACHE_DIR / "transcodes")
+    if args.cache_command == "prune":
+        max_size = args.max_size * 1024 ** 2 if args.max_size is not None else None
+        removed, freed = cache.prune(max_size)
+        print(f"  Pruned {removed} file(s), freed {freed / 1024 ** 2:.1f} MB")
+        removed, freed = transcodes.prune()
+        print(f"  Pruned {removed} conversion(s), freed {freed / 1024 ** 2:.1f} MB")
+        print(f"  Dropped {_search_cache_instance().prune()} expired search(es)")
+    info = cache.summary()
+    print(f"  Cache: {info['root']}")
+    print(f"  URLs:    {info['urls']}")
+    print(f"  Objects: {info['objects']} ({info['bytes'] / 1024 ** 2:.1f} MB "
+          f"of {info['max_size'] / 1024 ** 2:.0f} MB)")
+    info = transcodes.summary()
+    print(f"  Transcodes: {info['conversions']} ({info['bytes'] / 1024 ** 2:.1f} MB "
+          f"of {info['max_size'] / 1024 ** 2:.0f} MB, {info['cpu_seconds']:.1f} CPU-s to redo)")
+    print(f"  Searches: {len(_search_cache_instance())} cached")
+
+
+def _each_in_processes(fn, paths: list[str], **options):
+    """Run fn(path, **options) for every path, one process per path; exits 1 on failures."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if len(paths) == 1:
+        fn(paths[0], **options)
+        return
+    _numpy()
+    failed = 0
+    workers = min(len(paths), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {path: pool.submit(fn, path, **options) for path in paths}
+        for path, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"  ERROR: {path}: {e}", file=sys.stderr)
+                failed += 1
+    if failed:
+        sys.exit(1)
+
+
+def run_command(args):
+    """Run a parsed subcommand (everything except `serve`)."""
+    if args.command == "image":
+        generate_image(args.prompt, args.output, args.size, args.quality)
+    elif args.command == "audio":
+        download_audio(args.url, args.output, args.format, args.sha256)
+    elif args.command == "search-audio":
+        search_and_download_audio(args.query, args.output, args.format, args.source, args.pick,
+                                  constraints={"max_duration": args.max_duration,
+                                               "max_bytes": args.max_bytes, "mono": args.mono})
+    elif args.command == "list-audio":
+        list_audio(args.query, args.source)
+    elif args.command == "cache":
+        cache_command(args)
+    elif args.command == "pack":
+        pack_command(args)
+    elif args.command == "sprites":
+        _each_in_processes(make_sprite_atlas, args.input, frames=args.frames,
+                           frame_size=args.frame_size, rows=args.rows, scales=args.scales,
+                           padding=args.padding, transparent=not args.keep_background)
+    elif args.command == "quantize":
+        _each_in_processes(quantize_png, args.input, max_delta_e=args.max_delta_e,
+                           max_colors=args.max_colors)
+    elif args.command == "batch":
+        run_batch(args.manifest, max(1, args.jobs), args.limit, args.incremental, args.force,
+                  args.trace, args.resume)
+    elif args.command == "workspace":
+        run_workspace(args.root, max(1, args.jobs), args.limit, args.incremental, args.force,
+                      args.trace, args.resume)
+    elif args.command == "watch":
+        watch_manifest(args.manifest, max(1, args.jobs), args.limit)
+
+
+def _add_build_options(p):
+    """Options `batch` and `workspace` share."""
+    p.add_argument("--jobs", type=int, default=1,
+                   help="Network jobs in flight (default: 1 = serial)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Skip entries unchanged since the last run (see <manifest>.lock.json)")
+    p.add_argument("--force", action="append", metavar="NAME",
+                   help="Rebuild this entry even if unchanged (repeatable, implies --incremental)")
+    p.add_argument("--limit", action="append", metavar="KIND=N",
+                   help="Per-kind concurrency cap: image, search, download, convert (repeatable)")
+    p.add_argument("--resume", action="store_true",
+                   help="Skip entries <manifest>.results.jsonl shows as already built")
+    p.add_argument("--trace", metavar="PATH",
+                   help="Write a Chrome/Perfetto trace of every phase to PATH")
+
+
+def main():
+    import argparse
+
+    # Options that configure the process; a daemon job runs with the daemon's own
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--connect-timeout", type=float, default=10.0,
+                        help="HTTP connect timeout in seconds (default: 10)")
+    common.add_argument("--read-timeout", type=float, default=30.0,
+                        help="HTTP read timeout in seconds (default: 30)")
+    common.add_argument("--chunk-size", type=int, default=DOWNLOAD_CHUNK_SIZE,
+                        help=f"Download buffer size in bytes (default: {DOWNLOAD_CHUNK_SIZE})")
+    common.add_argument("--cache-dir", help=f"Download cache directory (default: {CACHE_DIR})")
+    common.add_argument("--cache-max-size", type=int, metavar="MB",
+                        help="Download cache size cap in MB (default: 2048)")
+    common.add_argument("--transcode-cache-max-size", type=int, metavar="MB",
+                        help="Transcode cache size cap in MB (default: 1024)")
+    common.add_argument("--no-cache", action="store_true",
+                        help="Bypass the download and transcode caches")
+    common.add_argument("--search-ttl", type=float, default=24.0, metavar="HOURS",
+                        help="How long cached search results stay valid (default: 24)")
+    common.add_argument("--refresh", action="store_true",
+                        help="Ignore cached search results and scrape again")
+    common.add_argument("--image-rate", type=float, default=IMAGE_RATE_PER_MINUTE,
+                        metavar="PER_MIN",
+                        help=f"DALL-E requests started per minute (default: {IMAGE_RATE_PER_MINUTE})")
+
+    parser = argparse.ArgumentParser(
+        parents=[common],
+        description="Asset Fetcher — DALL-E 3 images + Pixabay/Freesound audio",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Audio sources (all license-safe for commercial apps):
+  pixabay   — Pixabay License: royalty-free, no attribution, commercial OK
+  freesound — CC0 Public Domain: no restrictions whatsoever
+  all       — search both, pixabay results first
+
+Audio formats:
+  m4a  — AAC compressed, good for ambient loops (small files)
+  caf  — PCM 16-bit uncompressed, good for one-shot SFX (low latency)
+  wav  — PCM 16-bit uncompressed, universal compatibility
+""",
+    )
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="Run here even if a `serve` daemon is listening")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    # image
+    img = sub.add_parser("image", help="Generate a DALL-E 3 image")
+    img.add_argument("--prompt", required=True, help="Image generation prompt")
+    img.add_argument("--output", required=True, help="Output file path (.png)")
+    img.add_argument("--size", default="1792x1024",
+                     choices=["1024x1024", "1024x1792", "1792x1024"],
+                     help="Image dimensions (default: 1792x1024)")
+    img.add_argument("--quality", default="standard", choices=["standard", "hd"],
+                     help="DALL-E quality tier (default: standard)")
+
+    # audio
+    aud = sub.add_parser("audio", help="Download + convert audio from a direct URL")
+    aud.add_argument("--url", required=True, help="Direct audio file URL")
+    aud.add_argument("--output", required=True, help="Output file path")
+    aud.add_argument("--format", help="Target format: m4a, caf, wav (inferred from extension)")
+    aud.add_argument("--sha256", help="Expected SHA-256 of the downloaded file")
+
+    # search-audio
+    sa = sub.add_parser("search-audio", help="Search Pixabay/Freesound and download audio")
+    sa.add_argument("--query", required=True, help="Search query (e.g. 'rain patter loop')")
+    sa.add_argument("--output", required=True, help="Output file path")
+    sa.add_argument("--format", help="Target format: m4a, caf, wav")
+    sa.add_argument("--source", default="pixabay", choices=["pixabay", "freesound", "all"],
+                    help="Where to search (default: pixabay)")
+    sa.add_argument("--pick", type=int, default=0, help="Which result to download (default: 0 = first)")
+    sa.add_argument("--max-duration", type=float, metavar="SECONDS",
+                    help="Probe the top results and take the best one at most this long")
+    sa.add_argument("--max-bytes", type=int, help="Probe the top results for one at most this big")
+    sa.add_argument("--mono", action="store_true", help="Probe the top results for a mono file")
+
+    # list-audio
+    la = sub.add_parser("list-audio", help="List search results without downloading")
+    la.add_argument("--query", required=True, help="Search query")
+    la.add_argument("--source", default="pixabay", choices=["pixabay", "freesound", "all"],
+                    help="Where to search (default: pixabay)")
+
+    # batch
+    bat = sub.add_parser("batch", help="Process a JSON asset manifest")
+    bat.add_argument("--manifest", required=True,
+                     help="Path to manifest JSON file (.jsonl: one entry per line, streamed)")
+    _add_build_options(bat)
+
+    # workspace
+    ws = sub.add_parser("workspace",
+                        help="Build every *_assets.json(l) manifest in the repo in one run")
+    ws.add_argument("--root", default=".",
+                    help="Where to look for manifests; output_dir is relative to it "
+                         "(default: current directory)")
+    _add_build_options(ws)
+
+    # watch
+    wat = sub.add_parser("watch", help="Rebuild a manifest's entries as they are edited")
+    wat.add_argument("--manifest", required=True, help="Path to manifest JSON or JSONL file")
+    wat.add_argument("--jobs", type=int, default=4,
+                     help="Entries built at once (default: 4, so an edit need not queue)")
+    wat.add_argument("--limit", action="append", metavar="KIND=N",
+                     help="Per-kind concurrency cap: image, search, download, convert (repeatable)")
+
+    # sprites
+    spr = sub.add_parser("sprites", help="Slice sprite sheets into packed multi-scale atlases")
+    spr.add_argument("--input", required=True, nargs="+", metavar="PNG",
+                     help="Sprite sheet(s) on a white or transparent background")
+    spr.add_argument("--frames", type=int, help="Expected frame count per sheet")
+    spr.add_argument("--rows", type=int, default=1, help="Rows of frames (default: 1)")
+    spr.add_argument("--frame-size", type=int, default=128, metavar="PT",
+                     help="Largest frame side at @1x (default: 128)")
+    spr.add_argument("--scales", type=int, nargs="+", default=[1, 2, 3],
+                     help="Atlas scales to write (default: 1 2 3)")
+    spr.add_argument("--padding", type=int, default=2, help="Points between frames (default: 2)")
+    spr.add_argument("--keep-background", action="store_true",
+                     help="Keep the white background instead of making it transparent")
+
+    # quantize
+    qnt = sub.add_parser("quantize", help="Shrink PNGs in place to an indexed palette")
+    qnt.add_argument("--input", required=True, nargs="+", metavar="PNG", help="PNG file(s)")
+    qnt.add_argument("--max-delta-e", type=float, default=QUANTIZE_MAX_DELTA_E,
+                     help=f"Mean CIE76 error allowed (default: {QUANTIZE_MAX_DELTA_E})")
+    qnt.add_argument("--max-colors", type=int, default=256, choices=range(2, 257),
+                     metavar="N", help="Largest palette to try (default: 256)")
+
+    # cache
+    cch = sub.add_parser("cache", help="Inspect or prune the download cache")
+    cch_sub = cch.add_subparsers(dest="cache_command", required=True)
+    cch_sub.add_parser("stats", help="Show cache size and entry counts")
+    prn = cch_sub.add_parser("prune", help="Evict least recently used files")
+    prn.add_argument("--max-size", type=int, metavar="MB",
+                     help="Shrink the cache to this size (default: the cache cap)")
+
+    # pack
+    pck = sub.add_parser("pack", help="Inspect or verify an asset pack")
+    pck_sub = pck.add_subparsers(dest="pack_command", required=True)
+    for command, text in (("inspect", "List the assets in a pack"),
+                          ("verify", "Check a pack's index, layout and content hashes")):
+        pck_sub.add_parser(command, help=text).add_argument("pack", help="Pack file")
+
+    # serve
+    srv = sub.add_parser("serve", help="Keep a warm daemon that runs "
+                                       f"{'/'.join(DAEMON_COMMANDS)} for later calls")
+    srv.add_argument("--socket", default=str(SERVE_SOCKET),
+                     help=f"Unix socket to listen on (default: $ASSET_FETCHER_SOCKET or {SERVE_SOCKET})")
+
+    args = parser.parse_args()
+    if args.command in ("batch", "workspace", "watch"):
+        try:
+            args.limit = parse_limits(args.limit)
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+
+    defaults = vars(common.parse_args([]))
+    if (args.command in DAEMON_COMMANDS and not args.no_daemon
+            and all(getattr(args, k) == v for k, v in defaults.items())):
+        code = forward_to_daemon(args)
+        if code is not None:
+            sys.exit(code)
+
+    configure_http(args.connect_timeout, args.read_timeout)
+    configure_cache(not args.no_cache, args.cache_dir, args.cache_max_size,
+                    args.transcode_cache_max_size)
+    configure_search_cache(args.search_ttl * 3600, args.refresh)
+    configure_images(args.image_rate)
+    configure_downloads(args.chunk_size,
+                        show_progress=args.command not in ("batch", "workspace", "watch")
+                        and sys.stdout.isatty())
+
+    if args.command == "serve":
+        sys.exit(serve(args.socket))
+    try:
+        run_command(args)
+    except AssetError as e:
+        print(f"  ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Startup budget for asset_fetcher.
+
+Every CLI call pays for starting Python, compiling tools/asset_fetcher.py
+(a script is never cached, so it stays a thin wrapper) and importing
+asset_fetcher_lib, so heavy dependencies (http.client, ssl, subprocess,
+argparse, openai, ...) are imported where they are used. This check times
+what users run, `python3 tools/asset_fetcher.py list-audio --help` in a
+fresh interpreter, after one warm-up call has cached the module's bytecode
+as a first run would. It fails if the time on top of a bare interpreter
+start goes over the budget, or if one of DEFERRED_MODULES creeps back to
+module level.
+
+Usage:
+    python3 tools/benchmarks/import_budget.py
+    python3 tools/benchmarks/import_budget.py --budget-ms 60 --runs 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+TOOLS_DIR = Path(__file__).resolve().parent.parent
+SCRIPT = TOOLS_DIR / "asset_fetcher.py"
+
+# Only imported when the work that needs them happens
+DEFERRED_MODULES = ("argparse", "asyncio", "http.client", "http.cookiejar", "numpy", "openai",
+                    "socket", "ssl", "subprocess", "tempfile", "urllib.request")
+
+# Milliseconds a CLI call may take on top of `python3 -c pass`
+DEFAULT_BUDGET_MS = 50.0
+
+# The invocation timed: parses every subcommand's options, does no work
+COMMAND = [str(SCRIPT), "list-audio", "--help"]
+
+
+def _env() -> dict:
+    # As a user's shell has it: bytecode for imported modules is cached
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def wall_ms(args: list[str], runs: int) -> float:
+    """Best wall time of running `python3 args...` runs times (ms)."""
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], env=_env(), stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def loaded_deferred_modules() -> list[str]:
+    code = ("import json, sys, asset_fetcher_lib; "
+            f"print(json.dumps([m for m in {list(DEFERRED_MODULES)!r} if m in sys.modules]))")
+    proc = subprocess.run([sys.executable, "-c", code], cwd=TOOLS_DIR, env=_env(),
+                          capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check asset_fetcher's startup budget")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="Fail above this time on top of a bare interpreter "
+                             f"(default: {DEFAULT_BUDGET_MS:.0f})")
+    parser.add_argument("--runs", type=int, default=5, help="Calls to time; the best counts")
+    args = parser.parse_args()
+
+    failed = False
+    loaded = loaded_deferred_modules()
+    if loaded:
+        print(f"FAIL: importing asset_fetcher_lib loads {', '.join(loaded)}")
+        failed = True
+
+    wall_ms(COMMAND, 1)
+    cli = wall_ms(COMMAND, args.runs)
+    bare = wall_ms(["-c", "pass"], args.runs)
+    overhead = cli - bare
+    verdict = "ok" if overhead <= args.budget_ms else "FAIL"
+    print(f"{verdict}: asset_fetcher.py list-audio --help took {cli:.1f} ms, {overhead:.1f} ms "
+          f"over a bare interpreter ({bare:.1f} ms; best of {args.runs}, "
+          f"budget {args.budget_ms:.0f} ms)")
+    failed |= overhead > args.budget_ms
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for asset_fetcher.
+
+Every scenario runs against stub_server.StubServer (recorded Pixabay and
+Freesound pages, synthetic CDN payloads, a fake OpenAI images endpoint), so
+results depend only on this machine and the simulated network settings.
+Each scenario runs in its own subprocess with an empty download/search
+cache so peak RSS and timings are not polluted by earlier scenarios.
+
+Scenarios:
+    batch_weather   run_batch on tools/weather_assets.json
+    batch_1000      run_batch on a synthetic 1,000-entry audio manifest
+    search_parse    search_audio against the stub, plus raw LinkExtractor parsing
+                    next to the old re.findall scan (exits 1 if well below it)
+    convert         convert_with_ffmpeg on a generated WAV (needs ffmpeg)
+
+Images are skipped when the openai package is missing, and audio is kept in
+its source format (no conversion) when ffmpeg is not on PATH.
+
+Usage:
+    python3 tools/benchmarks/run_benchmarks.py
+    python3 tools/benchmarks/run_benchmarks.py --latency-ms 80 --bandwidth-kbps 8000 --jobs 8
+    python3 tools/benchmarks/run_benchmarks.py --output before.json
+    python3 tools/benchmarks/run_benchmarks.py --only batch_1000 --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+TOOLS_DIR = BENCH_DIR.parent
+WEATHER_MANIFEST = TOOLS_DIR / "weather_assets.json"
+
+SCENARIOS = ("batch_weather", "batch_1000", "search_parse", "convert")
+
+# asset_fetcher functions timed as phases (wrapped in the child process)
+PHASES = ("search_audio", "_try_extract_audio_from_page", "download_file", "generate_image",
+          "convert_outputs", "fetch_and_convert", "extract_links")
+
+# Compared metrics where a larger value is an improvement
+HIGHER_IS_BETTER = ("throughput",)
+
+# What the scrapers ran before LinkExtractor: one re.findall per URL kind over
+# the whole decoded page. LinkExtractor streams, but should keep up with it.
+BASELINE_LINK_PATTERNS = (
+    r'https://cdn\.pixabay\.com/audio/\d{4}/[^"\'\\<>\s})]+\.(?:mp3|wav|ogg|m4a)',
+    r'https://cdn\.pixabay\.com/download/audio[^"\'\\<>\s})]+\.(?:mp3|wav|ogg|m4a)',
+    r'https://cdn\.freesound\.org/previews/[^"\'\\<>\s})]+\.(?:mp3|wav|ogg)',
+    r'https://freesound\.org/data/previews/[^"\'\\<>\s})]+\.(?:mp3|wav|ogg)',
+    r'/sound-effects/([\w-]+-\d+)/',
+)
+
+# search_parse fails if LinkExtractor parses slower than this share of the baseline
+MIN_PARSE_RATIO = 0.5
+
+QUERY_WORDS = ("rain", "thunder", "wind", "birds", "splash", "snow", "crunch", "gentle",
+               "storm", "chime", "pop", "whoosh", "morning", "night", "ambient", "puddle")
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered) + 0.5 - 1e-9))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+# ---------------------------------------------------------------------------
+# Child process: run one scenario with phase timers installed
+# ---------------------------------------------------------------------------
+
+def _install_timers(af, samples: dict):
+    """Wrap each PHASES function on the module, appending durations to samples."""
+    import functools
+
+    for name in PHASES:
+        fn = getattr(af, name)
+        durations = samples.setdefault(name, [])
+
+        def timed(*args, _fn=fn, _durations=durations, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _fn(*args, **kwargs)
+            finally:
+                _durations.append(time.perf_counter() - start)
+
+        setattr(af, name, functools.wraps(fn)(timed))
+
+
+def _weather_manifest(output_dir: Path, images: bool, convert: bool) -> dict:
+    manifest = json.loads(WEATHER_MANIFEST.read_text())
+    manifest["output_dir"] = str(output_dir)
+    if not images:
+        manifest["images"] = []
+    if not convert:
+        for aud in manifest["audio"]:
+            aud["name"] = Path(aud["name"]).stem + ".mp3"
+            aud["format"] = "mp3"
+    return manifest
+
+
+def _synthetic_manifest(output_dir: Path, count: int, convert: bool) -> dict:
+    """count audio entries: mostly direct CDN URLs, the rest (partly repeated) searches."""
+    audio = []
+    for i in range(count):
+        fmt = "m4a" if convert and i % 2 else "mp3"
+        name = f"sfx_{i:04d}.{fmt}"
+        if i % 5 < 3:
+            url = f"https://cdn.pixabay.com/audio/2024/03/{i % 28 + 1:02d}/audio_{i:06d}.mp3"
+            audio.append({"name": name, "url": url, "format": fmt})
+        else:
+            words = [QUERY_WORDS[(i * k) % len(QUERY_WORDS)] for k in (1, 3)]
+            source = "freesound" if i % 10 == 4 else "pixabay"
+            audio.append({"name": name, "search": " ".join(words), "source": source,
+                          "format": fmt})
+    return {"output_dir": str(output_dir), "images": [], "audio": audio}
+
+
+def _run_batch_scenario(af, manifest: dict, work: Path, jobs: int) -> dict:
+    manifest_path = work / "manifest.json"
+    manifest_path.write_text(json.dumps(manifest))
+    start = time.perf_counter()
+    af.run_batch(str(manifest_path), jobs=jobs)
+    elapsed = time.perf_counter() - start
+    results = json.loads(manifest_path.with_suffix(".results.json").read_text())
+    done = len(results.get("images", [])) + len(results.get("audio", []))
+    return {"wall_seconds": elapsed, "entries": len(manifest["images"]) + len(manifest["audio"]),
+            "completed": done, "errors": len(results.get("errors", [])),
+            "throughput": done / elapsed if elapsed else 0.0, "throughput_unit": "entries/s"}
+
+
+def _search_parse_scenario(af, work: Path, count: int) -> dict:
+    queries = [f"{QUERY_WORDS[i % len(QUERY_WORDS)]} {QUERY_WORDS[(i * 7 + 3) % len(QUERY_WORDS)]} {i}"
+               for i in range(count)]
+    start = time.perf_counter()
+    found = 0
+    for q in queries:
+        found += len(af.search_audio(q, "all"))
+    elapsed = time.perf_counter() - start
+
+    # Raw parse speed on a recorded page, without the network
+    sys.path.insert(0, str(BENCH_DIR))
+    from stub_server import StubServer
+
+    stub = StubServer(port=0)
+    html = stub.render("pixabay_search", query="rain", query_slug="rain", seed="123456")
+    stub._httpd.server_close()
+    rounds = 50
+    parse_start = time.perf_counter()
+    for _ in range(rounds):
+        extractor = af.LinkExtractor()
+        for i in range(0, len(html), af.DOWNLOAD_CHUNK_SIZE):
+            extractor.feed(html[i:i + af.DOWNLOAD_CHUNK_SIZE])
+        extractor.feed(b"", final=True)
+    parse_elapsed = time.perf_counter() - parse_start
+
+    import re
+    baseline_start = time.perf_counter()
+    for _ in range(rounds):
+        text = html.decode("utf-8", errors="replace")
+        for pattern in BASELINE_LINK_PATTERNS:
+            re.findall(pattern, text)
+    baseline_elapsed = time.perf_counter() - baseline_start
+
+    return {"wall_seconds": elapsed, "entries": count, "completed": count, "errors": 0,
+            "results_found": found, "throughput": count / elapsed if elapsed else 0.0,
+            "throughput_unit": "queries/s",
+            "parse_mb_per_s": rounds * len(html) / parse_elapsed / 1e6 if parse_elapsed else 0.0,
+            "findall_mb_per_s": rounds * len(html) / baseline_elapsed / 1e6}
+
+
+def _convert_scenario(af, work: Path, count: int) -> dict:
+    sys.path.insert(0, str(BENCH_DIR))
+    from stub_server import make_wav
+
+    source = work / "source.wav"
+    source.write_bytes(make_wav(10.0, "4242"))
+    start = time.perf_counter()
+    for i in range(count):
+        af.convert_with_ffmpeg(str(source), str(work / f"out_{i}.m4a"), "m4a")
+    elapsed = time.perf_counter() - start
+    return {"wall_seconds": elapsed, "entries": count, "completed": count, "errors": 0,
+            "throughput": count / elapsed if elapsed else 0.0, "throughput_unit": "converts/s"}
+
+
+def run_child(scenario: str, config: dict) -> dict:
+    """Run one scenario in this process and return its metrics."""
+    import contextlib
+    import resource
+
+    sys.path.insert(0, str(TOOLS_DIR))
+    import asset_fetcher_lib as af
+
+    # Every remote is the stub server (see StubServer.host_overrides)
+    af._http_session = af.HTTPSession(host_overrides=config["host_overrides"])
+    samples = {}
+    _install_timers(af, samples)
+    work = Path(config["work_dir"])
+    output_dir = work / "out"
+    convert = config["ffmpeg"]
+
+    log_path = work / "fetcher.log"
+    with open(log_path, "w") as log, contextlib.redirect_stdout(log), \
+            contextlib.redirect_stderr(log):
+        if scenario == "batch_weather":
+            manifest = _weather_manifest(output_dir, config["openai"], convert)
+            metrics = _run_batch_scenario(af, manifest, work, config["jobs"])
+        elif scenario == "batch_1000":
+            manifest = _synthetic_manifest(output_dir, config["entries"], convert)
+            metrics = _run_batch_scenario(af, manifest, work, config["jobs"])
+        elif scenario == "search_parse":
+            metrics = _search_parse_scenario(af, work, config["queries"])
+        elif scenario == "convert":
+            metrics = _convert_scenario(af, work, config["converts"])
+        else:
+            raise ValueError(f"unknown scenario {scenario!r}")
+
+    metrics["phases"] = {
+        name: {"count": len(values),
+               "p50_ms": percentile(values, 50) * 1000,
+               "p95_ms": percentile(values, 95) * 1000,
+               "total_seconds": sum(values)}
+        for name, values in samples.items() if values
+    }
+    metrics["http"] = af.http_stats()
+    metrics["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return metrics
+
+
+# ---------------------------------------------------------------------------
+# Parent: stub server, subprocesses, reporting
+# ---------------------------------------------------------------------------
+
+def _has_module(name: str) -> bool:
+    import importlib.util
+
+    return importlib.util.find_spec(name) is not None
+
+
+def run_scenario(scenario: str, config: dict, stub) -> dict:
+    """Run scenario in a fresh interpreter with its own cache and output dirs."""
+    if scenario == "convert" and not config["ffmpeg"]:
+        return {"status": "skipped", "reason": "ffmpeg not found on PATH"}
+
+    with tempfile.TemporaryDirectory(prefix=f"bench_{scenario}_") as work:
+        child_config = dict(config, work_dir=work, host_overrides=stub.host_overrides())
+        result_path = Path(work) / "result.json"
+        env = dict(os.environ,
+                   ASSET_FETCHER_CACHE=str(Path(work) / "cache"),
+                   OPENAI_BASE_URL=stub.openai_base_url(),
+                   OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "sk-benchmark"))
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", scenario, json.dumps(child_config),
+             str(result_path)],
+            env=env, capture_output=True, text=True)
+        if proc.returncode != 0 or not result_path.exists():
+            tail = (proc.stderr or proc.stdout).strip().splitlines()[-5:]
+            return {"status": "failed", "reason": "\n".join(tail)}
+        metrics = json.loads(result_path.read_text())
+    metrics["status"] = "ok"
+    return metrics
+
+
+def _parse_regressed(result: dict) -> bool:
+    return result["parse_mb_per_s"] < result["findall_mb_per_s"] * MIN_PARSE_RATIO
+
+
+def print_report(report: dict):
+    for name, result in report["scenarios"].items():
+        print(f"\n{name}")
+        if result["status"] != "ok":
+            print(f"  {result['status'].upper()}: {result['reason']}")
+            continue
+        print(f"  {result['completed']}/{result['entries']} done, {result['errors']} errors "
+              f"in {result['wall_seconds']:.2f}s — {result['throughput']:.1f} "
+              f"{result['throughput_unit']}, peak RSS {result['peak_rss_mb']:.0f} MB")
+        if "parse_mb_per_s" in result:
+            print(f"  LinkExtractor: {result['parse_mb_per_s']:.1f} MB/s "
+                  f"(baseline re.findall: {result['findall_mb_per_s']:.1f} MB/s)"
+                  + ("  FAIL: slower than baseline" if _parse_regressed(result) else ""))
+        http = result["http"]
+        print(f"  HTTP: {http['requests']} requests, {http['connections_opened']} connections "
+              f"opened, {http['connections_reused']} reused")
+        for phase, stats in sorted(result["phases"].items(),
+                                   key=lambda item: -item[1]["total_seconds"]):
+            print(f"    {phase:<30} n={stats['count']:<5} p50 {stats['p50_ms']:8.1f} ms   "
+                  f"p95 {stats['p95_ms']:8.1f} ms")
+
+
+def compare(report: dict, baseline: dict):
+    """Print per-scenario changes against a baseline report."""
+    print(f"\nCompared with baseline ({baseline.get('created', 'unknown date')})")
+    for name, result in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if result["status"] != "ok" or not base or base.get("status") != "ok":
+            continue
+        print(f"  {name}")
+        rows = [("throughput", result["throughput"], base["throughput"]),
+                ("wall_seconds", result["wall_seconds"], base["wall_seconds"]),
+                ("peak_rss_mb", result["peak_rss_mb"], base["peak_rss_mb"])]
+        for phase, stats in result["phases"].items():
+            if phase in base.get("phases", {}):
+                rows.append((f"{phase} p95_ms", stats["p95_ms"], base["phases"][phase]["p95_ms"]))
+        for label, new, old in rows:
+            change = (new - old) / old * 100 if old else 0.0
+            better = change > 0 if label in HIGHER_IS_BETTER else change < 0
+            marker = "" if abs(change) < 5 else (" (better)" if better else " (worse)")
+            print(f"    {label:<38} {old:10.2f} -> {new:10.2f}  {change:+6.1f}%{marker}")
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "--child":
+        metrics = run_child(sys.argv[2], json.loads(sys.argv[3]))
+        Path(sys.argv[4]).write_text(json.dumps(metrics))
+        return 0
+
+    parser = argparse.ArgumentParser(description="Offline asset_fetcher benchmarks")
+    parser.add_argument("--only", nargs="+", choices=SCENARIOS, help="Scenarios to run")
+    parser.add_argument("--jobs", type=int, default=4, help="run_batch --jobs")
+    parser.add_argument("--entries", type=int, default=1000, help="Entries in batch_1000")
+    parser.add_argument("--queries", type=int, default=40, help="Queries in search_parse")
+    parser.add_argument("--converts", type=int, default=10, help="Conversions in convert")
+    parser.add_argument("--latency-ms", type=float, default=30, help="Simulated server latency")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0,
+                        help="Simulated bandwidth per response (0 = unlimited)")
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--compare", help="Baseline report JSON to compare against")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(BENCH_DIR))
+    from stub_server import StubServer
+
+    config = {"jobs": args.jobs, "entries": args.entries, "queries": args.queries,
+              "converts": args.converts, "ffmpeg": shutil.which("ffmpeg") is not None,
+              "openai": _has_module("openai")}
+    if not config["openai"]:
+        print("openai package not installed — image generation is skipped")
+    if not config["ffmpeg"]:
+        print("ffmpeg not found — audio is kept in its source format, convert is skipped")
+
+    stub = StubServer(latency_ms=args.latency_ms, bandwidth_kbps=args.bandwidth_kbps).start()
+    report = {
+        "version": 1,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": dict(config, latency_ms=args.latency_ms, bandwidth_kbps=args.bandwidth_kbps),
+        "scenarios": {},
+    }
+    try:
+        for scenario in args.only or SCENARIOS:
+            print(f"Running {scenario}...", flush=True)
+            report["scenarios"][scenario] = run_scenario(scenario, config, stub)
+    finally:
+        stub.stop()
+
+    print_report(report)
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text()))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"\nReport written to {args.output}")
+    parse = report["scenarios"].get("search_parse", {})
+    return 1 if parse.get("status") == "ok" and _parse_regressed(parse) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
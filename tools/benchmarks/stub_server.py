@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for Pixabay, Freesound, their CDNs and the OpenAI images API.
+
+Serves the recorded pages in fixtures/ (with per-query links filled in),
+synthetic audio/image payloads and a fake /v1/images/generations endpoint,
+with configurable latency and bandwidth. asset_fetcher talks to it through
+an HTTPSession built with host_overrides() and OPENAI_BASE_URL; the
+asset_fetcher CLI has no such hook, so to point a command at the stand-in,
+give it after `--` and it runs here with every remote redirected. Serving
+alone only stands in for the OpenAI API (via OPENAI_BASE_URL).
+
+Usage:
+    python3 tools/benchmarks/stub_server.py --port 8765 --latency-ms 80 --bandwidth-kbps 4000
+    python3 tools/benchmarks/stub_server.py --latency-ms 80 -- \
+        batch --manifest tools/weather_assets.json --jobs 6
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import math
+import os
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+import wave
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+TOOLS_DIR = Path(__file__).resolve().parent.parent
+
+# Hosts asset_fetcher reaches that the stand-in answers for
+STUB_HOSTS = ("pixabay.com", "cdn.pixabay.com", "freesound.org", "cdn.freesound.org")
+
+
+def _seed(text: str) -> str:
+    return str(int(hashlib.sha1(text.encode()).hexdigest()[:8], 16) % 10 ** 6)
+
+
+def make_wav(seconds: float, seed: str, rate: int = 44100) -> bytes:
+    """Mono 16-bit sine tone whose pitch depends on seed."""
+    freq = 220 + int(seed) % 660
+    frames = int(seconds * rate)
+    samples = (int(12000 * math.sin(2 * math.pi * freq * i / rate)) for i in range(frames))
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(struct.pack(f"<{frames}h", *samples))
+    return buf.getvalue()
+
+
+def make_png(width: int, height: int, seed: str) -> bytes:
+    """Flat two-tone RGB PNG, roughly like a pastel illustration."""
+    n = int(seed)
+    a = bytes((200 + n % 55, 180 + n % 75, 220))
+    b = bytes((255, 255, 255))
+    rows = b"".join(b"\x00" + (a * (width // 2) + b * (width - width // 2)) for _ in range(height))
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows, 6))
+            + chunk(b"IEND", b""))
+
+
+class StubServer:
+    """Threaded HTTP server standing in for every remote asset_fetcher uses."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0,
+                 bandwidth_kbps: float = 0, html_kb: int = 300, audio_seconds: float = 2.0,
+                 image_size: int = 256, image_429_every: int = 0):
+        self.latency = latency_ms / 1000
+        self.bandwidth = bandwidth_kbps * 1024 / 8 if bandwidth_kbps else 0
+        self.html_kb = html_kb
+        self.audio_seconds = audio_seconds
+        self.image_size = image_size
+        # Answer every Nth image generation with 429 + retry-after-ms
+        self.image_429_every = image_429_every
+        self.image_requests = 0
+        self.requests = 0
+        self._templates = {p.stem: p.read_text() for p in FIXTURES_DIR.glob("*.html")}
+        self._payloads = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        # Clients dropping idle keep-alive connections is expected, not an error
+        self._httpd.handle_error = lambda request, client_address: None
+        self._thread = None
+
+    @property
+    def address(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"{host}:{port}"
+
+    def host_overrides(self) -> dict:
+        """HTTPSession host_overrides sending every stubbed host here."""
+        return dict.fromkeys(STUB_HOSTS, self.address)
+
+    def openai_base_url(self) -> str:
+        """Value for OPENAI_BASE_URL."""
+        return f"http://{self.address}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    # -- content -----------------------------------------------------------
+
+    def render(self, name: str, **values) -> bytes:
+        html = self._templates[name]
+        filler_unit = '<div class="card"><span class="tag">sound</span><p>placeholder</p></div>\n'
+        half = max(0, self.html_kb * 1024 // 2 - len(html)) // len(filler_unit)
+        values["filler"] = filler_unit * half
+        for key, value in values.items():
+            html = html.replace("{{" + key + "}}", str(value))
+        return html.encode()
+
+    def payload(self, path: str) -> tuple[bytes, str]:
+        with self._lock:
+            if path not in self._payloads:
+                seed = _seed(path)
+                if path.endswith(".png"):
+                    self._payloads[path] = (make_png(self.image_size, self.image_size, seed),
+                                            "image/png")
+                else:
+                    self._payloads[path] = (make_wav(self.audio_seconds, seed), "audio/wav")
+            return self._payloads[path]
+
+    def route(self, host: str, path: str, query: dict) -> tuple[int, bytes, str]:
+        if host == "pixabay.com" and path.startswith("/sound-effects/search/"):
+            q = urllib.parse.unquote_plus(path.split("/")[3])
+            slug = "-".join(q.lower().split())
+            return 200, self.render("pixabay_search", query=q, query_slug=slug, seed=_seed(q)), \
+                "text/html"
+        if host == "pixabay.com" and path.startswith("/sound-effects/"):
+            slug = path.strip("/").split("/")[-1]
+            title = slug.rsplit("-", 1)[0].replace("-", " ").title()
+            return 200, self.render("pixabay_sound_page", slug=slug, title=title,
+                                    seed=_seed(slug)), "text/html"
+        if host == "freesound.org" and path.startswith("/search"):
+            q = query.get("q", [""])[0]
+            seed = _seed(q)
+            return 200, self.render("freesound_search", query=q, seed=seed, folder=seed[:3],
+                                    user=seed[-4:]), "text/html"
+        if path.startswith(("/audio/", "/download/", "/previews/", "/data/previews/", "/images/")):
+            body, ctype = self.payload(path)
+            return 200, body, ctype
+        return 404, b"not found", "text/plain"
+
+    def generate_image(self, request: dict) -> dict:
+        seed = _seed(request.get("prompt", ""))
+        item = {"revised_prompt": request.get("prompt", "")}
+        if request.get("response_format") == "b64_json":
+            body, _ = self.payload(f"/images/{seed}.png")
+            item["b64_json"] = base64.b64encode(body).decode()
+        else:
+            item["url"] = f"http://{self.address}/images/{seed}.png"
+        return {"created": int(time.time()), "data": [item]}
+
+    # -- HTTP --------------------------------------------------------------
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, ctype: str, head: bool = False,
+                      headers: dict | None = None):
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", '"%s"' % hashlib.sha1(body).hexdigest()[:16])
+                self.send_header("Accept-Ranges", "bytes")
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if head:
+                    return
+                step = 16 * 1024
+                for i in range(0, len(body), step):
+                    self.wfile.write(body[i:i + step])
+                    if server.bandwidth:
+                        time.sleep(step / server.bandwidth)
+
+            def _route(self):
+                parts = urllib.parse.urlsplit(self.path)
+                host = (self.headers.get("Host") or "").split(":")[0]
+                return server.route(host, parts.path, urllib.parse.parse_qs(parts.query))
+
+            def do_GET(self):
+                status, body, ctype = self._route()
+                rng = self.headers.get("Range")
+                if status == 200 and rng and rng.startswith("bytes="):
+                    first, _, last = rng[6:].partition("-")
+                    first = int(first)
+                    last = min(int(last), len(body) - 1) if last else len(body) - 1
+                    if first >= len(body):
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{len(body)}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {first}-{last}/{len(body)}")
+                    self.send_header("Content-Type", ctype)
+                    self.send_header("Content-Length", str(last - first + 1))
+                    self.end_headers()
+                    self.wfile.write(body[first:last + 1])
+                    return
+                self._send(status, body, ctype)
+
+            def do_HEAD(self):
+                status, body, ctype = self._route()
+                self._send(status, body, ctype, head=True)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if urllib.parse.urlsplit(self.path).path.endswith("/images/generations"):
+                    with server._lock:
+                        server.image_requests += 1
+                        limited = (server.image_429_every
+                                   and server.image_requests % server.image_429_every == 0)
+                    if limited:
+                        body = b'{"error": {"message": "Rate limit exceeded", "type": "requests"}}'
+                        self._send(429, body, "application/json",
+                                   headers={"retry-after-ms": "200"})
+                        return
+                    body = json.dumps(server.generate_image(request)).encode()
+                    self._send(200, body, "application/json")
+                else:
+                    self._send(404, b'{"error": "not found"}', "application/json")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for asset_fetcher's remotes")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="Port to serve on (a command after -- gets a free one)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay before each response")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0,
+                        help="Throttle response bodies (0 = unlimited)")
+    parser.add_argument("--html-kb", type=int, default=300, help="Size of served HTML pages")
+    parser.add_argument("--image-429-every", type=int, default=0, metavar="N",
+                        help="Rate-limit every Nth image generation (0 = never)")
+    parser.add_argument("command", nargs=argparse.REMAINDER,
+                        help="After --: an asset_fetcher command to run against the stand-in")
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+
+    server = StubServer(port=0 if command else args.port, latency_ms=args.latency_ms,
+                        bandwidth_kbps=args.bandwidth_kbps, html_kb=args.html_kb,
+                        image_429_every=args.image_429_every)
+    if command:
+        return run_command(server, command)
+    print(f"Serving on {server.address}")
+    print(f"  export OPENAI_BASE_URL='{server.openai_base_url()}'")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run_command(server: StubServer, command: list[str]) -> int:
+    """Run an asset_fetcher command in this process with every remote sent to server."""
+    sys.path.insert(0, str(TOOLS_DIR))
+    import asset_fetcher_lib as af
+
+    server.start()
+    af._http_session = af.HTTPSession(host_overrides=server.host_overrides())
+    os.environ["OPENAI_BASE_URL"] = server.openai_base_url()
+    os.environ.setdefault("OPENAI_API_KEY", "sk-stub")
+    # A running daemon would fetch from the real hosts
+    sys.argv = ["asset_fetcher.py", "--no-daemon", *command]
+    try:
+        af.main()
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else int(e.code is not None)
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())